@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connects the signals that keep the ranking, the lesson progress and
+        # the search catalog fresh
+        from api import progress, ranking  # noqa: F401
+        from api.search import catalog  # noqa: F401
@@ -0,0 +1,145 @@
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import jwt
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, CSRFCheck
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Attribute used to memoize the token user on the Django HttpRequest
+REQUEST_USER_ATTR = '_token_user'
+_UNRESOLVED = object()
+
+
+class VerifiedTokenCache:
+    """
+    Small bounded LRU of tokens whose signature was already verified.
+    Hot tokens (the same browser hitting the API many times) skip the
+    HMAC check and JSON decoding. The exp claim is still enforced on
+    every hit, so an expired token never comes back out of the cache.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._payloads = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token):
+        with self._lock:
+            payload = self._payloads.get(token)
+            if payload is None:
+                return None
+            if payload.get('exp') is not None and payload['exp'] <= time.time():
+                del self._payloads[token]
+                return None
+            self._payloads.move_to_end(token)
+            return payload
+
+    def set(self, token, payload):
+        with self._lock:
+            self._payloads[token] = payload
+            self._payloads.move_to_end(token)
+            while len(self._payloads) > self.max_size:
+                self._payloads.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+
+token_cache = VerifiedTokenCache(getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 1024))
+
+
+def get_token_from_request(request):
+    # Only the access token identifies a request, the long-lived refresh
+    # token is only for getting a new one
+    return request.COOKIES.get('access_token')
+
+
+def decode_token(token):
+    """Returns the verified payload of the token or None if it is invalid"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=["HS256"])
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError) as e:
+        logger.error(f"Token error: {e}")
+        return None
+    token_cache.set(token, payload)
+    return payload
+
+
+def load_token_user(token):
+    """
+    Decodes the token and loads its user together with the profile and the
+    teacher (if any) in a single query.
+    """
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    if payload.get('token_type', 'access') != 'access':
+        logger.error("Not an access token")
+        return None
+    user_id = payload.get('user_id')
+    logger.debug(f"Decoded user_id from token: {user_id}")
+    try:
+        return User.objects.select_related('profile', 'teacher').get(id=user_id)
+    except User.DoesNotExist:
+        logger.error("User does not exist")
+        return None
+
+
+def resolve_request_user(request):
+    """
+    Returns the user the request's JWT cookie belongs to. The token is only
+    decoded and the user only loaded once per request, every later call
+    (views, serializers, the DRF authenticator) reuses the result.
+    Accepts both Django's HttpRequest and DRF's Request.
+    """
+    http_request = getattr(request, '_request', request)
+    user = getattr(http_request, REQUEST_USER_ATTR, _UNRESOLVED)
+    if user is _UNRESOLVED:
+        token = get_token_from_request(http_request)
+        if not token:
+            logger.debug("No token found in cookies")
+            user = None
+        else:
+            user = load_token_user(token)
+        setattr(http_request, REQUEST_USER_ATTR, user)
+    return user
+
+
+class CookieJWTAuthentication(BaseAuthentication):
+    """
+    Authenticates DRF requests with the access_token cookie the frontend
+    sends. Invalid or missing tokens are not an error here, the request
+    simply stays anonymous like before. The browser sends the cookie on
+    cross-site requests too, so like SessionAuthentication the unsafe
+    methods need the CSRF token.
+    """
+
+    def authenticate(self, request):
+        user = resolve_request_user(request)
+        if user is None:
+            return None
+        self.enforce_csrf(request)
+        return user, get_token_from_request(request)
+
+    def enforce_csrf(self, request):
+        """The CSRF check of SessionAuthentication, for the cookie's user"""
+        def dummy_get_response(request):
+            return None
+
+        check = CSRFCheck(dummy_get_response)
+        # populates request.META['CSRF_COOKIE'], which is used in process_view()
+        check.process_request(request)
+        reason = check.process_view(request, None, (), {})
+        if reason:
+            raise exceptions.PermissionDenied(f'CSRF Failed: {reason}')
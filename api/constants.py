@@ -30,6 +30,12 @@ class CourseConstants:
         ("Failed", "Failed"),
     )
 
+    MEDIA_STATUS = (
+        ("Processing", "Processing"),
+        ("Ready", "Ready"),
+        ("Failed", "Failed"),
+    )
+
     RATING = (
         (1, "1 Star"),
         (2, "2 Star"),
@@ -0,0 +1,113 @@
+"""
+Sparse fieldsets for the read endpoints.
+
+?fields=title,image,course.title keeps only these fields in the output,
+dotted names reach into nested objects. ?expand=curriculum,category
+expands only these of the serializer's `Meta.expandable` fields: the
+other nested lists are left out and the other nested objects are
+rendered as their primary key. Without the parameters the output is the
+full one.
+
+The same FieldSelection is passed to the querysets (for_serializer), so
+what isn't serialized isn't prefetched either.
+"""
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+def parse_fields(value):
+    """'id,course.title,course.image' -> {'id': {}, 'course': {'title': {}, 'image': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields or None  # {name: subtree}, None is every field
+        self.expand = expand  # set of names, None expands everything
+
+    @classmethod
+    def from_request(cls, request):
+        """None when the request doesn't restrict the output"""
+        if request is None or request.method != 'GET':
+            return None
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        if fields is None and expand is None:
+            return None
+        return cls(
+            fields=parse_fields(fields) if fields is not None else None,
+            expand={name.strip() for name in expand.split(',') if name.strip()} if expand is not None else None,
+        )
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields
+
+    def expands(self, name):
+        return self.expand is None or name in self.expand
+
+    def nested(self, name):
+        """The selection inside a nested field, None when it's the whole field"""
+        subtree = self.fields.get(name) if self.fields else None
+        return FieldSelection(subtree) if subtree else None
+
+    def wants(self, name, *path):
+        """Whether `name` (and then `path` inside it) is serialized as an object"""
+        if not self.includes(name) or not self.expands(name):
+            return False
+        nested = self.nested(name)
+        return not path or nested is None or nested.wants(*path)
+
+    def apply(self, serializer, compiled, copy_field):
+        """
+        The fields of `serializer` for this selection. Only the kept fields
+        are copied from `compiled`, the nested ones get their part of the
+        selection.
+        """
+        expandable = getattr(serializer.Meta, 'expandable', ())
+        unknown = sorted(set(self.fields or ()) - set(compiled))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+        unknown = sorted((self.expand or set()) - set(expandable))
+        if unknown:
+            raise ValidationError({'expand': f"Can't expand: {', '.join(unknown)}"})
+
+        fields = {}
+        for name, field in compiled.items():
+            if not self.includes(name):
+                continue
+            if name in expandable and not self.expands(name):
+                if isinstance(field, serializers.ListSerializer) or not isinstance(field, serializers.BaseSerializer):
+                    continue
+                # A nested object that isn't expanded is rendered as its id
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+                continue
+            field = copy_field(field)
+            nested = self.nested(name)
+            if nested is not None:
+                target = field.child if isinstance(field, serializers.ListSerializer) else field
+                if isinstance(target, serializers.BaseSerializer):
+                    target.selection = nested
+            fields[name] = field
+        return fields
+
+
+class FieldSelectionMixin:
+    """For the generic views: reads ?fields= and ?expand= once per request"""
+
+    @property
+    def field_selection(self):
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = FieldSelection.from_request(getattr(self, 'request', None))
+        return self._field_selection
+
+    def get_serializer(self, *args, **kwargs):
+        if self.field_selection is not None:
+            kwargs.setdefault('selection', self.field_selection)
+        return super().get_serializer(*args, **kwargs)
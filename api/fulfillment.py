@@ -0,0 +1,72 @@
+"""
+Fulfillment of the paid orders: the order is marked Paid, the student is
+enrolled in every course of it and notified, the teachers are notified
+and the revenue rollup is updated, all in one transaction.
+
+The order row is locked (select_for_update) and an OrderFulfillment row,
+one per order, records the provider's payment reference as the
+idempotency key. A repeated or concurrent success callback finds the
+order already fulfilled (or fails on the unique order and rolls back), so
+a student is never enrolled twice. A payment reference already used by
+another order raises ReferenceAlreadyUsed, one payment pays one order.
+The same code runs for Stripe, PayPal and `manage.py replay_fulfillment`.
+"""
+from django.db import IntegrityError, transaction
+
+from api import models as api_models
+from api.revenue import record_paid_items
+
+
+class ReferenceAlreadyUsed(Exception):
+    pass
+
+
+def idempotency_key(provider, reference):
+    return f'{provider}:{reference}'
+
+
+def fulfill_order(order, provider, reference):
+    """
+    Fulfills the order once its payment was confirmed by the provider.
+    Returns True if it was fulfilled now, False if it already was (or
+    isn't waiting for a payment anymore). Raises ReferenceAlreadyUsed if
+    the reference fulfilled another order.
+    """
+    try:
+        with transaction.atomic():
+            order = api_models.CartOrder.objects.select_for_update().get(pk=order.pk)
+            if order.payment_status != 'Processing':
+                return False
+            api_models.OrderFulfillment.objects.create(
+                order=order, provider=provider, idempotency_key=idempotency_key(provider, reference),
+            )
+
+            order.payment_status = 'Paid'
+            order.save(update_fields=['payment_status'])
+
+            order_items = list(api_models.CartOrderItem.objects.filter(order=order).only(
+                'id', 'order_id', 'course_id', 'teacher_id', 'price', 'tax_fee', 'saved', 'date',
+            ))
+            record_paid_items(order_items)
+
+            api_models.Notification.objects.bulk_create([
+                api_models.Notification(user_id=order.student_id, order=order, type='Course Enrollment Completed'),
+            ] + [
+                # One for every teacher of the order
+                api_models.Notification(teacher_id=item.teacher_id, order=order, order_item=item, type='New Order')
+                for item in order_items
+            ])
+            api_models.EnrolledCourse.objects.bulk_create([
+                api_models.EnrolledCourse(course_id=item.course_id, user_id=order.student_id,
+                                          teacher_id=item.teacher_id, order_item=item)
+                for item in order_items
+            ])
+    except IntegrityError:
+        # Another callback fulfilled it in between (no row lock on SQLite)
+        if api_models.OrderFulfillment.objects.filter(order_id=order.pk).exists():
+            return False
+        key = idempotency_key(provider, reference)
+        if api_models.OrderFulfillment.objects.filter(idempotency_key=key).exclude(order_id=order.pk).exists():
+            raise ReferenceAlreadyUsed(f'{key} already fulfilled another order')
+        raise
+    return True
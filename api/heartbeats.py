@@ -0,0 +1,189 @@
+"""
+Write-behind buffer for the video heartbeats of the lectures.
+
+The player reports the watch position every few seconds. A heartbeat only
+replaces the pending one of its (enrollment, lecture) in memory; the
+pending positions are written with one bulk upsert every
+HEARTBEAT_FLUSH_INTERVAL seconds, or as soon as HEARTBEAT_FLUSH_SIZE
+lectures are pending. A lecture whose furthest position passes
+HEARTBEAT_COMPLETE_FRACTION of its duration is marked completed once
+(api/progress.py).
+
+The buffer is per process: a crash loses at most the last interval of
+positions, never a completion that was already flushed.
+"""
+import atexit
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api import models as api_models
+from api.progress import complete_lesson
+
+logger = logging.getLogger(__name__)
+
+LECTURE_CACHE_TIMEOUT = 5 * 60
+
+
+@dataclass
+class Heartbeat:
+    enrollment_id: int
+    variant_item_id: int
+    position: float
+    furthest: float
+    duration: float  # seconds, 0 when unknown
+    date: datetime
+
+
+def watched_lecture(user, enrollment_id, variant_item_id):
+    """
+    (enrollment pk, variant item pk, duration in seconds) of the user's
+    enrollment and one of its course's lectures, by their public ids.
+    None if they don't match. Cached, the player sends the same pair over
+    and over.
+    """
+    key = f'heartbeat-lecture:{user.pk}:{enrollment_id}:{variant_item_id}'
+    lecture = cache.get(key)
+    if lecture is None:
+        enrollment = api_models.EnrolledCourse.objects.filter(
+            user=user, enrollment_id=enrollment_id).values_list('id', 'course_id').first()
+        item = api_models.VariantItem.objects.filter(
+            variant_item_id=variant_item_id).values_list('id', 'variant__course_id', 'duration').first()
+        if enrollment is None or item is None or enrollment[1] != item[1]:
+            lecture = ()
+        else:
+            lecture = (enrollment[0], item[0], item[2].total_seconds() if item[2] else 0)
+        cache.set(key, lecture, LECTURE_CACHE_TIMEOUT)
+    return lecture or None
+
+
+class HeartbeatBuffer:
+
+    def __init__(self):
+        self._pending = {}  # (enrollment id, variant item id) -> Heartbeat
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, enrollment_id, variant_item_id, position, duration=0):
+        key = (enrollment_id, variant_item_id)
+        with self._lock:
+            previous = self._pending.get(key)
+            self._pending[key] = Heartbeat(
+                enrollment_id, variant_item_id, position,
+                max(position, previous.furthest) if previous else position,
+                duration or (previous.duration if previous else 0),
+                timezone.now(),
+            )
+            pending = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='heartbeat-flush')
+                self._thread.start()
+        if pending >= getattr(settings, 'HEARTBEAT_FLUSH_SIZE', 500):
+            self._wake.set()
+
+    def pending(self, enrollment_id):
+        """The unflushed heartbeats of the enrollment, {variant item id: Heartbeat}"""
+        with self._lock:
+            return {item_id: beat for (beat_enrollment_id, item_id), beat in self._pending.items()
+                    if beat_enrollment_id == enrollment_id}
+
+    def flush(self):
+        """Writes the pending heartbeats, returns how many lectures were written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            write_heartbeats(pending.values())
+        except Exception:
+            # Keep them for the next flush. A newer heartbeat keeps its
+            # position, its furthest started over after the swap
+            with self._lock:
+                for key, beat in pending.items():
+                    newer = self._pending.get(key)
+                    if newer is None:
+                        self._pending[key] = beat
+                    else:
+                        newer.furthest = max(newer.furthest, beat.furthest)
+                        newer.duration = newer.duration or beat.duration
+            raise
+        return len(pending)
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, 'HEARTBEAT_FLUSH_INTERVAL', 5))
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing the lecture heartbeats failed")
+            finally:
+                connection.close()
+
+
+def write_heartbeats(heartbeats):
+    """
+    One upsert for all the lectures, keeping the furthest position ever
+    reported, then the lectures that were just watched far enough are
+    marked completed.
+    """
+    heartbeats = list(heartbeats)
+    # Enrollments and lectures deleted since their heartbeat are skipped
+    enrollment_ids = set(api_models.EnrolledCourse.objects.filter(
+        id__in={beat.enrollment_id for beat in heartbeats}).values_list('id', flat=True))
+    item_ids = set(api_models.VariantItem.objects.filter(
+        id__in={beat.variant_item_id for beat in heartbeats}).values_list('id', flat=True))
+    heartbeats = [beat for beat in heartbeats if beat.enrollment_id in enrollment_ids and beat.variant_item_id in item_ids]
+    stored = {
+        (enrollment_id, item_id): (furthest, auto_completed)
+        for enrollment_id, item_id, furthest, auto_completed in api_models.LectureProgress.objects.filter(
+            enrollment_id__in=enrollment_ids, variant_item_id__in=item_ids,
+        ).values_list('enrollment_id', 'variant_item_id', 'furthest', 'auto_completed')
+    }
+    fraction = getattr(settings, 'HEARTBEAT_COMPLETE_FRACTION', 0.9)
+
+    rows, watched = [], []
+    for beat in heartbeats:
+        furthest, auto_completed = stored.get((beat.enrollment_id, beat.variant_item_id), (0, False))
+        furthest = max(furthest, beat.furthest)
+        if not auto_completed and beat.duration and furthest >= fraction * beat.duration:
+            auto_completed = True
+            watched.append(beat)
+        rows.append(api_models.LectureProgress(
+            enrollment_id=beat.enrollment_id, variant_item_id=beat.variant_item_id, position=beat.position,
+            furthest=furthest, auto_completed=auto_completed, date=beat.date,
+        ))
+
+    with transaction.atomic():
+        api_models.LectureProgress.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True, unique_fields=['enrollment', 'variant_item'],
+            update_fields=['position', 'furthest', 'auto_completed', 'date'],
+        )
+        if watched:
+            enrollments = api_models.EnrolledCourse.objects.only('id', 'user_id', 'course_id').in_bulk(
+                {beat.enrollment_id for beat in watched})
+            items = api_models.VariantItem.objects.only('id', 'ordinal').in_bulk(
+                {beat.variant_item_id for beat in watched})
+            for beat in watched:
+                complete_lesson(enrollments[beat.enrollment_id], items[beat.variant_item_id])
+
+
+buffer = HeartbeatBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception("Flushing the lecture heartbeats at exit failed")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import models as api_models
+from api.revenue import rebuild_revenue_rollup
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the TeacherRevenueDaily rollup from the paid order items"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teacher', type=int, help="Only rebuild the rows of this teacher id")
+
+    def handle(self, *args, **options):
+        teacher = None
+        if options['teacher'] is not None:
+            teacher = api_models.Teacher.objects.filter(id=options['teacher']).first()
+            if not teacher:
+                raise CommandError(f"Teacher {options['teacher']} does not exist")
+
+        rows = rebuild_revenue_rollup(teacher)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} revenue rollup rows"))
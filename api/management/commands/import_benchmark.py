@@ -0,0 +1,70 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a gunicorn worker imports before serving its first request
+STARTUP_SCRIPT = (
+    "from django.core.wsgi import get_wsgi_application; "
+    "get_wsgi_application(); "
+    "import django.urls; django.urls.get_resolver().url_patterns"
+)
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure_startup_imports():
+    """
+    Boots Django in a fresh interpreter with -X importtime and returns
+    [(module, self_us, cumulative_us, depth)] in import order.
+    """
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings')}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise CommandError(f"Django failed to start:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ("Reports the import cost of booting a worker (settings, apps, models and URLconf) "
+            "and fails when it exceeds the startup budget")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=getattr(settings, 'STARTUP_IMPORT_BUDGET_MS', 1000),
+                            help="Fail when the total import time exceeds this many milliseconds")
+        parser.add_argument('--top', type=int, default=20, help="Number of modules to list")
+        parser.add_argument('--runs', type=int, default=3, help="Keep the fastest of this many runs")
+
+    def handle(self, *args, **options):
+        runs = [measure_startup_imports() for _ in range(max(options['runs'], 1))]
+        modules = min(runs, key=lambda run: sum(module[1] for module in run))
+        total_ms = sum(module[1] for module in modules) / 1000
+
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        top_level = [module for module in modules if module[3] == 0]
+        for name, self_us, cumulative_us, _ in sorted(top_level, key=lambda m: m[2], reverse=True)[:options['top']]:
+            self.stdout.write(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+        # Packages that should only load on first use
+        loaded = {name.split('.')[0] for name, *_ in modules}
+        eager = [name for name in getattr(settings, 'STARTUP_LAZY_IMPORTS', []) if name in loaded]
+        if eager:
+            self.stdout.write(self.style.WARNING(f"Imported at startup, expected lazily: {', '.join(eager)}"))
+
+        self.stdout.write(f"Total import time: {total_ms:.1f} ms (budget {options['budget_ms']:.0f} ms)")
+        if total_ms > options['budget_ms'] or eager:
+            raise CommandError("Startup import budget exceeded")
+        self.stdout.write(self.style.SUCCESS("Within the startup import budget"))
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import json
+import logging
+import socket
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api import models as api_models
+from api.payments import get_paypal, get_stripe
+
+HOST = '127.0.0.1'
+
+
+class FakePayments(BaseHTTPRequestHandler):
+    """The PayPal and Stripe calls of the payment views, answered after `latency` seconds"""
+    protocol_version = 'HTTP/1.1'
+    latency = 0.1
+    sessions = itertools.count()
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, body, status=200):
+        time.sleep(self.latency)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/v1/oauth2/token':
+            return self.answer({'access_token': 'fake', 'expires_in': 32400})
+        session_id = f'cs_fake_{next(self.sessions)}'
+        self.answer({'id': session_id, 'object': 'checkout.session', 'payment_status': 'unpaid',
+                     'url': f'https://checkout.example.com/{session_id}'})
+
+    def do_GET(self):
+        object_id = self.path.rsplit('/', 1)[1]
+        if self.path.startswith('/v2/checkout/orders/'):
+            # Approved, not captured: the view answers without writing anything
+            return self.answer({'id': object_id, 'status': 'APPROVED'})
+        self.answer({'id': object_id, 'object': 'checkout.session', 'payment_status': 'unpaid'})
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class SyncWorkerServer(WSGIServer):
+    # One request at a time, like a sync gunicorn worker, the others wait
+    request_queue_size = 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def run_load(url, body, requests, concurrency, timeout):
+    """(seconds, latencies of the successful requests, failed requests)"""
+    import httpx
+
+    latencies, failed = [], 0
+    remaining = iter(range(requests))
+
+    async def client_loop(client):
+        nonlocal failed
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=body)
+                ok = response.status_code in (200, 302)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failed += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        return time.perf_counter() - started, latencies, failed
+
+
+class Command(BaseCommand):
+    help = ("Load test of the payment views against a local fake PayPal/Stripe: requests per second and "
+            "latency of one sync WSGI worker (the DRF views) and one ASGI worker (the async views) at "
+            "increasing concurrency. Runs on a throwaway test database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=['checkout', 'paypal'], default='checkout',
+                            help="The Stripe checkout, or the PayPal payment success check")
+        parser.add_argument('--latency', type=float, default=100, help="Fake provider latency in ms")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per run")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        try:
+            import httpx  # noqa: F401
+            import uvicorn
+        except ImportError as e:
+            raise CommandError(f"The load test needs httpx and uvicorn: {e}")
+
+        FakePayments.latency = options['latency'] / 1000
+        fake = ThreadingHTTPServer((HOST, 0), FakePayments)
+        fake.daemon_threads = True
+        threading.Thread(target=fake.serve_forever, daemon=True).start()
+        fake_url = f'http://{HOST}:{fake.server_port}'
+
+        # The request logs of every layer would be most of the work
+        logging.disable(logging.WARNING)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        servers = []
+        try:
+            with override_settings(PAYPAL_API_URL=fake_url, STRIPE_API_URL=fake_url, STRIPE_WEBHOOK_SECRET='',
+                                   ALLOWED_HOSTS=[HOST]):
+                get_paypal.cache_clear()
+                get_stripe.cache_clear()
+                self.run_tests(options, servers, uvicorn)
+        finally:
+            for server in servers:
+                server()
+            fake.shutdown()
+            get_paypal.cache_clear()
+            get_stripe.cache_clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            logging.disable(logging.NOTSET)
+
+    def run_tests(self, options, servers, uvicorn):
+        from django.core.asgi import get_asgi_application
+        from django.core.wsgi import get_wsgi_application
+
+        order = api_models.CartOrder.objects.create(full_name='Load test', email='load@example.com', total=10)
+        if options['endpoint'] == 'checkout':
+            paths = {'WSGI': f'/api/v1/payment/stripe-checkout/{order.oid}/',
+                     'ASGI': f'/api/v1/payment/async/stripe-checkout/{order.oid}/'}
+            body = {}
+        else:
+            paths = {'WSGI': '/api/v1/payment/payment-success/', 'ASGI': '/api/v1/payment/async/payment-success/'}
+            body = {'order_oid': order.oid, 'session_id': 'null', 'paypal_order_id': 'FAKE'}
+        # The order's row is only read and written by the server threads from here
+        connection.close()
+
+        wsgi = make_server(HOST, 0, get_wsgi_application(), server_class=SyncWorkerServer,
+                           handler_class=QuietWSGIRequestHandler)
+        threading.Thread(target=wsgi.serve_forever, daemon=True).start()
+        servers.append(wsgi.shutdown)
+
+        asgi_port = free_port()
+        asgi = uvicorn.Server(uvicorn.Config(get_asgi_application(), host=HOST, port=asgi_port, workers=1,
+                                             lifespan='off', log_level='warning', access_log=False))
+        threading.Thread(target=asgi.run, daemon=True).start()
+        servers.append(lambda: setattr(asgi, 'should_exit', True))
+        while not asgi.started:
+            time.sleep(0.05)
+
+        urls = {'WSGI': f'http://{HOST}:{wsgi.server_port}', 'ASGI': f'http://{HOST}:{asgi_port}'}
+        self.stdout.write(f"{options['endpoint']}, {options['requests']} requests per run, provider latency "
+                          f"{options['latency']:.0f} ms")
+        throughput = {}
+        for concurrency in options['concurrency']:
+            for worker in ('WSGI', 'ASGI'):
+                seconds, latencies, failed = asyncio.run(run_load(
+                    urls[worker] + paths[worker], body, options['requests'], concurrency, options['timeout']))
+                throughput[worker, concurrency] = len(latencies) / seconds
+                if latencies:
+                    p50 = statistics.median(latencies) * 1000
+                    p95 = statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else p50
+                else:
+                    p50 = p95 = 0
+                self.stdout.write(f"{worker} concurrency {concurrency:>4}: {throughput[worker, concurrency]:8.1f} "
+                                  f"req/s   p50 {p50:8.1f} ms   p95 {p95:8.1f} ms   failed {failed}")
+
+        top = max(options['concurrency'])
+        if throughput['WSGI', top]:
+            self.stdout.write(self.style.SUCCESS(
+                f"At concurrency {top} one ASGI worker serves "
+                f"{throughput['ASGI', top] / throughput['WSGI', top]:.1f}x the requests of one sync WSGI worker"))
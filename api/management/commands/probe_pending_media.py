@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api import models as api_models
+from api.media import mark_probe_failed, probe_duration, store_duration
+
+
+class Command(BaseCommand):
+    help = ("Probes the lecture files still marked as Processing, e.g. the ones "
+            "queued by a worker that was restarted before finishing")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help="Also retry the items marked as Failed")
+
+    def handle(self, *args, **options):
+        statuses = ['Processing', 'Failed'] if options['failed'] else ['Processing']
+        items = api_models.VariantItem.objects.filter(media_status__in=statuses).exclude(file='')
+
+        for item in items.iterator():
+            try:
+                duration = probe_duration(item.file.path)
+            except Exception as e:
+                self.stderr.write(f"{item.variant_item_id}: {e}")
+                mark_probe_failed(item.pk, item.file.name)
+                continue
+            store_duration(item.pk, item.file.name, duration)
+            self.stdout.write(f"{item.variant_item_id}: {duration:.1f}s")
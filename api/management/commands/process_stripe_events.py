@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.stripe_events import process_events
+
+
+class Command(BaseCommand):
+    help = ("Handles the Stripe webhook events waiting in the inbox. With --loop it keeps running as the "
+            "event worker")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling the inbox")
+        parser.add_argument('--interval', type=float, default=2, help="Seconds between two polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            handled = process_events()
+            if handled or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Handled {handled} Stripe events"))
+            if not options['loop']:
+                return
+            connection.close()
+            time.sleep(options['interval'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.ranking import refresh_best_courses
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the ranked best courses snapshots (run it periodically, e.g. hourly from cron)"
+
+    def handle(self, *args, **options):
+        scopes = refresh_best_courses()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {scopes} best courses snapshots"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import models as api_models
+
+
+class Command(BaseCommand):
+    help = "Recomputes the rating columns of the courses (sum, count and per-star counts) from the active reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', help="Only repair the course with this course_id")
+
+    def handle(self, *args, **options):
+        courses = api_models.Course.objects.all()
+        if options['course'] is not None:
+            courses = courses.filter(course_id=options['course'])
+            if not courses.exists():
+                raise CommandError(f"Course {options['course']} does not exist")
+
+        fixed = courses.recompute_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Repaired the ratings of {fixed} courses"))
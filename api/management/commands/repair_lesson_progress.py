@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import models as api_models
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the lesson completion bitmaps and counts of the enrollments from the CompletedLesson "
+            "rows, and the lecture counts of the courses")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', help="Only repair the course with this course_id")
+
+    def handle(self, *args, **options):
+        courses = api_models.Course.objects.all()
+        if options['course'] is not None:
+            courses = courses.filter(course_id=options['course'])
+            if not courses.exists():
+                raise CommandError(f"Course {options['course']} does not exist")
+
+        for course in courses.only('id'):
+            lectures = api_models.VariantItem.objects.filter(variant__course=course, ordinal__isnull=False).count()
+            api_models.Course.objects.filter(pk=course.pk).update(lecture_count=lectures)
+
+        fixed = api_models.EnrolledCourse.objects.filter(course__in=courses).rebuild_progress()
+        self.stdout.write(self.style.SUCCESS(f"Repaired the lesson progress of {fixed} enrollments"))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import models as api_models
+from api.fulfillment import ReferenceAlreadyUsed, fulfill_order
+from api.payments import get_stripe
+
+
+class Command(BaseCommand):
+    help = ("Fulfills the orders whose payment success callback never arrived. Orders with a Stripe checkout "
+            "session are only fulfilled if Stripe says the session is paid, the others need --mark-paid")
+
+    def add_arguments(self, parser):
+        parser.add_argument('oids', nargs='*', help="The oids of the orders to replay")
+        parser.add_argument('--pending', action='store_true',
+                            help="Replay every order still Processing that has a Stripe checkout session")
+        parser.add_argument('--mark-paid', action='store_true',
+                            help="Fulfill the given orders without a Stripe session, their payment was "
+                                 "confirmed some other way")
+
+    def handle(self, *args, **options):
+        if not options['oids'] and not options['pending']:
+            raise CommandError("Give the oids of the orders or --pending")
+
+        orders = api_models.CartOrder.objects.filter(payment_status='Processing')
+        if options['oids']:
+            orders = orders.filter(oid__in=options['oids'])
+            missing = set(options['oids']) - set(orders.values_list('oid', flat=True))
+            if missing:
+                self.stderr.write(f"Not waiting for a payment: {', '.join(sorted(missing))}")
+        else:
+            orders = orders.exclude(stripe_session_id__isnull=True).exclude(stripe_session_id='')
+
+        fulfilled = 0
+        for order in orders:
+            if order.stripe_session_id:
+                session = get_stripe().checkout.Session.retrieve(order.stripe_session_id)
+                if session.payment_status != 'paid':
+                    self.stdout.write(f"{order.oid}: Stripe session not paid ({session.payment_status})")
+                    continue
+                provider, reference = 'stripe', order.stripe_session_id
+            elif options['mark_paid']:
+                provider, reference = 'replay', order.oid
+            else:
+                self.stdout.write(f"{order.oid}: no Stripe session, use --mark-paid to fulfill it")
+                continue
+            try:
+                done = fulfill_order(order, provider, reference)
+            except ReferenceAlreadyUsed as e:
+                self.stderr.write(f"{order.oid}: {e}")
+                continue
+            fulfilled += done
+            self.stdout.write(f"{order.oid}: {'fulfilled' if done else 'already fulfilled'}")
+
+        self.stdout.write(self.style.SUCCESS(f"Fulfilled {fulfilled} orders"))
@@ -0,0 +1,107 @@
+import random
+import sqlite3
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.search.bm25 import InvertedIndex
+from api.search.text import terms
+from api.search.trigram import WordSimilarityIndex
+
+TOPICS = """python django javascript react angular vue typescript java kotlin swift flutter docker kubernetes
+linux postgresql mongodb redis graphql machine learning data science statistics excel photoshop illustrator
+figma marketing copywriting guitar piano photography spanish italian english accounting finance blockchain
+security networking aws azure unity unreal blender animation drawing cooking yoga""".split()
+MODIFIERS = """complete beginners advanced practical modern masterclass bootcamp fundamentals crash course
+guide introduction professional essential ultimate hands projects zero hero mastery design development
+programming analysis automation testing deployment architecture patterns""".split()
+SYLLABLES = 'ba be bi bo bu ca co da de di do fa fe ga go ka ke la le li lo ma me mi mo na ne no ra re ri ro sa se ta te to va ve za'.split()
+
+
+def make_titles(count, rng):
+    # Real catalogs have a long tail of rare words, names and brands
+    rare = [''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(count // 20 or 1)]
+    titles = []
+    for _ in range(count):
+        title = rng.sample(MODIFIERS, 2) + rng.sample(TOPICS, 2) + [rng.choice(rare)]
+        rng.shuffle(title)
+        titles.append(' '.join(title).capitalize())
+    return titles
+
+
+def misspell(word, rng):
+    if len(word) < 4:
+        return word
+    position = rng.randrange(1, len(word) - 1)
+    typo = rng.choice(('swap', 'drop', 'double'))
+    if typo == 'swap':
+        return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    if typo == 'drop':
+        return word[:position] + word[position + 1:]
+    return word[:position] + word[position] + word[position:]
+
+
+class Command(BaseCommand):
+    help = ("Compares `icontains` (LIKE '%q%' on SQLite) with the in-memory trigram indexes of the fuzzy "
+            "search, on synthetic course titles: latency, and recall on misspelled queries")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--threshold', type=float, default=getattr(settings, 'SEARCH_FUZZY_THRESHOLD', 0.25))
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        threshold = options['threshold']
+        titles = make_titles(options['rows'], rng)
+
+        db = sqlite3.connect(':memory:')
+        db.execute('CREATE TABLE course (id INTEGER PRIMARY KEY, title TEXT)')
+        db.executemany('INSERT INTO course VALUES (?, ?)', enumerate(titles))
+
+        started = time.perf_counter()
+        index = InvertedIndex({'title': 1.0})
+        for course_id, title in enumerate(titles):
+            index.add(course_id, {'title': title})
+        words = WordSimilarityIndex(index.postings)
+        words.add_terms(index.postings)
+        build_seconds = time.perf_counter() - started
+
+        def trigram_search(query):
+            return InvertedIndex.top(words.scores(terms(query), threshold), 20)
+
+        def icontains(query):
+            # What Course.objects.filter(title__icontains=query) runs on SQLite
+            return [row[0] for row in db.execute(r"SELECT id FROM course WHERE title LIKE ? ESCAPE '\'", (f'%{query}%',))]
+
+        # Two adjacent words of a random title, one of them its rare word,
+        # as typed and misspelled
+        common = set(TOPICS) | set(MODIFIERS)
+        samples = []
+        for _ in range(options['queries']):
+            course_id = rng.randrange(len(titles))
+            title_words = titles[course_id].lower().split()
+            rare = next(i for i, word in enumerate(title_words) if word not in common)
+            start = rare - 1 if rare == len(title_words) - 1 or rare and rng.random() < 0.5 else rare
+            query_words = title_words[start:start + 2]
+            samples.append((course_id, ' '.join(query_words), ' '.join(misspell(w, rng) for w in query_words)))
+
+        self.stdout.write(f"{len(titles)} titles, trigram indexes built in {build_seconds:.1f}s")
+        self.stdout.write(f"{'':<22}{'mean ms':>9}{'p95 ms':>9}{'recall':>8}")
+        for label, search, column in (
+            ('icontains, exact', icontains, 1),
+            ('trigram, exact', trigram_search, 1),
+            ('icontains, typo', icontains, 2),
+            ('trigram, typo', trigram_search, 2),
+        ):
+            timings, found = [], 0
+            for sample in samples:
+                started = time.perf_counter()
+                results = search(sample[column])
+                timings.append((time.perf_counter() - started) * 1000)
+                found += sample[0] in results
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            self.stdout.write(f"{label:<22}{statistics.mean(timings):>9.2f}{p95:>9.2f}{found / len(samples):>8.0%}")
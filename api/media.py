@@ -0,0 +1,167 @@
+"""
+Background probing of uploaded lecture files.
+
+VariantItem.save() only marks the item as "Processing" and queues the file
+here. The duration is read in a process pool (so a slow probe never blocks
+a request thread) and then written to VariantItem.duration and
+content_duration. Failed probes are retried with an exponential backoff.
+
+This module is imported by the pool's worker processes, so it must not
+import Django models at module level.
+"""
+import logging
+import math
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+from multiprocessing import get_context
+
+logger = logging.getLogger(__name__)
+
+# Boxes that contain other boxes on the way to moov/mvhd
+MP4_CONTAINER_BOXES = {b'moov'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# ---------- Probing (runs in the worker processes) ----------
+
+def _read_box_header(f):
+    header = f.read(8)
+    if len(header) < 8:
+        return None, None, None
+    size, box_type = struct.unpack('>I4s', header)
+    header_size = 8
+    if size == 1:
+        size = struct.unpack('>Q', f.read(8))[0]
+        header_size = 16
+    return box_type, size, header_size
+
+
+def mp4_duration(path):
+    """
+    Reads the duration from the mvhd box of an MP4/MOV file. Only box
+    headers are read, the media data is skipped with seek(), so the cost
+    doesn't depend on the size of the file. Returns None if the file is
+    not an MP4 container.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        end = f.tell()
+        f.seek(0)
+        while f.tell() < end:
+            start = f.tell()
+            box_type, size, header_size = _read_box_header(f)
+            if box_type is None:
+                return None
+            if size == 0:
+                size = end - start
+            if size < header_size:
+                return None
+            if box_type in MP4_CONTAINER_BOXES:
+                # Walk the children of moov
+                end = start + size
+                continue
+            if box_type == b'mvhd':
+                version = f.read(4)[0]
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+                else:
+                    _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+                return duration / timescale if timescale else None
+            f.seek(start + size)
+    return None
+
+
+def ffmpeg_duration(path):
+    """Fallback for other containers, ffmpeg only parses the header info"""
+    from moviepy.editor import VideoFileClip
+
+    with VideoFileClip(path, audio=False) as clip:
+        return clip.duration
+
+
+def probe_duration(path):
+    """Duration of the media file in seconds"""
+    try:
+        duration = mp4_duration(path)
+    except (OSError, struct.error, IndexError):
+        duration = None
+    if duration is None:
+        duration = ffmpeg_duration(path)
+    return duration
+
+
+def format_content_duration(duration_seconds):
+    minutes, remainder = divmod(duration_seconds, 60)
+
+    minutes = math.floor(minutes)
+    seconds = math.floor(remainder)
+
+    return f"{minutes}m {seconds}s"
+
+
+# ---------- Queueing (runs in the web process) ----------
+
+def get_executor():
+    global _executor
+    from django.conf import settings
+
+    with _executor_lock:
+        if _executor is None:
+            # spawn: never fork a process that is running request threads
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'MEDIA_PROBE_WORKERS', 2),
+                mp_context=get_context('spawn'),
+            )
+        return _executor
+
+
+def enqueue_probe(item_id, path, file_name, attempt=0):
+    future = get_executor().submit(probe_duration, path)
+    future.add_done_callback(partial(_on_probe_done, item_id, path, file_name, attempt))
+
+
+def _on_probe_done(item_id, path, file_name, attempt, future):
+    from django.conf import settings
+    from django.db import connection
+
+    try:
+        try:
+            duration = future.result()
+        except Exception as e:
+            max_retries = getattr(settings, 'MEDIA_PROBE_MAX_RETRIES', 3)
+            if attempt < max_retries:
+                delay = getattr(settings, 'MEDIA_PROBE_RETRY_DELAY', 5) * 2 ** attempt
+                logger.warning(f"Probing {path} failed ({e}), retrying in {delay}s")
+                timer = threading.Timer(delay, enqueue_probe, args=(item_id, path, file_name, attempt + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                logger.error(f"Probing {path} failed after {attempt + 1} attempts: {e}")
+                mark_probe_failed(item_id, file_name)
+            return
+        store_duration(item_id, file_name, duration)
+    finally:
+        # Callbacks run on the pool's management thread, not in a request
+        connection.close()
+
+
+def store_duration(item_id, file_name, duration_seconds):
+    """Saves the probe result, unless the item got another file meanwhile"""
+    from api.models import VariantItem
+
+    VariantItem.objects.filter(pk=item_id, file=file_name).update(
+        duration=timedelta(seconds=duration_seconds),
+        content_duration=format_content_duration(duration_seconds),
+        media_status='Ready',
+    )
+
+
+def mark_probe_failed(item_id, file_name):
+    from api.models import VariantItem
+
+    VariantItem.objects.filter(pk=item_id, file=file_name).update(media_status='Failed')
@@ -0,0 +1,54 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.utils.functional import SimpleLazyObject
+
+from api.authentication import resolve_request_user
+
+
+def get_request_user(request, session_user):
+    # A logged in session (the admin) keeps its own user, the JWT cookie the
+    # browser also carries only stands in for an anonymous one
+    if session_user.is_authenticated:
+        return session_user
+    return resolve_request_user(request) or session_user
+
+
+class TokenUserMiddleware:
+    """
+    Makes request.user the user of the JWT cookie when the session has no
+    user. It is resolved lazily, on first access, and only once per request
+    (api/authentication.py), so requests that never look at the user (static
+    files, health checks) don't decode the token or query the database. The
+    user's teacher and profile come with it, see get_teacher_from_request
+    and get_profile_from_request. Must be placed after
+    AuthenticationMiddleware.
+
+    Sync and async, under ASGI the async views (api/views/payment_async_views.py)
+    don't hold a thread while they wait. request.auser() resolves the same
+    user from async code.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.set_user(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.set_user(request)
+        return await self.get_response(request)
+
+    def set_user(self, request):
+        session_user, session_auser = request.user, request.auser
+
+        async def auser():
+            return await sync_to_async(get_request_user)(request, await session_auser())
+
+        request.user = SimpleLazyObject(lambda: get_request_user(request, session_user))
+        request.auser = auser
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-17 22:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_alter_notification_type_alter_variantitem_file'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrolledcourse',
+            index=models.Index(fields=['teacher', 'date', 'user'], name='enrolled_teacher_date_user'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0 on 2026-10-17 22:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_enrolledcourse_teacher_date_user_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeacherRevenueDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('sales_count', models.PositiveIntegerField(default=0)),
+                ('tax', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('discounts', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='api.course')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='api.teacher')),
+            ],
+            options={
+                'verbose_name_plural': 'Teacher revenue daily',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='teacherrevenuedaily',
+            constraint=models.UniqueConstraint(fields=('teacher', 'day', 'course'), name='unique_teacher_day_course_revenue'),
+        ),
+    ]
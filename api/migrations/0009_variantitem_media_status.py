@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_teacherrevenuedaily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variantitem',
+            name='media_status',
+            field=models.CharField(choices=[('Processing', 'Processing'), ('Ready', 'Ready'), ('Failed', 'Failed')], default='Ready', max_length=100),
+        ),
+    ]
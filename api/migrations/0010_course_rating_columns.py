@@ -0,0 +1,68 @@
+# Generated by Django 5.0 on 2026-10-17 22:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_rating_columns(apps, schema_editor):
+    Course = apps.get_model('api', 'Course')
+    Review = apps.get_model('api', 'Review')
+
+    courses = {}
+    rows = Review.objects.filter(active=True).values('course_id', 'rating').annotate(count=Count('id')).order_by()
+    for row in rows:
+        if row['rating'] not in (1, 2, 3, 4, 5):
+            continue
+        course = courses.setdefault(row['course_id'], Course(id=row['course_id']))
+        setattr(course, f"rating_{row['rating']}_count", row['count'])
+        course.rating_count += row['count']
+        course.rating_sum += row['rating'] * row['count']
+
+    fields = ['rating_sum', 'rating_count'] + [f'rating_{star}_count' for star in (1, 2, 3, 4, 5)]
+    Course.objects.bulk_update(courses.values(), fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_variantitem_media_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-17 22:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_course_rating_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestCoursesSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=200, unique=True)),
+                ('course_ids', models.JSONField(default=list)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
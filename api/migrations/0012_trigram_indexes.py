@@ -0,0 +1,36 @@
+# Trigram indexes for the fuzzy search (api/search/fuzzy.py), PostgreSQL only.
+# Other databases use the in-memory trigram indexes of the search catalog.
+
+from django.db import migrations
+
+TRIGRAM_INDEXES = [
+    ('api_course_title_trgm', 'api_course', 'title'),
+    ('api_course_description_trgm', 'api_course', 'description'),
+    ('api_questionanswer_title_trgm', 'api_questionanswer', 'title'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_bestcoursessnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0 on 2026-10-17 23:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_trigram_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['cart_id', 'date', 'id'], name='cart_cart_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='cartorderitem',
+            index=models.Index(fields=['teacher', 'date', 'id'], name='cartorderitem_teacher_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['teacher', 'date', 'id'], name='coupon_teacher_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['teacher', 'date', 'id'], name='course_teacher_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['platform_status', 'teacher_course_status', 'date', 'id'], name='course_status_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='enrolledcourse',
+            index=models.Index(fields=['user', 'date', 'id'], name='enrolled_user_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', 'course', 'date', 'id'], name='note_user_course_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['teacher', 'date', 'id'], name='notification_teacher_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='questionanswer',
+            index=models.Index(fields=['course', 'date', 'id'], name='questionanswer_course_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['course', 'date', 'id'], name='review_course_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='wishlist',
+            index=models.Index(fields=['user', 'id'], name='wishlist_user_id'),
+        ),
+    ]
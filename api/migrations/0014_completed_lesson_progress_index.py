@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-17 23:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_list_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='completedlesson',
+            index=models.Index(fields=['user', 'course', 'date'], name='completedlesson_user_course'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.0 on 2026-10-17 23:12
+
+from django.db import migrations, models
+
+
+def fill_lesson_bitmaps(apps, schema_editor):
+    Course = apps.get_model('api', 'Course')
+    VariantItem = apps.get_model('api', 'VariantItem')
+    EnrolledCourse = apps.get_model('api', 'EnrolledCourse')
+    CompletedLesson = apps.get_model('api', 'CompletedLesson')
+
+    # The lectures of a course numbered in creation order
+    ordinals = {}
+    item_courses = {}
+    courses = {}
+    items = []
+    for item_id, course_id in VariantItem.objects.order_by('id').values_list('id', 'variant__course_id'):
+        item_courses[item_id] = course_id
+        course = courses.setdefault(course_id, Course(id=course_id))
+        ordinals[item_id] = course.lecture_ordinals
+        items.append(VariantItem(id=item_id, ordinal=course.lecture_ordinals))
+        course.lecture_ordinals += 1
+        course.lecture_count += 1
+    VariantItem.objects.bulk_update(items, ['ordinal'], batch_size=500)
+    Course.objects.bulk_update(courses.values(), ['lecture_count', 'lecture_ordinals'], batch_size=500)
+
+    bitmaps = {}
+    for user_id, course_id, item_id in CompletedLesson.objects.values_list('user_id', 'course_id', 'variant_item_id'):
+        # A lecture of another course, its ordinal isn't a bit of this one
+        if item_courses.get(item_id) != course_id:
+            continue
+        bitmaps[user_id, course_id] = bitmaps.get((user_id, course_id), 0) | 1 << ordinals[item_id]
+    enrollments = []
+    for enrollment_id, user_id, course_id in EnrolledCourse.objects.values_list('id', 'user_id', 'course_id'):
+        value = bitmaps.get((user_id, course_id), 0)
+        if value:
+            enrollments.append(EnrolledCourse(id=enrollment_id, completed_count=value.bit_count(),
+                                              lesson_bitmap=value.to_bytes((value.bit_length() + 7) // 8, 'little')))
+    EnrolledCourse.objects.bulk_update(enrollments, ['lesson_bitmap', 'completed_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_completed_lesson_progress_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lecture_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='lecture_ordinals',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrolledcourse',
+            name='completed_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrolledcourse',
+            name='lesson_bitmap',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='variantitem',
+            name='ordinal',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_lesson_bitmaps, migrations.RunPython.noop),
+    ]
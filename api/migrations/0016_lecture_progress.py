@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-17 23:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_lesson_bitmaps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LectureProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.FloatField(default=0)),
+                ('furthest', models.FloatField(default=0)),
+                ('auto_completed', models.BooleanField(default=False)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('enrollment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.enrolledcourse')),
+                ('variant_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.variantitem')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='lectureprogress',
+            constraint=models.UniqueConstraint(fields=('enrollment', 'variant_item'), name='lectureprogress_enrollment_item'),
+        ),
+    ]
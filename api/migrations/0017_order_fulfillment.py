@@ -0,0 +1,25 @@
+# Generated by Django 5.0 on 2026-10-17 23:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_lecture_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderFulfillment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('idempotency_key', models.CharField(max_length=255, unique=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fulfillment', to='api.cartorder')),
+            ],
+        ),
+    ]
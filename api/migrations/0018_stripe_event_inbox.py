@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-17 23:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_order_fulfillment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('type', models.CharField(max_length=100)),
+                ('object_id', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('payload', models.TextField()),
+                ('received', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed__isnull', True)), fields=['received'], name='stripeevent_pending')],
+            },
+        ),
+    ]
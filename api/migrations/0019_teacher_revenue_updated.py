@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-17 23:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_stripe_event_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teacherrevenuedaily',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='teacherrevenuedaily',
+            index=models.Index(fields=['teacher', 'updated'], name='teacherrevenue_teacher_updated'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-17 23:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_review_teachers(apps, schema_editor):
+    Course = apps.get_model('api', 'Course')
+    Review = apps.get_model('api', 'Review')
+    Review.objects.update(teacher_id=Subquery(Course.objects.filter(pk=OuterRef('course_id')).values('teacher_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_teacher_revenue_updated'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='teacher',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='course_reviews', to='api.teacher'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['teacher', 'date', 'id'], name='review_teacher_date_id'),
+        ),
+        migrations.RunPython(fill_review_teachers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-18 00:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_question_teachers(apps, schema_editor):
+    Course = apps.get_model('api', 'Course')
+    QuestionAnswer = apps.get_model('api', 'QuestionAnswer')
+    QuestionAnswer.objects.update(
+        teacher_id=Subquery(Course.objects.filter(pk=OuterRef('course_id')).values('teacher_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_review_teacher'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionanswer',
+            name='teacher',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='course_questions', to='api.teacher'),
+        ),
+        migrations.AddIndex(
+            model_name='questionanswer',
+            index=models.Index(fields=['teacher', 'date', 'id'], name='questionanswer_teacher_date_id'),
+        ),
+        migrations.RunPython(fill_question_teachers, migrations.RunPython.noop),
+    ]
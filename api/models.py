@@ -1,14 +1,25 @@
 import random
 import string
+from decimal import Decimal
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
 from userauths.models import User, Profile
 from django.utils.text import slugify
 from .constants import CourseConstants
 from shortuuid.django_fields import ShortUUIDField
 from django.utils import timezone
-from moviepy.editor import VideoFileClip
-import math
+from .media import enqueue_probe
+
+
+def user_profile(user):
+    """Returns the user's profile through the one-to-one cache, so rows loaded
+    with select_related('user__profile') don't run an extra query."""
+    if user is None:
+        raise Profile.DoesNotExist
+    return user.profile
 
 
 def generate_unique_slug(title):
@@ -63,6 +74,129 @@ class Category(models.Model):
         super(Category, self).save()
 
 
+def is_prefetched(instance, relation):
+    """True when ``relation`` was loaded through prefetch_related on ``instance``."""
+    return relation in getattr(instance, '_prefetched_objects_cache', {})
+
+
+def user_m2m_lookups(prefix):
+    """Nested users are serialized with their groups and permissions."""
+    return f'{prefix}__groups', f'{prefix}__user_permissions'
+
+
+class CourseQuerySet(models.QuerySet):
+
+    def for_serializer(self, selection=None):
+        """Loads everything CourseSerializer walks (at depth 3) in a fixed
+        number of queries, no matter how many courses are in the page.
+        The Course/EnrolledCourse methods read these caches instead of
+        querying again. With a FieldSelection (api/fieldsets.py) only
+        what it serializes is loaded."""
+        wants = selection.wants if selection is not None else (lambda *path: True)
+        queryset = self
+        if wants('category'):
+            queryset = queryset.select_related('category')
+        if wants('teacher'):
+            queryset = queryset.select_related('teacher__user').prefetch_related(*user_m2m_lookups('teacher__user'))
+        if any(wants(*path) for path in (('curriculum',), ('lectures',), ('students', 'curriculum'),
+                                          ('students', 'lectures'))):
+            queryset = queryset.prefetch_related(
+                Prefetch('variant_set', queryset=Variant.objects.prefetch_related('variant_items')),
+            )
+        reviews = Review.objects.select_related('user__profile').prefetch_related(*user_m2m_lookups('user'))
+        if wants('reviews'):
+            queryset = queryset.prefetch_related(
+                Prefetch('review_set', queryset=reviews.filter(active=True), to_attr='active_reviews'),
+            )
+        if not wants('students'):
+            return queryset
+
+        enrollments = EnrolledCourse.objects.select_related(
+            'user', 'teacher__user', 'order_item__course__category', 'order_item__course__teacher',
+            'order_item__order__student', 'order_item__teacher__user',
+        ).prefetch_related(
+            *user_m2m_lookups('user'), *user_m2m_lookups('teacher__user'),
+            *user_m2m_lookups('order_item__order__student'), *user_m2m_lookups('order_item__teacher__user'),
+            'order_item__coupons__used_by', 'order_item__order__teachers', 'order_item__order__coupons',
+        )
+        queryset = queryset.prefetch_related(Prefetch('enrolledcourse_set', queryset=enrollments))
+        # The per-student lists are filtered in memory from these
+        if wants('students', 'review'):
+            queryset = queryset.prefetch_related(Prefetch('review_set', queryset=reviews, to_attr='all_reviews'))
+        if wants('students', 'completed_lesson'):
+            completed_lessons = CompletedLesson.objects.select_related(
+                'user', 'variant_item__variant__course',
+            ).prefetch_related(*user_m2m_lookups('user'))
+            queryset = queryset.prefetch_related(
+                Prefetch('completedlesson_set', queryset=completed_lessons, to_attr='all_completed_lessons'),
+            )
+        if wants('students', 'note'):
+            queryset = queryset.prefetch_related(
+                Prefetch('note_set', queryset=Note.objects.select_related('user'), to_attr='all_notes'),
+            )
+        if wants('students', 'question_answer'):
+            messages = QuestionAnswerMessage.objects.select_related('user__profile')
+            questions = QuestionAnswer.objects.select_related('user__profile').prefetch_related(
+                Prefetch('questionanswermessage_set', queryset=messages),
+            )
+            queryset = queryset.prefetch_related(Prefetch('questionanswer_set', queryset=questions))
+        return queryset
+
+    def for_public_detail(self):
+        """What CoursePublicDetailSerializer needs: the outline, the teacher
+        card and the enrollment count, in 4 queries. Nothing here grows with
+        the number of enrollments or reviews."""
+        published = Q(course__platform_status='Published', course__teacher_course_status='Published')
+        teachers = Teacher.objects.annotate(
+            published_courses=Count('course', filter=published, distinct=True),
+            total_students=Count('course__enrolledcourse__user', filter=published, distinct=True),
+        )
+        enrollments = EnrolledCourse.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+            count=Count('id')
+        ).values('count')
+        return self.select_related('category').annotate(
+            enrollment_count=Coalesce(Subquery(enrollments), 0),
+        ).prefetch_related(
+            Prefetch('teacher', queryset=teachers),
+            Prefetch('variant_set', queryset=Variant.objects.order_by('id').prefetch_related(
+                Prefetch('variant_items', queryset=VariantItem.objects.order_by('id'))
+            )),
+        )
+
+    def recompute_ratings(self):
+        """Recomputes the rating columns of these courses from their active
+        reviews. Returns how many courses had drifted."""
+        fixed = 0
+        course_ids = list(self.values_list('id', flat=True))
+        for start in range(0, len(course_ids), 500):
+            batch = course_ids[start:start + 500]
+            with transaction.atomic():
+                courses = list(Course.objects.filter(id__in=batch).select_for_update().only('id', *RATING_FIELDS))
+                histograms = {course.id: dict.fromkeys(RATING_STARS, 0) for course in courses}
+                rows = Review.objects.filter(course_id__in=batch, active=True).values('course_id', 'rating').annotate(
+                    count=Count('id')
+                ).order_by()
+                for row in rows:
+                    histograms[row['course_id']][row['rating']] = row['count']
+
+                changed = []
+                for course in courses:
+                    stored = [getattr(course, field) for field in RATING_FIELDS]
+                    course.set_rating_histogram(histograms[course.id])
+                    if stored != [getattr(course, field) for field in RATING_FIELDS]:
+                        changed.append(course)
+                Course.objects.bulk_update(changed, RATING_FIELDS)
+                fixed += len(changed)
+        return fixed
+
+
+# Denormalized from the active reviews by the Review signals at the bottom
+RATING_STARS = (1, 2, 3, 4, 5)
+RATING_FIELDS = ['rating_sum', 'rating_count'] + [f'rating_{star}_count' for star in RATING_STARS]
+# Kept by VariantItem.save() and the VariantItem signals in api/progress.py
+LECTURE_FIELDS = ['lecture_count', 'lecture_ordinals']
+
+
 class Course(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
@@ -79,6 +213,25 @@ class Course(models.Model):
     course_id = ShortUUIDField(unique=True, length=6, max_length=20, alphabet="1234567890")
     slug = models.SlugField(unique=True, null=True, blank=True)
     date = models.DateTimeField(default=timezone.now)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    lecture_count = models.PositiveIntegerField(default=0, editable=False)
+    # The next VariantItem.ordinal, ordinals of deleted lectures aren't reused
+    lecture_ordinals = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CourseQuerySet.as_manager()
+
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['teacher', 'date', 'id'], name='course_teacher_date_id'),
+            models.Index(fields=['platform_status', 'teacher_course_status', 'date', 'id'], name='course_status_date_id'),
+        ]
 
     def __str__(self):
         return self.title
@@ -86,30 +239,61 @@ class Course(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(generate_unique_slug(self.title))
-        super(Course, self).save()
-
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The rating and lecture columns are only written with F() by the
+            # Review and VariantItem signals, saving a stale instance must not
+            # overwrite them
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in RATING_FIELDS + LECTURE_FIELDS]
+        adding = self._state.adding
+        super(Course, self).save(*args, **kwargs)
+        # Review.teacher and QuestionAnswer.teacher follow the course's
+        # teacher. Queryset.update() of the teacher skips this, like it skips
+        # every save()
+        if not adding and 'teacher' in kwargs['update_fields']:
+            Review.objects.filter(course=self).exclude(teacher_id=self.teacher_id).update(teacher_id=self.teacher_id)
+            QuestionAnswer.objects.filter(course=self).exclude(teacher_id=self.teacher_id).update(
+                teacher_id=self.teacher_id)
+
+    # The relation methods below go through the related managers so they pick
+    # up the caches filled by Course.objects.for_serializer()
     def students(self):
-        return EnrolledCourse.objects.filter(course=self)
+        return self.enrolledcourse_set.all()
 
     def curriculum(self):
-        # Using __ we can grab any field in the variant and query on something
-        return Variant.objects.filter(course=self)
+        return self.variant_set.all()
 
     def lectures(self):
+        if is_prefetched(self, 'variant_set'):
+            return [item for variant in self.variant_set.all() for item in variant.variant_items.all()]
+        # Using __ we can grab any field in the variant and query on something
         return VariantItem.objects.filter(variant__course=self)
 
+    def preview_lectures(self):
+        return [lecture for lecture in self.lectures() if lecture.preview]
+
     def average_rating(self):
-        average_rating = Review.objects.filter(course=self, active=True).aggregate(avg_rating=models.Avg('rating'))
-        if average_rating['avg_rating'] is not None:
-            return round(average_rating['avg_rating'], 1)
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1)
         return None
 
-    def rating_count(self):
-        return Review.objects.filter(course=self, active=True).count()
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}_count') for star in RATING_STARS}
+
+    def set_rating_histogram(self, histogram):
+        for star in RATING_STARS:
+            setattr(self, f'rating_{star}_count', histogram.get(star, 0))
+        self.rating_count = sum(histogram.values())
+        self.rating_sum = sum(star * count for star, count in histogram.items())
 
     def reviews(self):
+        if hasattr(self, 'active_reviews'):
+            return self.active_reviews
         return Review.objects.filter(course=self, active=True)
 
+    def questions(self):
+        return self.questionanswer_set.all()
+
 
 class Variant(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -127,6 +311,14 @@ class Variant(models.Model):
         return VariantItem.objects.filter(variant=self)
 
 
+def next_lecture_ordinal(course_id):
+    """Takes the next ordinal of the course. Call it in a transaction, the
+    update keeps the course row locked until the lecture is saved."""
+    course = Course.objects.filter(pk=course_id)
+    course.update(lecture_ordinals=F('lecture_ordinals') + 1)
+    return course.values_list('lecture_ordinals', flat=True).get() - 1
+
+
 class VariantItem(models.Model):
     variant = models.ForeignKey(Variant, on_delete=models.CASCADE, related_name='variant_items')
     title = models.CharField(max_length=1000)
@@ -135,27 +327,37 @@ class VariantItem(models.Model):
     duration = models.DurationField(null=True, blank=True)
     preview = models.BooleanField(default=False)
     content_duration = models.CharField(max_length=1000, null=True, blank=True)
+    media_status = models.CharField(max_length=100, choices=CourseConstants.MEDIA_STATUS, default='Ready')
     variant_item_id = ShortUUIDField(unique=True, length=6, max_length=20, alphabet="1234567890")
     date = models.DateTimeField(default=timezone.now)
+    # Position of the lecture in its course's completion bitmaps (EnrolledCourse.lesson_bitmap)
+    ordinal = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.variant.title} - {self.title}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        if self.file:
-            clip = VideoFileClip(self.file.path)
-            duration_seconds = clip.duration
-
-            minutes, remainder = divmod(duration_seconds, 60)
-
-            minutes = math.floor(minutes)
-            seconds = math.floor(remainder)
-
-            duration_text = f"{minutes}m {seconds}s"
-            self.content_duration = duration_text
-            super().save(update_fields=['content_duration'])
+        # A new upload (or a file never probed) gets its duration read in the
+        # background, the request returns with the item still "Processing"
+        probe = bool(self.file) and (
+            not self.file._committed or (self.content_duration is None and self.media_status != 'Processing')
+        )
+        if probe:
+            self.media_status = 'Processing'
+            self.duration = None
+            self.content_duration = None
+            if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'media_status', 'duration', 'content_duration'}
+
+        with transaction.atomic():
+            if self._state.adding and self.ordinal is None:
+                self.ordinal = next_lecture_ordinal(self.variant.course_id)
+                Course.objects.filter(pk=self.variant.course_id).update(lecture_count=F('lecture_count') + 1)
+            super().save(*args, **kwargs)
+
+        if probe:
+            path, file_name = self.file.path, self.file.name
+            transaction.on_commit(lambda: enqueue_probe(self.pk, path, file_name))
 
 
 class QuestionAnswer(models.Model):
@@ -164,18 +366,33 @@ class QuestionAnswer(models.Model):
     title = models.CharField(max_length=1000, null=True, blank=True)
     qa_id = ShortUUIDField(unique=True, length=6, max_length=20, alphabet="1234567890")
     date = models.DateTimeField(default=timezone.now)
+    # The course's teacher, copied on save (and by Course.save when the
+    # course changes hands) so the teacher's questions are one keyset
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+                                related_name='course_questions')
 
     def __str__(self):
         return f"{self.user.username} - {self.course.title}"
 
     class Meta:
         ordering = ['-date']
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['course', 'date', 'id'], name='questionanswer_course_date_id'),
+            models.Index(fields=['teacher', 'date', 'id'], name='questionanswer_teacher_date_id'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.teacher_id = self.course.teacher_id
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'teacher'}
+        super().save(*args, **kwargs)
 
     def messages(self):
-        return QuestionAnswerMessage.objects.filter(question=self)
+        return self.questionanswermessage_set.all()
 
     def profile(self):
-        return Profile.objects.get(user=self.user)
+        return user_profile(self.user)
 
 
 class QuestionAnswerMessage(models.Model):
@@ -193,7 +410,7 @@ class QuestionAnswerMessage(models.Model):
         ordering = ['date']
 
     def profile(self):
-        return Profile.objects.get(user=self.user)
+        return user_profile(self.user)
 
 
 class Cart(models.Model):
@@ -206,10 +423,50 @@ class Cart(models.Model):
     cart_id = ShortUUIDField(length=6, max_length=20, alphabet="1234567890")
     date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['cart_id', 'date', 'id'], name='cart_cart_date_id'),
+        ]
+
     def __str__(self):
         return self.course.title
 
 
+class CartOrderQuerySet(models.QuerySet):
+
+    def create_from_cart(self, cart_id, student=None, **details):
+        """Creates the order of the cart's items as one unit: the items in
+        one insert, the teachers in one insert and the totals summed by the
+        database, in a fixed number of queries whatever the size of the
+        cart. `details` are the billing fields (full_name, email, country)."""
+        cart_items = Cart.objects.filter(cart_id=cart_id).select_related('course').only(
+            'price', 'tax_fee', 'total', 'course__teacher_id',
+        )
+        with transaction.atomic():
+            order = self.create(student=student, **details)
+            CartOrderItem.objects.bulk_create([
+                CartOrderItem(order=order, course_id=item.course_id, teacher_id=item.course.teacher_id,
+                              price=item.price, tax_fee=item.tax_fee, total=item.total, initial_total=item.total)
+                for item in cart_items
+            ])
+            teacher_ids = {item.course.teacher_id for item in cart_items if item.course.teacher_id is not None}
+            CartOrder.teachers.through.objects.bulk_create([
+                CartOrder.teachers.through(cartorder_id=order.pk, teacher_id=teacher_id) for teacher_id in teacher_ids
+            ])
+
+            zero = Value(Decimal('0.00'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+            totals = CartOrderItem.objects.filter(order=order).aggregate(
+                sub_total=Coalesce(Sum('price'), zero),
+                tax_fee=Coalesce(Sum('tax_fee'), zero),
+                total=Coalesce(Sum('total'), zero),
+            )
+            order.sub_total, order.tax_fee, order.total = totals['sub_total'], totals['tax_fee'], totals['total']
+            order.initial_total = order.total
+            order.save(update_fields=['sub_total', 'tax_fee', 'total', 'initial_total'])
+        return order
+
+
 class CartOrder(models.Model):
     student = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     teachers = models.ManyToManyField(Teacher, blank=True)
@@ -227,6 +484,8 @@ class CartOrder(models.Model):
     oid = ShortUUIDField(unique=True, length=6, max_length=20, alphabet="1234567890")
     date = models.DateTimeField(default=timezone.now)
 
+    objects = CartOrderQuerySet.as_manager()
+
     def __str__(self):
         return self.oid
 
@@ -237,6 +496,45 @@ class CartOrder(models.Model):
         return CartOrderItem.objects.filter(order=self)
 
 
+class OrderFulfillment(models.Model):
+    """Written in the transaction that fulfills a paid order (api/fulfillment.py).
+    One per order, so a repeated or concurrent success callback can't
+    enroll the student twice."""
+    order = models.OneToOneField(CartOrder, on_delete=models.CASCADE, related_name='fulfillment')
+    provider = models.CharField(max_length=20)  # stripe, paypal or replay
+    # provider:payment reference, the same payment can't fulfill two orders
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.idempotency_key
+
+
+class StripeEvent(models.Model):
+    """Inbox of the Stripe webhook (api/stripe_events.py). Every event Stripe
+    delivers is stored once, as it was signed, and handled afterwards by
+    the worker, which only fills in processed, attempts and error."""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    # The id of the event's object, the checkout session for the checkout events
+    object_id = models.CharField(max_length=255, blank=True, db_index=True)
+    payload = models.TextField()
+    received = models.DateTimeField(default=timezone.now)
+    processed = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # The worker's queue
+            models.Index(fields=['received'], condition=Q(processed__isnull=True),
+                         name='stripeevent_pending'),
+        ]
+
+    def __str__(self):
+        return f'{self.type} {self.event_id}'
+
+
 class CartOrderItem(models.Model):
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='orderitem')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='order_item')
@@ -256,6 +554,10 @@ class CartOrderItem(models.Model):
 
     class Meta:
         ordering = ['-date']
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['teacher', 'date', 'id'], name='cartorderitem_teacher_date_id'),
+        ]
 
     def order_id(self):
         return f"Order ID #{self.order.oid}"
@@ -264,6 +566,45 @@ class CartOrderItem(models.Model):
         return f"{self.order.payment_status}"
 
 
+class TeacherRevenueDaily(models.Model):
+    """Per teacher, per course, per day totals of the paid order items.
+    Maintained by api.revenue when an order is paid, the teacher dashboards
+    read from here instead of re-aggregating CartOrderItem."""
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='revenue_rollups')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='revenue_rollups')
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=12, default=0.0, decimal_places=2)
+    sales_count = models.PositiveIntegerField(default=0)
+    tax = models.DecimalField(max_digits=12, default=0.0, decimal_places=2)
+    discounts = models.DecimalField(max_digits=12, default=0.0, decimal_places=2)
+    # Set on every write, the cached earnings series of the teacher are
+    # versioned by it (api/revenue.py)
+    updated = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "Teacher revenue daily"
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['teacher', 'day', 'course'], name='unique_teacher_day_course_revenue'),
+        ]
+        indexes = [
+            models.Index(fields=['teacher', 'updated'], name='teacherrevenue_teacher_updated'),
+        ]
+
+    def __str__(self):
+        return f"{self.teacher} - {self.course} - {self.day}"
+
+
+class BestCoursesSnapshot(models.Model):
+    """Ranked course ids of one (category, language) scope, see api/ranking.py"""
+    scope = models.CharField(max_length=200, unique=True)
+    course_ids = models.JSONField(default=list)
+    date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.scope
+
+
 class Certificate(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -280,10 +621,119 @@ class CompletedLesson(models.Model):
     variant_item = models.ForeignKey(VariantItem, on_delete=models.CASCADE)
     date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # The progress subqueries of the enrolled-course cards
+            models.Index(fields=['user', 'course', 'date'], name='completedlesson_user_course'),
+        ]
+
     def __str__(self):
         return self.course.title
 
 
+PROGRESS_FIELDS = ['lesson_bitmap', 'completed_count']
+
+
+class EnrolledCourseQuerySet(models.QuerySet):
+
+    def for_serializer(self, selection=None):
+        """Loads what EnrolledCourseSerializer walks (at depth 3) in a fixed
+        number of queries, like Course.objects.for_serializer(). The rows
+        of the per-user lists are only loaded for the users of these
+        enrollments."""
+        wants = selection.wants if selection is not None else (lambda *path: True)
+        queryset = self.select_related('course')
+        users = self.values('user_id')
+        if wants('course'):
+            queryset = queryset.select_related('course__category', 'course__teacher__user').prefetch_related(
+                *user_m2m_lookups('course__teacher__user'))
+        if wants('user'):
+            queryset = queryset.select_related('user').prefetch_related(*user_m2m_lookups('user'))
+        if wants('teacher'):
+            queryset = queryset.select_related('teacher__user').prefetch_related(*user_m2m_lookups('teacher__user'))
+        if wants('order_item'):
+            queryset = queryset.select_related(
+                'order_item__order__student', 'order_item__course__teacher', 'order_item__teacher__user',
+            ).prefetch_related('order_item__coupons__used_by', 'order_item__order__teachers',
+                               'order_item__order__coupons',
+                               *user_m2m_lookups('order_item__order__student'),
+                               *user_m2m_lookups('order_item__teacher__user'))
+        if wants('lectures') or wants('curriculum'):
+            queryset = queryset.prefetch_related(
+                Prefetch('course__variant_set', queryset=Variant.objects.prefetch_related('variant_items')),
+            )
+        if wants('completed_lesson'):
+            completed_lessons = CompletedLesson.objects.filter(user__in=users).select_related(
+                'user', 'variant_item__variant__course',
+            ).prefetch_related(*user_m2m_lookups('user'))
+            queryset = queryset.prefetch_related(
+                Prefetch('course__completedlesson_set', queryset=completed_lessons, to_attr='all_completed_lessons'),
+            )
+        if wants('note'):
+            notes = Note.objects.filter(user__in=users).select_related('user')
+            queryset = queryset.prefetch_related(Prefetch('course__note_set', queryset=notes, to_attr='all_notes'))
+        if wants('review'):
+            reviews = Review.objects.filter(user__in=users).select_related('user__profile').prefetch_related(
+                *user_m2m_lookups('user'))
+            queryset = queryset.prefetch_related(
+                Prefetch('course__review_set', queryset=reviews, to_attr='all_reviews'),
+            )
+        if wants('question_answer'):
+            messages = QuestionAnswerMessage.objects.select_related('user__profile')
+            questions = QuestionAnswer.objects.select_related('user__profile').prefetch_related(
+                Prefetch('questionanswermessage_set', queryset=messages),
+            )
+            queryset = queryset.prefetch_related(Prefetch('course__questionanswer_set', queryset=questions))
+        return queryset
+
+    def with_progress(self):
+        """What the dashboard cards show: the course's lecture count, how
+        many of them the student completed and the progress percent, from
+        the counters kept by api/progress.py, and the last time the student
+        did anything in the course."""
+        completed = CompletedLesson.objects.filter(course=OuterRef('course'), user=OuterRef('user')).order_by()
+        return self.select_related('course').annotate(
+            total_lectures=F('course__lecture_count'),
+            completed_lessons=F('completed_count'),
+            last_activity=Greatest('date', Coalesce(Subquery(completed.values('course').annotate(
+                last=Max('date')).values('last')), 'date')),
+            progress=Case(
+                When(course__lecture_count=0, then=Value(0)),
+                When(completed_count__gte=F('course__lecture_count'), then=Value(100)),
+                default=F('completed_count') * 100 / F('course__lecture_count'),
+            ),
+        )
+
+    def rebuild_progress(self):
+        """Recomputes the completion bitmaps (api/progress.py) of these
+        enrollments from their CompletedLesson rows. Returns how many
+        enrollments had drifted."""
+        fixed = 0
+        enrollments = list(self.values_list('id', 'user_id', 'course_id', 'lesson_bitmap', 'completed_count'))
+        for start in range(0, len(enrollments), 500):
+            batch = enrollments[start:start + 500]
+            with transaction.atomic():
+                ordinals = {}
+                lessons = CompletedLesson.objects.filter(
+                    user__in={row[1] for row in batch}, course__in={row[2] for row in batch},
+                    # A row of a lecture of another course (the endpoint used to allow them)
+                    # would set the bit of one of this course's lectures
+                    variant_item__ordinal__isnull=False, variant_item__variant__course=F('course'),
+                ).values_list('user_id', 'course_id', 'variant_item__ordinal')
+                for user_id, course_id, ordinal in lessons:
+                    ordinals[user_id, course_id] = ordinals.get((user_id, course_id), 0) | 1 << ordinal
+                changed = []
+                for enrollment_id, user_id, course_id, bitmap, count in batch:
+                    value = ordinals.get((user_id, course_id), 0)
+                    new_bitmap = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+                    if bytes(bitmap) != new_bitmap or count != value.bit_count():
+                        changed.append(EnrolledCourse(id=enrollment_id, lesson_bitmap=new_bitmap,
+                                                      completed_count=value.bit_count()))
+                EnrolledCourse.objects.bulk_update(changed, PROGRESS_FIELDS)
+                fixed += len(changed)
+        return fixed
+
+
 class EnrolledCourse(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -291,29 +741,86 @@ class EnrolledCourse(models.Model):
     order_item = models.ForeignKey(CartOrderItem, on_delete=models.CASCADE)
     enrollment_id = ShortUUIDField(unique=True, length=6, max_length=20, alphabet="1234567890")
     date = models.DateTimeField(default=timezone.now)
+    # Bit VariantItem.ordinal is set for every completed lecture, see api/progress.py
+    lesson_bitmap = models.BinaryField(default=b'', editable=False)
+    completed_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = EnrolledCourseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Covers the teacher's distinct-students subquery (with ?since=)
+            models.Index(fields=['teacher', 'date', 'user'], name='enrolled_teacher_date_user'),
+            # The keyset of the student's enrolled courses (api/pagination.py)
+            models.Index(fields=['user', 'date', 'id'], name='enrolled_user_date_id'),
+        ]
 
     def __str__(self):
         return self.course.title
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The bitmap is only written by api/progress.py, with a
+            # compare-and-swap, saving a stale instance must not overwrite it
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in PROGRESS_FIELDS]
+        super().save(*args, **kwargs)
+
+    def progress(self):
+        """Percent of the course's lectures completed, from the counters"""
+        if not self.course.lecture_count:
+            return 0
+        return min(self.completed_count * 100 // self.course.lecture_count, 100)
+
+    # When the enrollment was loaded through Course.objects.for_serializer()
+    # or EnrolledCourse.objects.for_serializer(), self.course carries the
+    # prefetched rows, so the per-user relations are filtered in memory
+    # instead of re-queried.
     def lectures(self):
-        return VariantItem.objects.filter(variant__course=self.course)
+        return self.course.lectures()
 
     def completed_lesson(self):
+        if hasattr(self.course, 'all_completed_lessons'):
+            return [lesson for lesson in self.course.all_completed_lessons if lesson.user_id == self.user_id]
         return CompletedLesson.objects.filter(course=self.course, user=self.user)
 
     def curriculum(self):
-        return Variant.objects.filter(course=self.course)
+        return self.course.curriculum()
 
     def note(self):
+        if hasattr(self.course, 'all_notes'):
+            return [note for note in self.course.all_notes if note.user_id == self.user_id]
         return Note.objects.filter(course=self.course, user=self.user)
 
     def question_answer(self):
-        return QuestionAnswer.objects.filter(course=self.course)
+        return self.course.questions()
 
     def review(self):
+        if hasattr(self.course, 'all_reviews'):
+            return [review for review in self.course.all_reviews if review.user_id == self.user_id]
         return Review.objects.filter(course=self.course, user=self.user)# .first()
 
 
+class LectureProgress(models.Model):
+    """Where the student is in a lecture's video, written in bulk by api/heartbeats.py"""
+    enrollment = models.ForeignKey(EnrolledCourse, on_delete=models.CASCADE)
+    variant_item = models.ForeignKey(VariantItem, on_delete=models.CASCADE)
+    position = models.FloatField(default=0)  # seconds, the last one reported
+    furthest = models.FloatField(default=0)  # seconds, the furthest one reported
+    # The lecture was marked completed once for watching it, it isn't
+    # marked again if the student unmarks it
+    auto_completed = models.BooleanField(default=False)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['enrollment', 'variant_item'], name='lectureprogress_enrollment_item'),
+        ]
+
+    def __str__(self):
+        return f"{self.enrollment_id} - {self.variant_item_id}: {self.position:.0f}s"
+
+
 class Note(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -322,6 +829,12 @@ class Note(models.Model):
     note_id = ShortUUIDField(unique=True, length=6, max_length=20, alphabet="1234567890")
     date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['user', 'course', 'date', 'id'], name='note_user_course_date_id'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -334,12 +847,29 @@ class Review(models.Model):
     active = models.BooleanField(default=False)
     rating = models.IntegerField(choices=CourseConstants.RATING, default=None)
     date = models.DateTimeField(default=timezone.now)
+    # The course's teacher, copied on save (and by Course.save when the
+    # course changes hands) so the teacher's reviews are one keyset
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+                                related_name='course_reviews')
+
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['course', 'date', 'id'], name='review_course_date_id'),
+            models.Index(fields=['teacher', 'date', 'id'], name='review_teacher_date_id'),
+        ]
 
     def __str__(self):
         return self.course.title
 
+    def save(self, *args, **kwargs):
+        self.teacher_id = self.course.teacher_id
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'teacher'}
+        super().save(*args, **kwargs)
+
     def profile(self):
-        return Profile.objects.get(user=self.user)
+        return user_profile(self.user)
 
 
 class Notification(models.Model):
@@ -352,6 +882,12 @@ class Notification(models.Model):
     seen = models.BooleanField(default=False)
     date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['teacher', 'date', 'id'], name='notification_teacher_date_id'),
+        ]
+
     def __str__(self):
         return self.type
 
@@ -364,6 +900,12 @@ class Coupon(models.Model):
     date = models.DateTimeField(default=timezone.now)
     active = models.BooleanField(default=False)
 
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['teacher', 'date', 'id'], name='coupon_teacher_date_id'),
+        ]
+
     def __str__(self):
         return self.code
 
@@ -372,6 +914,12 @@ class WishList(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
 
+    class Meta:
+        # The keysets of the list endpoints (api/pagination.py)
+        indexes = [
+            models.Index(fields=['user', 'id'], name='wishlist_user_id'),
+        ]
+
     def __str__(self):
         return f'{self.user.email} - {self.course.course_id} - {self.course.title}'
 
@@ -385,3 +933,56 @@ class Country(models.Model):
         return self.name
 
 
+# ---------- Course rating columns ----------
+# Every active review counts once in the rating columns of its course. The
+# signals work out which (course, star) a review counted for before and
+# after the change and move it with F() updates, so concurrent reviews of
+# the same course can't lose an update. Queryset.update() skips signals,
+# manage.py repair_course_ratings fixes the columns after one.
+
+def review_rating_key(course_id, rating, active):
+    # The views create reviews straight from request data, so the rating
+    # can still be a string here
+    if active and rating is not None and int(rating) in RATING_STARS:
+        return course_id, int(rating)
+    return None
+
+
+def shift_course_rating(key, sign):
+    if key is None:
+        return
+    course_id, rating = key
+    Course.objects.filter(pk=course_id).update(
+        rating_sum=F('rating_sum') + sign * rating,
+        rating_count=F('rating_count') + sign,
+        **{f'rating_{rating}_count': F(f'rating_{rating}_count') + sign},
+    )
+
+
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_rating_key = None
+    if raw or instance._state.adding:
+        return
+    previous = Review.objects.filter(pk=instance.pk).values_list('course_id', 'rating', 'active').first()
+    if previous is not None:
+        instance._previous_rating_key = review_rating_key(*previous)
+
+
+def update_course_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating_key', None)
+    current = review_rating_key(instance.course_id, instance.rating, instance.active)
+    if previous != current:
+        shift_course_rating(previous, -1)
+        shift_course_rating(current, 1)
+
+
+def remove_course_rating(sender, instance, **kwargs):
+    shift_course_rating(review_rating_key(instance.course_id, instance.rating, instance.active), -1)
+
+
+pre_save.connect(remember_review_rating, sender=Review)
+post_save.connect(update_course_rating, sender=Review)
+post_delete.connect(remove_course_rating, sender=Review)
+
@@ -0,0 +1,124 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class TeacherStudentCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the teacher's distinct students. The cursor
+    holds the last profile id, so every page is an indexed range scan
+    whatever the total number of students is.
+    """
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 500
+
+
+class SearchPagination(PageNumberPagination):
+    """Pages of ranked search results, ?page=2&page_size=20"""
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class DateCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the list endpoints, newest first. The opaque
+    cursor holds the (date, id) of the last row of the page and the next
+    page is `WHERE (date, id) < cursor ORDER BY date DESC, id DESC`, so a
+    deep page costs the same as the first one. Unlike DRF's CursorPagination,
+    which keys on one column plus an offset, rows with the same date never
+    make it slower. ?limit= sets the page size (up to LIST_MAX_PAGE_SIZE).
+    """
+    ordering = ('-date', '-id')
+    page_size = getattr(settings, 'LIST_PAGE_SIZE', 20)
+    page_size_query_param = 'limit'
+    max_page_size = getattr(settings, 'LIST_MAX_PAGE_SIZE', 100)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        model = queryset.model
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        position, reverse = self.decode_position(request, model)
+
+        # Walking backwards (the previous page) flips every direction
+        ordering = [(name, descending != reverse) for name, descending in self.fields]
+        queryset = queryset.order_by(*[('-' if descending else '') + name for name, descending in ordering])
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        # Coming back from a later page there is always a next one
+        has_next, has_previous = (True, has_more) if reverse else (has_more, position is not None)
+        self.next_url = self.previous_url = None
+        if self.page:
+            if has_next:
+                self.next_url = self.link(self.page[-1], reverse=False)
+            if has_previous:
+                self.previous_url = self.link(self.page[0], reverse=True)
+        elif has_previous:
+            # Past the end, the way back starts at the cursor itself
+            self.previous_url = self.encode(position, reverse=True)
+        return self.page
+
+    @staticmethod
+    def after(ordering, position):
+        """Rows past `position` in this ordering, lexicographically on the fields"""
+        condition = Q()
+        for i, (name, descending) in enumerate(ordering):
+            equal = {field: value for (field, _), value in zip(ordering[:i], position[:i])}
+            condition |= Q(**equal, **{f"{name}__{'lt' if descending else 'gt'}": position[i]})
+        return condition
+
+    def decode_position(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            values = cursor['p']
+            if len(values) != len(self.fields):
+                raise ValueError
+            position = [model._meta.get_field(name).to_python(value) for (name, _), value in zip(self.fields, values)]
+            return position, bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode(self, position, reverse):
+        cursor = {'p': position, 'r': 1} if reverse else {'p': position}
+        # str() keeps the microseconds, DjangoJSONEncoder cuts them to milliseconds
+        encoded = urlsafe_b64encode(json.dumps(cursor, default=str).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def link(self, instance, reverse):
+        return self.encode([getattr(instance, name) for name, _ in self.fields], reverse)
+
+    def get_next_link(self):
+        return self.next_url
+
+    def get_previous_link(self):
+        return self.previous_url
+
+    def get_html_context(self):
+        return {'previous_url': self.previous_url, 'next_url': self.next_url}
+
+
+class IdCursorPagination(DateCursorPagination):
+    """The same for the tables without a date, newest (highest id) first"""
+    ordering = ('-id',)
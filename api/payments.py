@@ -0,0 +1,290 @@
+"""
+Access to the payment providers. The SDKs are imported on first use so
+management commands, migrations and worker boot don't pay for them.
+
+The async views (api/views/payment_async_views.py) use the Async* clients
+instead, over httpx, so waiting for PayPal or Stripe doesn't hold a
+worker thread.
+"""
+import asyncio
+import threading
+import time
+import uuid
+import weakref
+from functools import lru_cache
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_stripe():
+    """Imports and configures the stripe SDK the first time it is needed"""
+    import stripe
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = getattr(settings, 'STRIPE_API_URL', stripe.api_base)
+    return stripe
+
+
+class PaymentError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PayPalError(PaymentError):
+    pass
+
+
+class StripeAPIError(PaymentError):
+    pass
+
+
+class PayPalClient:
+    """
+    The PayPal REST API over one pooled requests.Session, so the payment
+    confirmations reuse the TLS connections. The OAuth access token is
+    kept until TOKEN_EXPIRY_MARGIN seconds before its expires_in, and the
+    calls retry connection errors, 429 and 5xx with exponential backoff.
+    """
+    TOKEN_EXPIRY_MARGIN = 60
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, client_id, secret, base_url, timeout=10, max_retries=3, backoff=0.5, pool_size=10):
+        self.client_id = client_id
+        self.secret = secret
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self._token = None
+        self._token_expires = 0
+        self._lock = threading.RLock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._make_session()
+        return self._session
+
+    def _make_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # The token request and the order lookups don't change anything,
+        # POST can be retried too
+        retry = Retry(total=self.max_retries, backoff_factor=self.backoff, status_forcelist=self.RETRY_STATUSES,
+                      allowed_methods=frozenset({'GET', 'POST'}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _send(self, method, path, **kwargs):
+        import requests
+
+        try:
+            return self.session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            # The retries are used up
+            raise PayPalError(f'Could not reach paypal: {e}')
+
+    def access_token(self, refresh=False):
+        with self._lock:
+            if refresh or self._token is None or time.monotonic() >= self._token_expires:
+                response = self._send('POST', '/v1/oauth2/token', data={'grant_type': 'client_credentials'},
+                                      auth=(self.client_id, self.secret))
+                if response.status_code != 200:
+                    raise PayPalError(f'Failed to get access token from paypal {response.status_code}',
+                                      response.status_code)
+                data = response.json()
+                self._token = data['access_token']
+                self._token_expires = time.monotonic() + max(
+                    int(data.get('expires_in', 0)) - self.TOKEN_EXPIRY_MARGIN, 0)
+            return self._token
+
+    def request(self, method, path, **kwargs):
+        """The API response, getting a new token once if PayPal revoked the cached one"""
+        for refresh in (False, True):
+            headers = {'Content-type': 'application/json',
+                       'Authorization': f'Bearer {self.access_token(refresh=refresh)}'}
+            response = self._send(method, path, headers=headers, **kwargs)
+            if response.status_code != 401:
+                break
+        return response
+
+    def get_order(self, paypal_order_id):
+        """The checkout order, as PayPal returns it"""
+        response = self.request('GET', f'/v2/checkout/orders/{paypal_order_id}')
+        if response.status_code != 200:
+            raise PayPalError(f'Failed to get the paypal order {response.status_code}', response.status_code)
+        return response.json()
+
+
+@lru_cache(maxsize=None)
+def get_paypal():
+    """The PayPal client of the process, sharing its connections and token between requests"""
+    return PayPalClient(
+        settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_ID,
+        getattr(settings, 'PAYPAL_API_URL', 'https://api-m.sandbox.paypal.com'),
+        timeout=getattr(settings, 'PAYPAL_TIMEOUT', 10),
+        max_retries=getattr(settings, 'PAYPAL_MAX_RETRIES', 3),
+    )
+
+
+class AsyncClient:
+    """
+    A pooled httpx.AsyncClient retrying connection errors, 429 and 5xx
+    with exponential backoff, like PayPalClient. It belongs to the event
+    loop it was made in, get one with get_async_paypal/get_async_stripe.
+    """
+    error_class = PaymentError
+    RETRY_STATUSES = PayPalClient.RETRY_STATUSES
+
+    def __init__(self, base_url, timeout=10, max_retries=3, backoff=0.5, max_connections=100):
+        import httpx
+
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections))
+
+    async def send(self, method, path, **kwargs):
+        import httpx
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = await self.client.request(method, f'{self.base_url}{path}', **kwargs)
+            except httpx.TransportError as e:
+                error = e
+                continue
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return response
+        raise self.error_class(f'Could not reach {self.base_url}: {error!r}')
+
+
+class AsyncPayPalClient(AsyncClient):
+    """PayPalClient for the async views, with the same token cache"""
+    error_class = PayPalError
+    TOKEN_EXPIRY_MARGIN = PayPalClient.TOKEN_EXPIRY_MARGIN
+
+    def __init__(self, client_id, secret, base_url, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.client_id = client_id
+        self.secret = secret
+        self._token = None
+        self._token_expires = 0
+        self._lock = asyncio.Lock()
+
+    async def access_token(self, refresh=False):
+        async with self._lock:
+            if refresh or self._token is None or time.monotonic() >= self._token_expires:
+                response = await self.send('POST', '/v1/oauth2/token', data={'grant_type': 'client_credentials'},
+                                           auth=(self.client_id, self.secret))
+                if response.status_code != 200:
+                    raise PayPalError(f'Failed to get access token from paypal {response.status_code}',
+                                      response.status_code)
+                data = response.json()
+                self._token = data['access_token']
+                self._token_expires = time.monotonic() + max(
+                    int(data.get('expires_in', 0)) - self.TOKEN_EXPIRY_MARGIN, 0)
+            return self._token
+
+    async def request(self, method, path, **kwargs):
+        for refresh in (False, True):
+            headers = {'Content-type': 'application/json',
+                       'Authorization': f'Bearer {await self.access_token(refresh=refresh)}'}
+            response = await self.send(method, path, headers=headers, **kwargs)
+            if response.status_code != 401:
+                break
+        return response
+
+    async def get_order(self, paypal_order_id):
+        response = await self.request('GET', f'/v2/checkout/orders/{paypal_order_id}')
+        if response.status_code != 200:
+            raise PayPalError(f'Failed to get the paypal order {response.status_code}', response.status_code)
+        return response.json()
+
+
+def stripe_form(params, prefix=''):
+    """Stripe's form encoding of nested parameters: line_items[0][quantity]=1"""
+    items = []
+    for key, value in (params.items() if isinstance(params, dict) else enumerate(params)):
+        name = f'{prefix}[{key}]' if prefix else key
+        if isinstance(value, (dict, list, tuple)):
+            items.extend(stripe_form(value, name))
+        elif value is not None:
+            items.append((name, str(value).lower() if isinstance(value, bool) else value))
+    return items
+
+
+class AsyncStripeClient(AsyncClient):
+    """The checkout sessions of the Stripe API, the calls the stripe SDK makes for the sync views"""
+    error_class = StripeAPIError
+
+    def __init__(self, secret_key, base_url, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.secret_key = secret_key
+
+    async def call(self, method, path, params=None):
+        headers = {'Authorization': f'Bearer {self.secret_key}'}
+        kwargs = {}
+        if method == 'POST':
+            # Makes the retries of a POST safe, Stripe answers them with the first result
+            headers['Idempotency-Key'] = str(uuid.uuid4())
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            kwargs['content'] = urlencode(stripe_form(params or {}))
+        response = await self.send(method, path, headers=headers, **kwargs)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code != 200:
+            raise StripeAPIError(data.get('error', {}).get('message', f'Stripe error {response.status_code}'),
+                                 response.status_code)
+        return data
+
+    async def create_checkout_session(self, **params):
+        return await self.call('POST', '/v1/checkout/sessions', params)
+
+    async def retrieve_checkout_session(self, session_id):
+        return await self.call('GET', f'/v1/checkout/sessions/{session_id}')
+
+
+# Event loop -> its clients. Under ASGI there is one loop per worker, under
+# WSGI every async view runs in a loop of its own.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _loop_client(name, make):
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = make()
+    return clients[name]
+
+
+def get_async_paypal():
+    return _loop_client('paypal', lambda: AsyncPayPalClient(
+        settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_ID,
+        getattr(settings, 'PAYPAL_API_URL', 'https://api-m.sandbox.paypal.com'),
+        timeout=getattr(settings, 'PAYPAL_TIMEOUT', 10),
+        max_retries=getattr(settings, 'PAYPAL_MAX_RETRIES', 3),
+    ))
+
+
+def get_async_stripe():
+    return _loop_client('stripe', lambda: AsyncStripeClient(
+        settings.STRIPE_SECRET_KEY, getattr(settings, 'STRIPE_API_URL', 'https://api.stripe.com'),
+        timeout=getattr(settings, 'STRIPE_TIMEOUT', 30),
+        max_retries=getattr(settings, 'STRIPE_MAX_RETRIES', 2),
+    ))
@@ -0,0 +1,142 @@
+"""
+Lesson completion as a bitmap per enrollment.
+
+Every lecture gets an ordinal in its course (VariantItem.ordinal, never
+reused) and an enrollment keeps the bit of every lecture its student
+completed in EnrolledCourse.lesson_bitmap, with the number of bits set in
+completed_count. Bit n is bit n % 8 of byte n // 8, so a course with 500
+lectures takes 63 bytes per enrollment.
+
+Toggling a lecture rewrites the bitmap with a compare-and-swap (the update
+only matches the bitmap it was computed from), so concurrent toggles of the
+same enrollment don't lose each other, without a row lock. Progress is
+completed_count / Course.lecture_count, no rows are counted.
+
+The CompletedLesson rows are still written next to the bit, for the
+endpoints that list them.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_delete
+
+from api import models as api_models
+
+
+def is_set(bitmap, ordinal):
+    byte = ordinal >> 3
+    return byte < len(bitmap) and bool(bitmap[byte] & (1 << (ordinal & 7)))
+
+
+def toggle_bit(bitmap, ordinal):
+    """The bitmap with the bit flipped and whether it's now set"""
+    bitmap = bytearray(bitmap)
+    byte = ordinal >> 3
+    if byte >= len(bitmap):
+        bitmap.extend(bytes(byte + 1 - len(bitmap)))
+    bitmap[byte] ^= 1 << (ordinal & 7)
+    # Keep it as short as possible, one bitmap per content compares equal
+    return bytes(bitmap).rstrip(b'\0'), bool(bitmap[byte] & (1 << (ordinal & 7)))
+
+
+def lecture_ordinal(variant_item, course_id):
+    """The item's ordinal, given one first if it was created without save() (bulk_create)"""
+    if variant_item.ordinal is None:
+        with transaction.atomic():
+            ordinal = api_models.next_lecture_ordinal(course_id)
+            if api_models.VariantItem.objects.filter(pk=variant_item.pk, ordinal=None).update(ordinal=ordinal):
+                api_models.Course.objects.filter(pk=course_id).update(lecture_count=F('lecture_count') + 1)
+        variant_item.refresh_from_db(fields=['ordinal'])
+    return variant_item.ordinal
+
+
+def swap_bitmap(enrollment_id, change):
+    """
+    Applies change(bitmap) -> (new bitmap, completed count delta), or None
+    to leave it, with a compare-and-swap retried until no other toggle
+    got in between. Returns what change returned.
+    """
+    while True:
+        bitmap = api_models.EnrolledCourse.objects.values_list('lesson_bitmap', flat=True).get(pk=enrollment_id)
+        bitmap = bytes(bitmap)
+        changed = change(bitmap)
+        if changed is None:
+            return None
+        new_bitmap, delta = changed
+        updated = api_models.EnrolledCourse.objects.filter(pk=enrollment_id, lesson_bitmap=bitmap).update(
+            lesson_bitmap=new_bitmap,
+            completed_count=F('completed_count') + delta,
+        )
+        if updated:
+            return changed
+
+
+def flip_lesson(enrollment_id, ordinal):
+    """Flips the lecture's bit of the enrollment, returns whether it's now completed"""
+    def flip(bitmap):
+        new_bitmap, completed = toggle_bit(bitmap, ordinal)
+        return new_bitmap, 1 if completed else -1
+
+    return swap_bitmap(enrollment_id, flip)[1] == 1
+
+
+def complete_lesson(enrollment, variant_item):
+    """
+    Marks the lecture completed for the enrollment unless it already is,
+    for the automatic completion (api/heartbeats.py). Returns whether it
+    was marked.
+    """
+    ordinal = lecture_ordinal(variant_item, enrollment.course_id)
+    with transaction.atomic():
+        marked = swap_bitmap(enrollment.pk, lambda bitmap: None if is_set(bitmap, ordinal) else (
+            toggle_bit(bitmap, ordinal)[0], 1))
+        if marked is None:
+            return False
+        api_models.CompletedLesson.objects.create(user_id=enrollment.user_id, course_id=enrollment.course_id,
+                                                  variant_item=variant_item)
+    return True
+
+
+def toggle_lesson(user, course, variant_item):
+    """
+    Marks the lecture completed, or not completed if it already was, for
+    the user's enrollment in the course. Returns whether it's completed.
+    Without an enrollment only the CompletedLesson row is toggled. Raises
+    ValueError if the lecture isn't one of the course's, its ordinal would
+    flip another lecture's bit.
+    """
+    if variant_item.variant.course_id != course.id:
+        raise ValueError(f'Lecture {variant_item.pk} is not in course {course.id}')
+    enrollment_id = api_models.EnrolledCourse.objects.filter(user=user, course=course).order_by('id').values_list(
+        'id', flat=True).first()
+    with transaction.atomic():
+        if enrollment_id is not None:
+            completed = flip_lesson(enrollment_id, lecture_ordinal(variant_item, course.id))
+        else:
+            completed = not api_models.CompletedLesson.objects.filter(
+                user=user, course=course, variant_item=variant_item).exists()
+        if completed:
+            api_models.CompletedLesson.objects.create(user=user, course=course, variant_item=variant_item)
+        else:
+            api_models.CompletedLesson.objects.filter(user=user, course=course, variant_item=variant_item).delete()
+    return completed
+
+
+def forget_lecture(course_id, ordinal):
+    """Clears the bit of a deleted lecture in the enrollments of its course"""
+    enrollments = api_models.EnrolledCourse.objects.filter(course_id=course_id, completed_count__gt=0)
+    for enrollment_id, bitmap in enrollments.values_list('id', 'lesson_bitmap').iterator():
+        if is_set(bytes(bitmap), ordinal):
+            flip_lesson(enrollment_id, ordinal)
+
+
+def remove_lecture(sender, instance, **kwargs):
+    # Runs before the delete, in its transaction, so a cascade from the
+    # variant or the course still finds the item's course
+    course_id = api_models.Variant.objects.filter(pk=instance.variant_id).values_list('course_id', flat=True).first()
+    if course_id is None or instance.ordinal is None:
+        return
+    api_models.Course.objects.filter(pk=course_id).update(lecture_count=F('lecture_count') - 1)
+    forget_lecture(course_id, instance.ordinal)
+
+
+pre_delete.connect(remove_lecture, sender=api_models.VariantItem)
@@ -0,0 +1,165 @@
+"""
+Best courses ranking.
+
+Courses are ranked by the Bayesian average of their active reviews: every
+course starts with BEST_COURSES_PRIOR_WEIGHT reviews at the platform wide
+average, so one 5 star review doesn't beat thousands of 4.8 star ones. The
+ranking is stored as a snapshot per (category, language) scope, plus the
+"any" scopes, so the endpoint only reads one row and the k courses in it.
+
+Snapshots are rebuilt by `manage.py refresh_best_courses` (run it from
+cron) and after BEST_COURSES_REFRESH_REVIEWS review changes.
+"""
+import heapq
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from api import models as api_models
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED = {'platform_status': 'Published', 'teacher_course_status': 'Published'}
+ANY = '*'
+# Set while a refresh runs, the timeout frees it if the refresh crashes hard
+REFRESHING = 'best-courses-refreshing'
+REFRESH_TIMEOUT = 10 * 60
+
+
+def scope_key(category_id=None, language=None):
+    return f'{category_id or ANY}:{language or ANY}'
+
+
+def bayesian_score(rating_sum, rating_count, prior_mean, prior_weight):
+    return (prior_weight * prior_mean + rating_sum) / (prior_weight + rating_count)
+
+
+def rank_courses(courses, prior_weight, size):
+    """
+    courses are dicts with id, category_id, language, rating_sum,
+    rating_count and date. Returns {scope: [course ids, best first]}.
+    """
+    total_sum = sum(course['rating_sum'] for course in courses)
+    total_count = sum(course['rating_count'] for course in courses)
+    prior_mean = total_sum / total_count if total_count else 0
+
+    def sort_key(course):
+        # Equal scores: more reviews first, then the newest course
+        score = bayesian_score(course['rating_sum'], course['rating_count'], prior_mean, prior_weight)
+        return score, course['rating_count'], course['date']
+
+    by_scope = defaultdict(list)
+    for course in courses:
+        category_id, language = course['category_id'], course['language']
+        for key in {scope_key(), scope_key(category_id), scope_key(language=language),
+                    scope_key(category_id, language)}:
+            by_scope[key].append(course)
+
+    return {
+        key: [course['id'] for course in heapq.nlargest(size, scope_courses, key=sort_key)]
+        for key, scope_courses in by_scope.items()
+    }
+
+
+def refresh_best_courses():
+    """Rebuilds every snapshot, returns the number of scopes written"""
+    courses = list(
+        api_models.Course.objects.filter(**PUBLISHED)
+        .values('id', 'category_id', 'language', 'rating_sum', 'rating_count', 'date')
+    )
+    ranking = rank_courses(
+        courses,
+        prior_weight=getattr(settings, 'BEST_COURSES_PRIOR_WEIGHT', 10),
+        size=getattr(settings, 'BEST_COURSES_SNAPSHOT_SIZE', 20),
+    )
+    # Always there, even without published courses, so an empty catalog
+    # doesn't look like missing snapshots
+    ranking.setdefault(scope_key(), [])
+    now = timezone.now()
+    with transaction.atomic():
+        # An upsert per scope: a refresh running at the same time in another
+        # process overwrites these rows instead of failing on the unique scope
+        api_models.BestCoursesSnapshot.objects.bulk_create([
+            api_models.BestCoursesSnapshot(scope=key, course_ids=course_ids, date=now)
+            for key, course_ids in ranking.items()
+        ], update_conflicts=True, unique_fields=['scope'], update_fields=['course_ids', 'date'])
+        api_models.BestCoursesSnapshot.objects.exclude(scope__in=list(ranking)).delete()
+    cache.delete('best-courses-review-changes')
+    return len(ranking)
+
+
+def best_courses(category_id=None, language=None, limit=4, selection=None):
+    """
+    The first `limit` courses of the snapshot of the scope, loaded for
+    CourseSerializer (and its FieldSelection). Courses unpublished since
+    the last refresh are skipped.
+    """
+    key = scope_key(category_id, language)
+    snapshot = api_models.BestCoursesSnapshot.objects.filter(scope=key).first()
+    if snapshot is None:
+        if api_models.BestCoursesSnapshot.objects.exists():
+            # The snapshots are there, the scope just has no courses
+            return []
+        # Cold start: one request builds the snapshots, the ones arriving
+        # meanwhile get no courses instead of rebuilding them too
+        if not cache.add(REFRESHING, True, REFRESH_TIMEOUT):
+            return []
+        try:
+            refresh_best_courses()
+        finally:
+            cache.delete(REFRESHING)
+        snapshot = api_models.BestCoursesSnapshot.objects.filter(scope=key).first()
+        if snapshot is None:
+            return []
+
+    published = set(
+        api_models.Course.objects.filter(id__in=snapshot.course_ids, **PUBLISHED).values_list('id', flat=True)
+    )
+    course_ids = [course_id for course_id in snapshot.course_ids if course_id in published][:limit]
+    courses = api_models.Course.objects.filter(id__in=course_ids).for_serializer(selection).in_bulk()
+    return [courses[course_id] for course_id in course_ids]
+
+
+# ---------- Refresh after enough new reviews ----------
+# The counter lives in the default cache, so with the local memory cache
+# every process counts its own review changes.
+
+def _refresh_in_background():
+    try:
+        refresh_best_courses()
+    except Exception:
+        logger.exception("Refreshing the best courses snapshot failed")
+    finally:
+        cache.delete(REFRESHING)
+        connection.close()
+
+
+def _start_refresh():
+    # Only one refresh at a time
+    if cache.add(REFRESHING, True, REFRESH_TIMEOUT):
+        cache.set('best-courses-review-changes', 0, None)
+        threading.Thread(target=_refresh_in_background, daemon=True).start()
+
+
+def count_review_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        changes = cache.incr('best-courses-review-changes')
+    except ValueError:
+        cache.set('best-courses-review-changes', 1, None)
+        changes = 1
+    if changes < getattr(settings, 'BEST_COURSES_REFRESH_REVIEWS', 25):
+        return
+    # Flagged once committed, a rolled back review must not leave the flag set
+    transaction.on_commit(_start_refresh)
+
+
+post_save.connect(count_review_change, sender=api_models.Review)
+post_delete.connect(count_review_change, sender=api_models.Review)
@@ -0,0 +1,215 @@
+from array import array
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from api import models as api_models
+
+ZERO = Decimal('0.00')
+GRANULARITIES = ('day', 'week', 'month', 'year')
+SERIES_CACHE_TIMEOUT = 60 * 60
+
+
+def _item_totals(items):
+    """Groups order items by (teacher, course, day) and sums them up"""
+    totals = defaultdict(lambda: {'revenue': ZERO, 'sales_count': 0, 'tax': ZERO, 'discounts': ZERO})
+    for item in items:
+        key = (item.teacher_id, item.course_id, timezone.localdate(item.date))
+        totals[key]['revenue'] += Decimal(item.price)
+        totals[key]['sales_count'] += 1
+        totals[key]['tax'] += Decimal(item.tax_fee)
+        totals[key]['discounts'] += Decimal(item.saved)
+    return totals
+
+
+def _increment_rollup(lookup, totals):
+    return api_models.TeacherRevenueDaily.objects.filter(**lookup).update(
+        revenue=F('revenue') + totals['revenue'],
+        sales_count=F('sales_count') + totals['sales_count'],
+        tax=F('tax') + totals['tax'],
+        discounts=F('discounts') + totals['discounts'],
+        updated=timezone.now(),
+    )
+
+
+def record_paid_items(items):
+    """
+    Adds the order items of an order that was just marked Paid to the
+    daily rollup. The increments are F() expressions so two orders paid
+    at the same time for the same course can't lose an update.
+    """
+    item_totals = _item_totals(items)
+    with transaction.atomic():
+        for (teacher_id, course_id, day), totals in item_totals.items():
+            lookup = {'teacher_id': teacher_id, 'course_id': course_id, 'day': day}
+            if _increment_rollup(lookup, totals):
+                continue
+            try:
+                with transaction.atomic():
+                    api_models.TeacherRevenueDaily.objects.create(**lookup, **totals)
+            except IntegrityError:
+                # Another payment created the row in between, add to it
+                _increment_rollup(lookup, totals)
+
+
+def rebuild_revenue_rollup(teacher=None):
+    """
+    Recomputes the rollup from the paid order items. Used by the
+    backfill_revenue_rollup command, returns the number of rows written.
+    """
+    items = api_models.CartOrderItem.objects.filter(order__payment_status='Paid')
+    rollups = api_models.TeacherRevenueDaily.objects.all()
+    if teacher is not None:
+        items = items.filter(teacher=teacher)
+        rollups = rollups.filter(teacher=teacher)
+
+    rows = (
+        items
+        .annotate(day=TruncDate('date', tzinfo=timezone.get_current_timezone()))
+        .values('teacher_id', 'course_id', 'day')
+        .annotate(
+            revenue=Coalesce(Sum('price'), ZERO),
+            sales_count=Count('id'),
+            tax=Coalesce(Sum('tax_fee'), ZERO),
+            discounts=Coalesce(Sum('saved'), ZERO),
+        )
+        .order_by()
+    )
+
+    with transaction.atomic():
+        rollups.delete()
+        created = api_models.TeacherRevenueDaily.objects.bulk_create(
+            [api_models.TeacherRevenueDaily(**row) for row in rows], batch_size=1000
+        )
+    return len(created)
+
+
+def teacher_revenue(teacher, since=None):
+    rollups = api_models.TeacherRevenueDaily.objects.filter(teacher=teacher)
+    if since is not None:
+        rollups = rollups.filter(day__gte=since)
+    return rollups.aggregate(total=Coalesce(Sum('revenue'), ZERO))['total']
+
+
+def teacher_course_revenue(teacher):
+    """Revenue and sales per course of the teacher, best selling first"""
+    return (
+        api_models.Course.objects
+        .filter(teacher=teacher)
+        .annotate(
+            revenue=Coalesce(Sum('revenue_rollups__revenue'), ZERO),
+            sales=Coalesce(Sum('revenue_rollups__sales_count'), 0),
+        )
+        .order_by('-revenue')
+    )
+
+
+# ---------- Earnings time series ----------
+# Every teacher's rollup is folded into a compact array of cumulative
+# revenue in cents, one slot per day since the first sale. Any bucket
+# total is then the difference of two slots, so a 5 year range at any
+# granularity costs one pass over the buckets and one index lookup once
+# the array is cached.
+#
+# The cache is per process (LocMemCache) unless CACHES says otherwise, so
+# the cached arrays are never invalidated: they are keyed by the version of
+# the teacher's rollup, the last time one of its rows was written and their
+# number (a course deleted with its rows), read on every request. A payment
+# handled by any worker changes the version, the others rebuild on their
+# next request.
+
+def _series_key(teacher_id):
+    version = api_models.TeacherRevenueDaily.objects.filter(teacher_id=teacher_id).aggregate(
+        updated=Max('updated'), rows=Count('id'))
+    updated = version['updated'].timestamp() if version['updated'] else 0
+    return f'teacher-revenue-series:{teacher_id}:{updated}:{version["rows"]}'
+
+
+class DailyRevenueSeries:
+    """cumulative[i] is the revenue in cents of the days before first_day + i"""
+
+    def __init__(self, first_day, cumulative):
+        self.first_day = first_day
+        self.cumulative = cumulative
+
+    @classmethod
+    def build(cls, teacher):
+        per_day = (
+            api_models.TeacherRevenueDaily.objects
+            .filter(teacher=teacher)
+            .values('day')
+            .annotate(total=Sum('revenue'))
+            .order_by('day')
+        )
+        cumulative = array('q', [0])
+        first_day = None
+        running = 0
+        for row in per_day:
+            if first_day is None:
+                first_day = row['day']
+            # Days without sales repeat the previous running total
+            gap = (row['day'] - first_day).days + 1 - len(cumulative)
+            cumulative.extend([running] * gap)
+            running += int(row['total'] * 100)
+            cumulative.append(running)
+        return cls(first_day, cumulative)
+
+    def _index(self, day):
+        if self.first_day is None:
+            return 0
+        return min(max((day - self.first_day).days, 0), len(self.cumulative) - 1)
+
+    def total(self, start, end):
+        """Revenue of the days in [start, end)"""
+        cents = self.cumulative[self._index(end)] - self.cumulative[self._index(start)]
+        return Decimal(cents) / 100
+
+
+def teacher_revenue_series(teacher):
+    key = _series_key(teacher.id)
+    series = cache.get(key)
+    if series is None:
+        series = DailyRevenueSeries.build(teacher)
+        cache.set(key, series, SERIES_CACHE_TIMEOUT)
+    return series
+
+
+def bucket_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    if granularity == 'year':
+        return date(day.year + 1, 1, 1)
+    return day + timedelta(days=1)
+
+
+def earnings_buckets(series, start, end, granularity):
+    """Zero-filled earnings per bucket for the days in [start, end]"""
+    buckets = []
+    current = bucket_start(start, granularity)
+    last = end + timedelta(days=1)
+    while current < last:
+        following = next_bucket(current, granularity)
+        buckets.append({
+            'period': current,
+            'total_earning': series.total(max(current, start), min(following, last)),
+        })
+        current = following
+    return buckets
@@ -0,0 +1,26 @@
+"""
+In-process course search, see catalog.py for how the indexes are kept
+in sync with the database.
+"""
+from api.search.catalog import catalog
+from api.search.fuzzy import rank_questions
+from api.search.results import FacetResults, SearchResults
+
+
+def search_courses(query, selection=None):
+    return SearchResults(query, selection)
+
+
+def filter_courses(selected, selection=None):
+    """selected: {facet: [values]}, see api/search/facets.py for the facets"""
+    return FacetResults(selected, selection)
+
+
+def search_questions(questions, query):
+    """Filters and ranks a QuestionAnswer queryset by similarity to the query"""
+    return rank_questions(questions, query)
+
+
+def autocomplete(prefix, limit):
+    """[{'type': 'course' | 'category' | 'teacher', 'label': ..., 'slug' or 'id': ...}]"""
+    return catalog.suggestions(prefix, limit)
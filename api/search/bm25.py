@@ -0,0 +1,84 @@
+import heapq
+import math
+from collections import defaultdict
+
+from api.search.text import terms
+
+
+class InvertedIndex:
+    """
+    BM25F over a few weighted fields. A term found in the title counts
+    `weights['title']` times, and so does every word of the title towards
+    the document length. Postings map term -> {doc id: weighted tf}, so
+    a query only touches the documents that contain one of its terms.
+    """
+
+    def __init__(self, weights, k1=1.2, b=0.75):
+        self.weights = weights
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.doc_length = {}
+        self.total_length = 0.0
+
+    def __len__(self):
+        return len(self.doc_length)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_length
+
+    def add(self, doc_id, fields):
+        """fields: {field name: text}, replaces the document if it's indexed"""
+        self.remove(doc_id)
+        frequencies = defaultdict(float)
+        length = 0.0
+        for field, text in fields.items():
+            weight = self.weights.get(field, 1.0)
+            field_terms = terms(text)
+            length += weight * len(field_terms)
+            for term in field_terms:
+                frequencies[term] += weight
+
+        for term, frequency in frequencies.items():
+            self.postings[term][doc_id] = frequency
+        self.doc_terms[doc_id] = tuple(frequencies)
+        self.doc_length[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id):
+        if doc_id not in self.doc_length:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_length.pop(doc_id)
+
+    def idf(self, term):
+        count = len(self.doc_length)
+        frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+    def scores(self, query):
+        """{doc id: BM25 score} of the documents matching any query term"""
+        if not self.doc_length:
+            return {}
+        average_length = self.total_length / len(self.doc_length) or 1.0
+        k1, b = self.k1, self.b
+        scores = defaultdict(float)
+        for term in set(terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, frequency in postings.items():
+                norm = k1 * (1 - b + b * self.doc_length[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (k1 + 1) / (frequency + norm)
+        return scores
+
+    @staticmethod
+    def top(scores, count):
+        """The `count` best doc ids, ties broken by the newest (highest) id"""
+        return heapq.nlargest(count, scores, key=lambda doc_id: (scores[doc_id], doc_id))
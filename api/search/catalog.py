@@ -0,0 +1,359 @@
+"""
+The in-memory search catalog of the published courses: the BM25 index for
+search, the prefix trie for autocomplete, the trigram indexes for the
+fuzzy (misspelled) searches over courses and questions and the facet
+bitmaps of the catalog filters.
+
+Every process builds it on first use and then keeps it up to date from
+the Course, Category and Teacher signals. Changes made by other processes
+are noticed through a generation counter in the default cache (when it is
+shared, e.g. Redis or Memcached), and in any case the catalog is rebuilt
+in the background once it is older than SEARCH_INDEX_MAX_AGE.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+
+from api import models as api_models
+from api.search.bm25 import InvertedIndex
+from api.search.facets import FacetIndex, course_facets
+from api.search.text import terms
+from api.search.trie import PrefixTrie
+from api.search.trigram import WordSimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {'title': 3.0, 'category': 2.0, 'teacher': 2.0, 'description': 1.0}
+QUESTION_WEIGHTS = {'title': 1.0}
+GENERATION_KEY = 'course-search-generation'
+PUBLISHED = {'platform_status': 'Published', 'teacher_course_status': 'Published'}
+PUBLISHED_ENROLLMENTS = Q(course__platform_status='Published', course__teacher_course_status='Published')
+
+
+def is_searchable(course):
+    return course.platform_status == 'Published' and course.teacher_course_status == 'Published'
+
+
+def course_document(course):
+    return {
+        'title': course.title,
+        'description': course.description or '',
+        'category': course.category.title if course.category else '',
+        'teacher': course.teacher.full_name if course.teacher else '',
+    }
+
+
+def searchable_courses():
+    return (
+        api_models.Course.objects
+        .filter(**PUBLISHED)
+        .select_related('category', 'teacher')
+        .only('id', 'title', 'description', 'slug', 'platform_status', 'teacher_course_status',
+              'price', 'level', 'language', 'rating_sum', 'rating_count', 'date',
+              'category__title', 'category__slug', 'teacher__full_name')
+        .annotate(enrollments=Count('enrolledcourse'))
+    )
+
+
+# Autocomplete entries are weighted by popularity, the number of
+# enrollments of the course or of the published courses of the category
+# or teacher. Weights are refreshed when the catalog is rebuilt.
+
+def suggested_categories():
+    return api_models.Category.objects.filter(active=True, course__in=api_models.Course.objects.filter(
+        **PUBLISHED)).distinct().annotate(enrollments=Count('course__enrolledcourse', filter=PUBLISHED_ENROLLMENTS))
+
+
+def suggested_teachers():
+    return api_models.Teacher.objects.filter(course__in=api_models.Course.objects.filter(
+        **PUBLISHED)).distinct().annotate(enrollments=Count('course__enrolledcourse', filter=PUBLISHED_ENROLLMENTS))
+
+
+# The trie keeps a (type, label, slug or id) tuple per entry, the
+# response's dict is only built for the suggestions returned
+SUGGESTION_FIELDS = {'course': 'slug', 'category': 'slug', 'teacher': 'id'}
+
+
+def suggestion(data):
+    kind, label, value = data
+    return {'type': kind, 'label': label, SUGGESTION_FIELDS[kind]: value}
+
+
+def add_course_suggestion(trie, course):
+    enrollments = getattr(course, 'enrollments', None)
+    if enrollments is None:
+        enrollments = api_models.EnrolledCourse.objects.filter(course=course).count()
+    trie.add(('course', course.id), course.title, enrollments, ('course', course.title, course.slug))
+
+
+def add_category_suggestion(trie, category):
+    trie.add(('category', category.id), category.title, category.enrollments,
+             ('category', category.title, category.slug))
+
+
+def add_teacher_suggestion(trie, teacher):
+    trie.add(('teacher', teacher.id), teacher.full_name, teacher.enrollments,
+             ('teacher', teacher.full_name, teacher.id))
+
+
+def _shared_generation():
+    return cache.get_or_set(GENERATION_KEY, 0, None)
+
+
+def _bump_shared_generation():
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+        return 1
+
+
+class CourseCatalog:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.index = None
+        self.trie = None
+        self.words = None  # WordSimilarityIndex over the BM25 postings
+        self.questions = None  # InvertedIndex of the question titles
+        self.question_words = None
+        self.facets = None
+        self.generation = None
+        self.built_at = 0.0
+        self.rebuilding = False
+
+    def build(self):
+        generation = _shared_generation()
+        index = InvertedIndex(FIELD_WEIGHTS)
+        trie = PrefixTrie(getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', 10))
+        facets = FacetIndex()
+        for category in api_models.Category.objects.only('slug', 'title'):
+            facets.set_label('category', category.slug, category.title)
+        # Oldest first, the facet results are listed newest first
+        for course in searchable_courses().order_by('date', 'id').iterator(chunk_size=2000):
+            index.add(course.id, course_document(course))
+            add_course_suggestion(trie, course)
+            facets.add(course.id, course_facets(course))
+        words = WordSimilarityIndex(index.postings)
+        words.add_terms(index.postings)
+        for category in suggested_categories():
+            add_category_suggestion(trie, category)
+        for teacher in suggested_teachers():
+            add_teacher_suggestion(trie, teacher)
+        questions = InvertedIndex(QUESTION_WEIGHTS)
+        for question_id, title in api_models.QuestionAnswer.objects.values_list('id', 'title').iterator(chunk_size=5000):
+            questions.add(question_id, {'title': title or ''})
+        question_words = WordSimilarityIndex(questions.postings)
+        question_words.add_terms(questions.postings)
+        with self.lock:
+            self.index = index
+            self.trie = trie
+            self.words = words
+            self.questions = questions
+            self.question_words = question_words
+            self.facets = facets
+            self.generation = generation
+            self.built_at = time.monotonic()
+        logger.info(f"Built the course search catalog, {len(index)} courses")
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Rebuilding the course search catalog failed")
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+    def ready(self):
+        """Builds the catalog on first use and refreshes it when it's stale"""
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self.build()
+            return
+        max_age = getattr(settings, 'SEARCH_INDEX_MAX_AGE', 15 * 60)
+        stale = self.generation != _shared_generation() or time.monotonic() - self.built_at > max_age
+        if stale and not self.rebuilding:
+            # Keep serving the current catalog while the new one is built
+            self.rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _changed(self, apply=None):
+        generation = _bump_shared_generation()
+        with self.lock:
+            if self.index is None:
+                return
+            if apply is None:
+                # Can't be applied incrementally, leave it to the rebuild
+                return
+            apply()
+            # Still in sync if ours was the only change since the last one we saw
+            if self.generation == generation - 1:
+                self.generation = generation
+
+    def update_course(self, course):
+        if is_searchable(course):
+            document = course_document(course)
+
+            def apply():
+                self.index.add(course.id, document)
+                add_course_suggestion(self.trie, course)
+                self.words.add_terms(self.index.doc_terms[course.id])
+                if course.category:
+                    self.facets.set_label('category', course.category.slug, course.category.title)
+                self.facets.add(course.id, course_facets(course))
+            self._changed(apply)
+        else:
+            self.remove_course(course.id)
+
+    def remove_course(self, course_id):
+        def apply():
+            self.index.remove(course_id)
+            self.trie.remove(('course', course_id))
+            self.facets.remove(course_id)
+        self._changed(apply)
+
+    def update_question(self, question_id, title):
+        def apply():
+            self.questions.add(question_id, {'title': title or ''})
+            self.question_words.add_terms(self.questions.doc_terms[question_id])
+        self._changed(apply)
+
+    def remove_question(self, question_id):
+        self._changed(lambda: self.questions.remove(question_id))
+
+    def update_suggestion(self, kind, instance):
+        """Re-weights a category or teacher entry, or drops it"""
+        suggested = suggested_categories() if kind == 'category' else suggested_teachers()
+        weighted = suggested.filter(id=instance.id).first()
+        if weighted is None:
+            self.remove_suggestion(kind, instance.id)
+            return
+        add = add_category_suggestion if kind == 'category' else add_teacher_suggestion
+        self._changed(lambda: add(self.trie, weighted))
+
+    def remove_suggestion(self, kind, instance_id):
+        self._changed(lambda: self.trie.remove((kind, instance_id)))
+
+    def invalidate(self):
+        self._changed()
+
+    def knows(self, query):
+        """False when a query term is in no course, most likely a typo"""
+        self.ready()
+        with self.lock:
+            return all(term in self.index.postings for term in terms(query))
+
+    def scores(self, query):
+        """{course id: BM25 score} of the courses matching the query"""
+        self.ready()
+        with self.lock:
+            return self.index.scores(query)
+
+    def similar_courses(self, query, threshold):
+        """{course id: similarity} of the courses with words similar to the query words"""
+        self.ready()
+        with self.lock:
+            return self.words.scores(terms(query), threshold)
+
+    def similar_questions(self, query, threshold):
+        """{question id: similarity} of the questions with words similar to the query words"""
+        self.ready()
+        with self.lock:
+            return self.question_words.scores(terms(query), threshold)
+
+    def filter(self, selected):
+        """(matches bitmap, facet counts), see FacetIndex.filter"""
+        self.ready()
+        with self.lock:
+            return self.facets.filter(selected)
+
+    def filtered_ids(self, matches, start, stop):
+        with self.lock:
+            return self.facets.doc_ids_of(matches, start, stop)
+
+    def suggestions(self, prefix, limit):
+        self.ready()
+        with self.lock:
+            found = self.trie.lookup(prefix, limit)
+        return [suggestion(data) for data in found]
+
+
+catalog = CourseCatalog()
+
+
+# ---------- Signals ----------
+# The catalog is only touched after the commit, a rolled back save never
+# shows up in the search results.
+
+def course_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: catalog.update_course(instance))
+
+
+def course_deleted(sender, instance, **kwargs):
+    course_id = instance.id
+    transaction.on_commit(lambda: catalog.remove_course(course_id))
+
+
+def course_related_saved(sender, instance, raw=False, **kwargs):
+    # The category title and the teacher name are part of the documents
+    if raw:
+        return
+    kind = 'category' if sender is api_models.Category else 'teacher'
+
+    def reindex():
+        for course in searchable_courses().filter(**{kind: instance}):
+            catalog.update_course(course)
+        catalog.update_suggestion(kind, instance)
+
+    transaction.on_commit(reindex)
+
+
+def course_related_deleted(sender, instance, **kwargs):
+    # Their courses were updated without signals (SET_NULL), rebuild
+    transaction.on_commit(catalog.invalidate)
+
+
+def course_reviewed(sender, instance, raw=False, **kwargs):
+    # The rating facet, the rating columns were updated without signals
+    if raw:
+        return
+    course_id = instance.course_id
+
+    def reindex():
+        course = searchable_courses().filter(id=course_id).first()
+        if course is not None:
+            catalog.update_course(course)
+
+    transaction.on_commit(reindex)
+
+
+def question_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        question_id, title = instance.id, instance.title
+        transaction.on_commit(lambda: catalog.update_question(question_id, title))
+
+
+def question_deleted(sender, instance, **kwargs):
+    question_id = instance.id
+    transaction.on_commit(lambda: catalog.remove_question(question_id))
+
+
+post_save.connect(course_saved, sender=api_models.Course)
+post_delete.connect(course_deleted, sender=api_models.Course)
+post_save.connect(course_related_saved, sender=api_models.Category)
+post_save.connect(course_related_saved, sender=api_models.Teacher)
+post_delete.connect(course_related_deleted, sender=api_models.Category)
+post_delete.connect(course_related_deleted, sender=api_models.Teacher)
+post_save.connect(course_reviewed, sender=api_models.Review)
+post_delete.connect(course_reviewed, sender=api_models.Review)
+post_save.connect(question_saved, sender=api_models.QuestionAnswer)
+post_delete.connect(question_deleted, sender=api_models.QuestionAnswer)
@@ -0,0 +1,157 @@
+"""
+Faceted filtering of the published courses with in-memory bitmaps.
+
+Every course gets an ordinal (a bit position) and every facet value a
+Python int with the bits of its courses set. A filter is a few ORs and
+ANDs of these ints and a facet count is a popcount, so a request with any
+combination of filters costs no query besides loading the courses of the
+page.
+"""
+from decimal import Decimal
+
+from api.constants import CourseConstants
+
+FACETS = ('category', 'level', 'language', 'price', 'rating')
+
+# (value, label, lowest price, highest price excluded)
+PRICE_RANGES = (
+    ('free', 'Free', Decimal('0'), Decimal('0.01')),
+    ('0-20', 'Less than 20', Decimal('0.01'), Decimal('20')),
+    ('20-50', '20 to 50', Decimal('20'), Decimal('50')),
+    ('50-100', '50 to 100', Decimal('50'), Decimal('100')),
+    ('100+', '100 or more', Decimal('100'), None),
+)
+
+# "4" is "4 stars and up": a course is in every bucket up to its average
+RATINGS = ('4', '3', '2', '1')
+
+
+def price_range(price):
+    price = price or Decimal('0')
+    for value, _, lowest, highest in PRICE_RANGES:
+        if price >= lowest and (highest is None or price < highest):
+            return value
+    return None
+
+
+def course_facets(course):
+    """{facet: [values]} of a course, category given by its slug"""
+    average = course.rating_sum / course.rating_count if course.rating_count else 0
+    return {
+        'category': [course.category.slug] if course.category else [],
+        'level': [course.level],
+        'language': [course.language],
+        'price': [price_range(course.price)],
+        'rating': [stars for stars in RATINGS if average >= int(stars)],
+    }
+
+
+def default_labels():
+    return {
+        'level': dict(CourseConstants.LEVEL),
+        'language': dict(CourseConstants.LANGUAGES),
+        'price': {value: label for value, label, _, _ in PRICE_RANGES},
+        'rating': {stars: f"{stars} star{'s' if stars != '1' else ''} and up" for stars in RATINGS},
+    }
+
+
+class FacetIndex:
+
+    def __init__(self, facets=FACETS):
+        self.ordinals = {}  # doc id -> bit
+        self.doc_ids = []  # bit -> doc id, removed ones keep their bit
+        self.all = 0
+        self.bitmaps = {facet: {} for facet in facets}  # facet -> {value: bitmap}
+        self.doc_values = {}
+        self.labels = {facet: {} for facet in facets}
+        for facet, labels in default_labels().items():
+            if facet in self.labels:
+                self.labels[facet].update(labels)
+
+    def __len__(self):
+        return len(self.doc_values)
+
+    def add(self, doc_id, values):
+        """
+        values: {facet: [values]}. A new document gets the next ordinal, an
+        indexed one keeps its own, so results stay in the order the
+        documents were first added (newest last).
+        """
+        self.remove(doc_id)
+        ordinal = self.ordinals.get(doc_id)
+        if ordinal is None:
+            ordinal = self.ordinals[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+        bit = 1 << ordinal
+        self.all |= bit
+        for facet, facet_values in values.items():
+            bitmaps = self.bitmaps[facet]
+            for value in facet_values:
+                bitmaps[value] = bitmaps.get(value, 0) | bit
+        self.doc_values[doc_id] = values
+
+    def remove(self, doc_id):
+        values = self.doc_values.pop(doc_id, None)
+        if values is None:
+            return
+        mask = ~(1 << self.ordinals[doc_id])
+        self.all &= mask
+        for facet, facet_values in values.items():
+            bitmaps = self.bitmaps[facet]
+            for value in facet_values:
+                bitmaps[value] &= mask
+                if not bitmaps[value]:
+                    del bitmaps[value]
+
+    def set_label(self, facet, value, label):
+        self.labels[facet][value] = label
+
+    def filter(self, selected):
+        """
+        selected: {facet: values}, the values of a facet are OR'ed and the
+        facets AND'ed. Returns the bitmap of the matching documents and
+        {facet: [{'value', 'label', 'count'}]}. The counts of a facet
+        apply the filters of the other facets only, so they show how many
+        results each value would add to the current ones.
+        """
+        masks = {}
+        for facet, values in selected.items():
+            if values:
+                bitmaps = self.bitmaps[facet]
+                mask = 0
+                for value in values:
+                    mask |= bitmaps.get(value, 0)
+                masks[facet] = mask
+
+        matches = self.all
+        for mask in masks.values():
+            matches &= mask
+
+        counts = {}
+        for facet, bitmaps in self.bitmaps.items():
+            base = self.all
+            for other, mask in masks.items():
+                if other != facet:
+                    base &= mask
+            # Values in the order their labels were set
+            labels = self.labels[facet]
+            position = {value: i for i, value in enumerate(labels)}
+            counts[facet] = [
+                {'value': value, 'label': labels.get(value, value), 'count': (bitmaps[value] & base).bit_count()}
+                for value in sorted(bitmaps, key=lambda value: position.get(value, len(position)))
+            ]
+        return matches, counts
+
+    def doc_ids_of(self, bitmap, start, stop):
+        """The doc ids of the bits start:stop of the bitmap, highest bit (newest) first"""
+        bits = bin(bitmap)[2:]
+        top = len(bits) - 1
+        doc_ids = []
+        position = bits.find('1')
+        found = 0
+        while position != -1 and found < stop:
+            if found >= start:
+                doc_ids.append(self.doc_ids[top - position])
+            found += 1
+            position = bits.find('1', position + 1)
+        return doc_ids
@@ -0,0 +1,74 @@
+"""
+Typo tolerant search, ranked by trigram similarity.
+
+On PostgreSQL it's done by pg_trgm's word_similarity(), with the GIN
+trigram indexes of migration 0012 on the course titles and descriptions
+and the question titles. On other databases it's done by the trigram
+indexes of the in-memory catalog, which compute a close equivalent.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from api import models as api_models
+from api.search.bm25 import InvertedIndex
+from api.search.catalog import PUBLISHED, catalog
+
+
+def fuzzy_threshold():
+    return getattr(settings, 'SEARCH_FUZZY_THRESHOLD', 0.25)
+
+
+def fuzzy_limit():
+    return getattr(settings, 'SEARCH_FUZZY_MAX_RESULTS', 500)
+
+
+def use_pg_trgm():
+    return connection.vendor == 'postgresql'
+
+
+def _set_pg_trgm_threshold(threshold):
+    # The %> operator (the one the GIN index serves) compares with it
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)", [str(threshold)])
+
+
+def similar_courses(query):
+    """{course id: similarity} of the published courses most similar to the query"""
+    threshold, limit = fuzzy_threshold(), fuzzy_limit()
+    if not use_pg_trgm():
+        scores = catalog.similar_courses(query, threshold)
+        return {course_id: scores[course_id] for course_id in InvertedIndex.top(scores, limit)}
+
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    _set_pg_trgm_threshold(threshold)
+    courses = api_models.Course.objects.filter(**PUBLISHED).filter(
+        Q(title__trigram_word_similar=query) | Q(description__trigram_word_similar=query),
+    ).annotate(
+        similarity=Greatest(TrigramWordSimilarity(query, 'title'), TrigramWordSimilarity(query, 'description')),
+    ).order_by('-similarity', '-id')
+    return dict(courses.values_list('id', 'similarity')[:limit])
+
+
+def rank_questions(questions, query):
+    """The questions of the queryset with a title similar to the query, most similar first"""
+    threshold = fuzzy_threshold()
+    if use_pg_trgm():
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        _set_pg_trgm_threshold(threshold)
+        return questions.filter(title__trigram_word_similar=query).annotate(
+            similarity=TrigramWordSimilarity(query, 'title'),
+        ).order_by('-similarity', '-date')
+
+    scores = catalog.similar_questions(query, threshold)
+    # The querysets are the questions of a course or a teacher, few ids
+    candidates = scores.keys() & set(questions.values_list('id', flat=True)) if scores else ()
+    best = InvertedIndex.top({question_id: scores[question_id] for question_id in candidates}, fuzzy_limit())
+    similarity = Case(
+        *[When(id=question_id, then=Value(scores[question_id])) for question_id in best],
+        default=Value(0.0), output_field=FloatField(),
+    )
+    return questions.filter(id__in=best).annotate(similarity=similarity).order_by('-similarity', '-date')
@@ -0,0 +1,69 @@
+from api import models as api_models
+from api.search.bm25 import InvertedIndex
+from api.search.catalog import catalog
+from api.search.fuzzy import similar_courses
+
+
+class SearchResults:
+    """
+    Lazy, sliceable ranked results, so DRF's paginators can page through
+    them. The query is scored once, and only the courses of the requested
+    page are loaded from the database, in rank order.
+
+    Queries with a term that no course contains are ranked by trigram
+    similarity instead of BM25, so misspelled queries still find courses.
+    """
+
+    def __init__(self, query, selection=None):
+        self.query = query
+        self.selection = selection
+        self._scores = None
+
+    @property
+    def scores(self):
+        if self._scores is None:
+            if catalog.knows(self.query):
+                self._scores = catalog.scores(self.query)
+            else:
+                self._scores = similar_courses(self.query)
+        return self._scores
+
+    def count(self):
+        return len(self.scores)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop if item.stop is not None else self.count()
+        course_ids = InvertedIndex.top(self.scores, stop)[start:]
+        courses = api_models.Course.objects.filter(id__in=course_ids).for_serializer(self.selection).in_bulk()
+        # A course deleted since it was ranked is just left out
+        return [courses[course_id] for course_id in course_ids if course_id in courses]
+
+
+class FacetResults:
+    """
+    The courses matching the facet filters, newest first, sliceable like
+    SearchResults. `facets` holds the counts of every facet value.
+    """
+
+    def __init__(self, selected, selection=None):
+        self.matches, self.facets = catalog.filter(selected)
+        self.selection = selection
+
+    def count(self):
+        return self.matches.bit_count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop if item.stop is not None else self.count()
+        course_ids = catalog.filtered_ids(self.matches, start, stop)
+        courses = api_models.Course.objects.filter(id__in=course_ids).for_serializer(self.selection).in_bulk()
+        return [courses[course_id] for course_id in course_ids if course_id in courses]
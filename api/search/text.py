@@ -0,0 +1,56 @@
+"""
+Text analysis shared by the search indexes: the same function has to turn
+both the indexed text and the query into terms.
+"""
+import re
+import unicodedata
+
+WORD = re.compile(r'[a-z0-9]+')
+
+# The course languages are English, Spanish and Italian
+STOPWORDS = frozenset("""
+a an and are as at be by for from how in into is it of on or the to with without your you
+al con de del el en la las los para por que un una y
+che di e il le per un una
+""".split())
+
+STEM_SUFFIXES = ('ations', 'ation', 'ments', 'ment', 'ness', 'ings', 'ing', 'edly', 'ed', 'ers', 'er', 'ly', 'es')
+
+
+def normalize(text):
+    """Lowercase without accents, "Programación" -> "programacion" """
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def words(text):
+    return WORD.findall(normalize(text or ''))
+
+
+def stem(word):
+    """
+    Light suffix stripping, enough to conflate the usual inflections:
+    program/programs/programming, code/coding, course/courses,
+    begin/beginner/beginning, study/studies.
+    """
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    for suffix in STEM_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    else:
+        if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            word = word[:-1]
+    if word.endswith('e') and len(word) > 3:
+        word = word[:-1]
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'lsz':
+        word = word[:-1]
+    return word
+
+
+def terms(text):
+    """Stemmed terms of the text without the stopwords, in order"""
+    return [stem(word) for word in words(text) if word not in STOPWORDS]
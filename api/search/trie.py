@@ -0,0 +1,203 @@
+"""
+Prefix trie for the search box autocomplete.
+
+Every label (course title, category title, teacher name) is inserted under
+each of its words, so "dja" finds "Advanced Django". To keep the memory
+bounded the trie bursts lazily: a leaf keeps up to BUCKET_SIZE keys and
+only splits into children once it holds more, and keys are cut at
+MAX_KEY_LENGTH characters.
+
+The nodes hold no strings and no per entry objects. An entry's normalized
+label, weight and data are stored once, in its slot, and a key is an int
+packing the slot and the offset of the key's first word in the label, kept
+in arrays. Internal nodes keep the slots of their `top_size` heaviest
+entries, so a lookup is a walk down the prefix plus a copy of that list,
+or a scan of one small bucket. Removing an entry refills those lists from
+the children's, they always hold the heaviest remaining entries.
+"""
+from array import array
+from bisect import bisect
+from heapq import nsmallest
+
+from api.search.text import words
+
+BUCKET_SIZE = 32
+MAX_KEY_LENGTH = 32
+# A key is slot << OFFSET_BITS | offset, words starting further in the
+# label are not keys
+OFFSET_BITS = 16
+MAX_OFFSET = (1 << OFFSET_BITS) - 1
+
+
+def normalize_label(label):
+    return ' '.join(words(label))
+
+
+def label_keys(label):
+    """The keys of a label: its normalized text starting at every word"""
+    label_words = words(label)
+    return {' '.join(label_words[start:])[:MAX_KEY_LENGTH] for start in range(len(label_words))}
+
+
+def normalize_prefix(prefix):
+    return normalize_label(prefix)[:MAX_KEY_LENGTH]
+
+
+def key_offsets(text):
+    """The offsets of the words of a normalized label, one per distinct key"""
+    offsets, keys = [], set()
+    for offset in [0] + [position + 1 for position, char in enumerate(text) if char == ' ']:
+        if offset > MAX_OFFSET:
+            break
+        key = text[offset:offset + MAX_KEY_LENGTH]
+        if key and key not in keys:
+            keys.add(key)
+            offsets.append(offset)
+    return offsets
+
+
+class _Node:
+    __slots__ = ('children', 'bucket', 'top')
+
+    def __init__(self):
+        self.children = None  # {char: _Node} once the node has burst
+        self.bucket = array('q')  # the keys of a leaf, or the keys ending here
+        self.top = None  # slots, best first, only on burst nodes
+
+
+class PrefixTrie:
+
+    def __init__(self, top_size=20):
+        self.top_size = top_size
+        self.root = _Node()
+        self.slots = {}  # entry id -> slot
+        self.ids = []  # slot -> entry id, None once removed
+        self.texts = []  # slot -> normalized label
+        self.data = []
+        self.weights = array('d')
+        self.free_slots = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, entry_id, label, weight, data):
+        """Adds or replaces an entry. data is what lookups return for it"""
+        self.remove(entry_id)
+        text = normalize_label(label)
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.ids[slot], self.texts[slot], self.data[slot], self.weights[slot] = entry_id, text, data, weight
+        else:
+            slot = len(self.ids)
+            self.ids.append(entry_id)
+            self.texts.append(text)
+            self.data.append(data)
+            self.weights.append(weight)
+        self.slots[entry_id] = slot
+        for offset in key_offsets(text):
+            self._insert(slot << OFFSET_BITS | offset)
+
+    def remove(self, entry_id):
+        """Removes an entry, the top lists it was in are refilled"""
+        slot = self.slots.pop(entry_id, None)
+        if slot is None:
+            return
+        touched = {}
+        for offset in key_offsets(self.texts[slot]):
+            item = slot << OFFSET_BITS | offset
+            key = self._key(item)
+            node, depth = self.root, 0
+            while node.children is not None:
+                touched[id(node)] = (depth, node)
+                if depth == len(key):
+                    break
+                node = node.children[key[depth]]
+                depth += 1
+            node.bucket.remove(item)
+        # Deepest first, a node's list is refilled from its children's
+        for _, node in sorted(touched.values(), key=lambda touched_node: -touched_node[0]):
+            if slot in node.top:
+                self._refill_top(node, slot)
+        self.ids[slot] = self.texts[slot] = self.data[slot] = None
+        self.free_slots.append(slot)
+
+    def _key(self, item):
+        return self.texts[item >> OFFSET_BITS][item & MAX_OFFSET:(item & MAX_OFFSET) + MAX_KEY_LENGTH]
+
+    def _rank(self, slot):
+        return -self.weights[slot], self.ids[slot]
+
+    def _add_to_top(self, node, slot):
+        top = node.top
+        rank = self._rank(slot)
+        # Most entries are lighter than a full list's last one
+        if len(top) >= self.top_size and rank > self._rank(top[-1]) or slot in top:
+            return
+        position = bisect(top, rank, key=self._rank)
+        if position < self.top_size:
+            top.insert(position, slot)
+            del top[self.top_size:]
+
+    def _refill_top(self, node, removed_slot):
+        slots = {item >> OFFSET_BITS for item in node.bucket}
+        for child in node.children.values():
+            if child.children is not None:
+                slots.update(child.top)
+            else:
+                slots.update(item >> OFFSET_BITS for item in child.bucket)
+        slots.discard(removed_slot)
+        node.top = array('q', nsmallest(self.top_size, slots, key=self._rank))
+
+    def _insert(self, item):
+        key = self._key(item)
+        node, depth = self.root, 0
+        while node.children is not None:
+            self._add_to_top(node, item >> OFFSET_BITS)
+            if depth == len(key):
+                node.bucket.append(item)
+                return
+            child = node.children.get(key[depth])
+            if child is None:
+                child = node.children[key[depth]] = _Node()
+            node = child
+            depth += 1
+        node.bucket.append(item)
+        if len(node.bucket) > BUCKET_SIZE and depth < MAX_KEY_LENGTH:
+            self._burst(node, depth)
+
+    def _burst(self, node, depth):
+        bucket, node.bucket, node.children, node.top = node.bucket, array('q'), {}, array('q')
+        for item in bucket:
+            self._add_to_top(node, item >> OFFSET_BITS)
+            key = self._key(item)
+            if depth == len(key):
+                node.bucket.append(item)
+            else:
+                child = node.children.get(key[depth])
+                if child is None:
+                    child = node.children[key[depth]] = _Node()
+                child.bucket.append(item)
+        for child in node.children.values():
+            if len(child.bucket) > BUCKET_SIZE and depth + 1 < MAX_KEY_LENGTH:
+                self._burst(child, depth + 1)
+
+    def lookup(self, prefix, limit):
+        """data of the `limit` heaviest entries with a key starting with prefix"""
+        prefix = normalize_prefix(prefix)
+        if not prefix:
+            return []
+        node = self.root
+        for char in prefix:
+            if node.children is None:
+                break
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        if node.children is not None:
+            ranked = node.top[:limit]
+        else:
+            # A leaf: its keys share the part of the prefix walked so far
+            matches = {item >> OFFSET_BITS for item in node.bucket if self._key(item).startswith(prefix)}
+            ranked = nsmallest(limit, matches, key=self._rank)
+        return [self.data[slot] for slot in ranked]
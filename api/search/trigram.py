@@ -0,0 +1,121 @@
+"""
+Trigram similarity, computed the way PostgreSQL's pg_trgm does it, so the
+in-process index and the pg_trgm path rank the same way: every word is
+padded with two spaces in front and one behind, and the similarity of two
+strings is shared trigrams / all distinct trigrams of both.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from api.search.text import normalize, words
+
+
+def trigrams(text):
+    result = set()
+    for word in words(text):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(first, second):
+    """Similarity of two trigram sets, between 0 and 1"""
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+class TrigramIndex:
+    """
+    Fuzzy lookup of short strings (titles, words). Postings map a trigram
+    to the ids of the strings that contain it. A lookup only reads the
+    postings of the rarest query trigrams: a string reaching the threshold
+    shares at least ceil(threshold * query trigrams) trigrams with the
+    query, so it has to show up in one of those lists. Then only these
+    candidates get their exact similarity computed.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(list)
+        self.texts = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.texts
+
+    def add(self, doc_id, text):
+        self.remove(doc_id)
+        text = normalize(text or '')
+        self.texts[doc_id] = text
+        for trigram in trigrams(text):
+            self.postings[trigram].append(doc_id)
+
+    def remove(self, doc_id):
+        text = self.texts.pop(doc_id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            postings = self.postings[trigram]
+            postings.remove(doc_id)
+            if not postings:
+                del self.postings[trigram]
+
+    def search(self, query, threshold, limit=None):
+        """[(similarity, doc id)] above the threshold, most similar first"""
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        needed = max(1, math.ceil(threshold * len(query_trigrams)))
+        rarest = sorted(query_trigrams, key=lambda trigram: len(self.postings.get(trigram, ())))
+        candidates = set()
+        for trigram in rarest[:len(query_trigrams) - needed + 1]:
+            candidates.update(self.postings.get(trigram, ()))
+
+        matches = []
+        for doc_id in candidates:
+            score = similarity(query_trigrams, trigrams(self.texts[doc_id]))
+            if score >= threshold:
+                matches.append((score, doc_id))
+        if limit is None:
+            return sorted(matches, reverse=True)
+        return heapq.nlargest(limit, matches)
+
+
+class WordSimilarityIndex:
+    """
+    Fuzzy matching of the words of longer texts (descriptions, questions),
+    the in-process counterpart of pg_trgm's word_similarity. Every query
+    term is compared with the vocabulary, and a document scores the mean,
+    over the query terms, of the best similarity of one of its terms.
+
+    postings is {term: doc ids} of an InvertedIndex and is shared with it,
+    only the vocabulary is kept here. Terms that are no longer in the
+    postings just stop matching, they are dropped on the next rebuild.
+    """
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.vocabulary = TrigramIndex()
+
+    def add_terms(self, terms):
+        for term in terms:
+            if term not in self.vocabulary:
+                self.vocabulary.add(term, term)
+
+    def scores(self, query_terms, threshold):
+        """{doc id: similarity} of the documents reaching the threshold"""
+        query_terms = set(query_terms)
+        scores = defaultdict(float)
+        for query_term in query_terms:
+            best = {}
+            for score, term in self.vocabulary.search(query_term, threshold):
+                for doc_id in self.postings.get(term, ()):
+                    if score > best.get(doc_id, 0.0):
+                        best[doc_id] = score
+            for doc_id, score in best.items():
+                scores[doc_id] += score / len(query_terms)
+        return {doc_id: score for doc_id, score in scores.items() if score >= threshold}
@@ -1,7 +1,10 @@
+import copy
+import math
 import random
 
 from django.db.utils import IntegrityError
 from rest_framework import serializers
+from rest_framework.utils.field_mapping import get_nested_relation_kwargs
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, AuthUser
 from rest_framework_simplejwt.tokens import Token
 from django.contrib.auth.password_validation import validate_password
@@ -96,67 +99,89 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+class PrecompiledModelSerializer(serializers.ModelSerializer):
+    """
+        ModelSerializer that introspects its model only once per class.
+        The fields built for the first instance are kept on the class
+        and every later instance gets a deep copy of them, which is a
+        lot cheaper than rebuilding the nested depth serializers.
+        Nothing here may depend on the request, use separate read and
+        write classes instead. The one exception is `selection` (see
+        api/fieldsets.py), it's applied to the copies.
+    """
+
+    def __init__(self, *args, selection=None, **kwargs):
+        self.selection = selection
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        cls = type(self)
+        fields = cls.__dict__.get('_compiled_fields')
+        if fields is None:
+            fields = super().get_fields()
+            cls._compiled_fields = fields
+        if self.selection is not None:
+            return self.selection.apply(self, fields, copy.deepcopy)
+        return copy.deepcopy(fields)
+
+    def build_nested_field(self, field_name, relation_info, nested_depth):
+        # Same as ModelSerializer's, but the nested serializers are precompiled too
+        class NestedSerializer(PrecompiledModelSerializer):
+            class Meta:
+                model = relation_info.related_model
+                depth = nested_depth - 1
+                fields = '__all__'
+
+        return NestedSerializer, get_nested_relation_kwargs(relation_info)
+
+
 # In this example, UserSerializer and
 # ProfileSerializer act as DTOs by
 # specifying only a subset of fields
 # to be serialized and deserialized.
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(PrecompiledModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(PrecompiledModelSerializer):
     class Meta:
         model = Profile
         fields = '__all__'
 
 
 # ---------MODEL SERIALIZERS----------------
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(PrecompiledModelSerializer):
     class Meta:
         fields = ['title', 'image', 'slug', 'course_count']
         model = api_models.Category
 
 
-class TeacherSerializer(serializers.ModelSerializer):
+class TeacherSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = ['user', 'image', 'full_name', 'bio', 'facebook', 'x', 'linkedin', 'about', 'country', 'students',
                   'courses', 'review']
         model = api_models.Teacher
 
 
-class VariantItemSerializer(serializers.ModelSerializer):
+class VariantItemSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.VariantItem
-
-    def __init__(self, *args, **kwargs):
-        super(VariantItemSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+        depth = 3
 
 
-class VariantSerializer(serializers.ModelSerializer):
+class VariantSerializer(PrecompiledModelSerializer):
     variant_items = VariantItemSerializer(many=True)
 
     class Meta:
         fields = '__all__'
         model = api_models.Variant
+        depth = 3
 
-    def __init__(self, *args, **kwargs):
-        super(VariantSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
 
-
-class QuestionAnswerMessageSerializer(serializers.ModelSerializer):
+class QuestionAnswerMessageSerializer(PrecompiledModelSerializer):
     profile = ProfileSerializer(many=False)
 
     class Meta:
@@ -164,146 +189,94 @@ class QuestionAnswerMessageSerializer(serializers.ModelSerializer):
         model = api_models.QuestionAnswerMessage
 
 
-class QuestionAnswerSerializer(serializers.ModelSerializer):
+class QuestionAnswerSerializer(PrecompiledModelSerializer):
     messages = QuestionAnswerMessageSerializer(many=True)
     profile = ProfileSerializer(many=False)
 
     class Meta:
-        fields = '__all__'
+        # teacher only keys the teacher's question list, it's the course's teacher
+        exclude = ['teacher']
         model = api_models.QuestionAnswer
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.Cart
+        depth = 3
 
-    def __init__(self, *args, **kwargs):
-        """This method ensures that when I serialize
-        a Course object, the related Teacher object is
-        included in the serialized data, allowing to
-         see the teacher's name in the frontend."""
-        super(CartSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
 
-
-class CartOrderItemSerializer(serializers.ModelSerializer):
+class CartOrderItemSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.CartOrderItem
-
-    def __init__(self, *args, **kwargs):
-        """This method ensures that when I serialize
-        a Course object, the related Teacher object is
-        included in the serialized data, allowing to
-         see the teacher's name in the frontend."""
-        super(CartOrderItemSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+        depth = 3
 
 
-class CartOrderSerializer(serializers.ModelSerializer):
+class CartOrderSerializer(PrecompiledModelSerializer):
     order_items = CartOrderItemSerializer(many=True)
 
     class Meta:
         fields = '__all__'
         model = api_models.CartOrder
-
-    def __init__(self, *args, **kwargs):
-        """This method ensures that when I serialize
-        a Course object, the related Teacher object is
-        included in the serialized data, allowing to
-         see the teacher's name in the frontend."""
-        super(CartOrderSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+        depth = 3
 
 
-class CertificateSerializer(serializers.ModelSerializer):
+class CertificateSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.Certificate
 
 
-class CompletedLessonSerializer(serializers.ModelSerializer):
+class CompletedLessonSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.CompletedLesson
+        depth = 3
 
-    def __init__(self, *args, **kwargs):
-        super(CompletedLessonSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
 
-
-class NoteSerializer(serializers.ModelSerializer):
+class NoteSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.Note
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(PrecompiledModelSerializer):
     profile = ProfileSerializer(many=False)
 
     class Meta:
-        fields = '__all__'
+        # teacher only keys the teacher's review list, it's the course's teacher
+        exclude = ['teacher']
         model = api_models.Review
-
-    def __init__(self, *args, **kwargs):
-        super(ReviewSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+        depth = 3
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.Notification
 
 
-class CouponSerializer(serializers.ModelSerializer):
+class CouponSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.Coupon
 
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.WishList
+        depth = 3
 
-    def __init__(self, *args, **kwargs):
-        super(WishlistSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
 
-
-class CountrySerializer(serializers.ModelSerializer):
+class CountrySerializer(PrecompiledModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.Country
 
 
-class EnrolledCourseSerializer(serializers.ModelSerializer):
+class EnrolledCourseSerializer(PrecompiledModelSerializer):
     lectures = VariantItemSerializer(many=True, read_only=True)
     completed_lesson = CompletedLessonSerializer(many=True, read_only=True)
     curriculum = VariantSerializer(many=True, read_only=True)
@@ -314,21 +287,30 @@ class EnrolledCourseSerializer(serializers.ModelSerializer):
     class Meta:
         fields = '__all__'
         model = api_models.EnrolledCourse
+        depth = 3
+        # See api/fieldsets.py, ?expand=
+        expandable = ('course', 'user', 'teacher', 'order_item', 'lectures', 'completed_lesson', 'curriculum',
+                      'note', 'question_answer', 'review')
+
+
+class EnrolledCourseCardSerializer(PrecompiledModelSerializer):
+    """An enrollment on the student dashboard, from EnrolledCourse.objects.with_progress()"""
+    course_id = serializers.IntegerField(source='course.id', read_only=True)
+    slug = serializers.SlugField(source='course.slug', read_only=True)
+    title = serializers.CharField(source='course.title', read_only=True)
+    image = serializers.FileField(source='course.image', read_only=True)
+    total_lectures = serializers.IntegerField(read_only=True)
+    completed_lessons = serializers.IntegerField(read_only=True)
+    progress = serializers.IntegerField(read_only=True)
+    last_activity = serializers.DateTimeField(read_only=True)
 
-    def __init__(self, *args, **kwargs):
-        """This method ensures that when I serialize
-        a Course object, the related Teacher object is
-        included in the serialized data, allowing to
-         see the teacher's name in the frontend."""
-        super(EnrolledCourseSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+    class Meta:
+        fields = ['enrollment_id', 'date', 'course_id', 'slug', 'title', 'image', 'total_lectures',
+                  'completed_lessons', 'progress', 'last_activity']
+        model = api_models.EnrolledCourse
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(PrecompiledModelSerializer):
     # students will become an array of students
     """CourseSerializer class is a model serializer
      for the Course model, which includes various fields
@@ -368,22 +350,148 @@ class CourseSerializer(serializers.ModelSerializer):
             'reviews'
         ]
         model = api_models.Course
+        depth = 3
+        # See api/fieldsets.py, ?expand=
+        expandable = ('category', 'teacher', 'students', 'curriculum', 'lectures', 'reviews')
+
+    def get_average_rating(self, obj):
+        return obj.average_rating()
+
+
+# ---------WRITE SERIALIZERS----------------
+# The serializers above render related objects nested (depth 3). POST
+# endpoints take primary keys for them instead, so they use these depth 0
+# variants. They are separate classes so that each one keeps its own
+# precompiled fields.
+class CartWriteSerializer(CartSerializer):
+    class Meta(CartSerializer.Meta):
+        depth = 0
+
+
+class CartOrderWriteSerializer(CartOrderSerializer):
+    class Meta(CartOrderSerializer.Meta):
+        depth = 0
+
+
+class CompletedLessonWriteSerializer(CompletedLessonSerializer):
+    class Meta(CompletedLessonSerializer.Meta):
+        depth = 0
+
+
+class ReviewWriteSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
+        depth = 0
+
+
+class WishlistWriteSerializer(WishlistSerializer):
+    class Meta(WishlistSerializer.Meta):
+        depth = 0
+
+
+class CourseWriteSerializer(CourseSerializer):
+    class Meta(CourseSerializer.Meta):
+        depth = 0
+
+
+# ---------PUBLIC COURSE DETAIL----------------
+# What anonymous visitors see of a course. Unlike CourseSerializer it
+# doesn't walk the enrollments, so the payload only depends on the size
+# of the curriculum. Use with Course.objects.for_public_detail().
+class PublicCategorySerializer(PrecompiledModelSerializer):
+    class Meta:
+        fields = ['title', 'image', 'slug']
+        model = api_models.Category
+
+
+class PublicTeacherSerializer(PrecompiledModelSerializer):
+    course_count = serializers.IntegerField(source='published_courses', read_only=True)
+    student_count = serializers.IntegerField(source='total_students', read_only=True)
+
+    class Meta:
+        fields = ['full_name', 'image', 'bio', 'about', 'country', 'facebook', 'x', 'linkedin',
+                  'course_count', 'student_count']
+        model = api_models.Teacher
 
-    def __init__(self, *args, **kwargs):
-        """This method ensures that when I serialize
-        a Course object, the related Teacher object is
-        included in the serialized data, allowing to
-         see the teacher's name in the frontend."""
-        super(CourseSerializer, self).__init__(*args, **kwargs)
-        request = self.context.get("request")
-        if request and request.method == "POST":
-            self.Meta.depth = 0
-        else:
-            self.Meta.depth = 3
+
+class PublicLectureSerializer(PrecompiledModelSerializer):
+    class Meta:
+        fields = ['variant_item_id', 'title', 'description', 'content_duration', 'preview', 'file']
+        model = api_models.VariantItem
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Only preview lectures can be watched before enrolling
+        if not instance.preview:
+            data['file'] = None
+        return data
+
+
+class PublicSectionSerializer(PrecompiledModelSerializer):
+    lectures = PublicLectureSerializer(source='variant_items', many=True, read_only=True)
+
+    class Meta:
+        fields = ['variant_id', 'title', 'lectures']
+        model = api_models.Variant
+
+
+class CoursePublicDetailSerializer(PrecompiledModelSerializer):
+    category = PublicCategorySerializer(read_only=True)
+    teacher = PublicTeacherSerializer(read_only=True)
+    curriculum = PublicSectionSerializer(many=True, read_only=True)
+    preview_lectures = PublicLectureSerializer(many=True, read_only=True)
+    average_rating = serializers.SerializerMethodField()
+    rating_count = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    student_count = serializers.IntegerField(source='enrollment_count', read_only=True)
+    lecture_count = serializers.SerializerMethodField()
+
+    class Meta:
+        fields = [
+            'id',
+            'category',
+            'teacher',
+            'image',
+            'file',
+            'title',
+            'description',
+            'price',
+            'language',
+            'level',
+            'featured',
+            'course_id',
+            'slug',
+            'date',
+            'curriculum',
+            'preview_lectures',
+            'lecture_count',
+            'average_rating',
+            'rating_count',
+            'rating_histogram',
+            'student_count',
+        ]
+        model = api_models.Course
 
     def get_average_rating(self, obj):
         return obj.average_rating()
 
+    def get_lecture_count(self, obj):
+        return len(obj.lectures())
+
+
+class LectureHeartbeatSerializer(serializers.Serializer):
+    enrollment_id = serializers.CharField()
+    variant_item_id = serializers.CharField()
+    position = serializers.FloatField(min_value=0)  # seconds
+    # Only used until the lecture's own duration is probed
+    duration = serializers.FloatField(min_value=0, required=False, default=0)
+
+    def validate_position(self, value):
+        if not math.isfinite(value):
+            raise serializers.ValidationError("Must be a number of seconds")
+        return value
+
+    validate_duration = validate_position
+
 
 class StudentSummarySerializer(serializers.Serializer):
     total_courses = serializers.IntegerField(default=0)
@@ -393,6 +501,14 @@ class StudentSummarySerializer(serializers.Serializer):
     wishlist_course_id = serializers.ListField(child=serializers.IntegerField(), default=[])
 
 
+class TeacherStudentSerializer(PrecompiledModelSerializer):
+    image = serializers.CharField(source='image.url')
+
+    class Meta:
+        fields = ['full_name', 'image', 'country', 'date']
+        model = Profile
+
+
 class TeacherSummarySerializer(serializers.Serializer):
     total_courses = serializers.IntegerField(default=0)
     total_students = serializers.IntegerField(default=0)
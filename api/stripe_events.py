@@ -0,0 +1,141 @@
+"""
+Stripe webhook inbox.
+
+The webhook only checks the Stripe-Signature of the body and stores the
+event in StripeEvent, as it was signed (a redelivered event is stored
+once), then answers. The worker handles the stored events in the order
+they were received: a paid checkout session fulfills its order
+(api/fulfillment.py). An event that fails is retried on the next run, up
+to STRIPE_EVENT_MAX_ATTEMPTS times, with its error kept on the row.
+
+The worker is a thread of the process that received the event, woken on
+every event and running every STRIPE_EVENT_INTERVAL seconds; `manage.py
+process_stripe_events` runs it as a separate process. Fulfillment is
+idempotent, several workers at once are fine.
+"""
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api import models as api_models
+from api.fulfillment import fulfill_order
+from api.payments import get_stripe
+
+logger = logging.getLogger(__name__)
+
+# The checkout events that can carry a paid session. A session paid with a
+# delayed method completes unpaid and is paid by the second one.
+PAYMENT_EVENTS = {'checkout.session.completed', 'checkout.session.async_payment_succeeded'}
+
+
+class InvalidEvent(Exception):
+    pass
+
+
+def receive_event(payload, signature):
+    """
+    Stores the webhook's body if its signature is valid, raises
+    InvalidEvent otherwise. Returns whether the event is new.
+    """
+    stripe = get_stripe()
+    try:
+        payload = payload.decode('utf-8')
+        stripe.WebhookSignature.verify_header(
+            payload, signature, settings.STRIPE_WEBHOOK_SECRET,
+            getattr(settings, 'STRIPE_WEBHOOK_TOLERANCE', 300),
+        )
+        event = json.loads(payload)
+        event_id, event_type = event['id'], event['type']
+        object_id = event['data']['object'].get('id') or ''
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError, ValueError, KeyError,
+            TypeError, AttributeError) as e:
+        raise InvalidEvent(str(e))
+
+    _, created = api_models.StripeEvent.objects.get_or_create(event_id=event_id, defaults={
+        'type': event_type, 'object_id': object_id, 'payload': payload,
+    })
+    if created:
+        transaction.on_commit(worker.wake)
+    return created
+
+
+def handle_event(event):
+    if event.type not in PAYMENT_EVENTS:
+        return
+    session = json.loads(event.payload)['data']['object']
+    if session.get('payment_status') != 'paid':
+        return
+    order = api_models.CartOrder.objects.filter(stripe_session_id=session['id']).first()
+    if order is None and session.get('client_reference_id'):
+        order = api_models.CartOrder.objects.filter(oid=session['client_reference_id']).first()
+    if order is None:
+        raise LookupError(f"No order for the checkout session {session['id']}")
+    fulfill_order(order, 'stripe', session['id'])
+
+
+def process_events(object_id=None, limit=100):
+    """
+    Handles the pending events, oldest first, only those of one Stripe
+    object if object_id is given. Returns how many were handled.
+    """
+    pending = api_models.StripeEvent.objects.filter(
+        processed__isnull=True, attempts__lt=getattr(settings, 'STRIPE_EVENT_MAX_ATTEMPTS', 5),
+    )
+    if object_id is not None:
+        pending = pending.filter(object_id=object_id)
+
+    handled = 0
+    for pk in list(pending.order_by('received', 'id').values_list('id', flat=True)[:limit]):
+        with transaction.atomic():
+            # Another worker has it, or had it
+            event = api_models.StripeEvent.objects.select_for_update(skip_locked=True).filter(
+                pk=pk, processed__isnull=True).first()
+            if event is None:
+                continue
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    handle_event(event)
+            except Exception as e:
+                logger.exception("Handling the Stripe event %s failed", event.event_id)
+                event.error = repr(e)
+                event.save(update_fields=['attempts', 'error'])
+                continue
+            event.processed = timezone.now()
+            event.error = ''
+            event.save(update_fields=['attempts', 'error', 'processed'])
+            handled += 1
+    return handled
+
+
+class EventWorker:
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='stripe-events')
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, 'STRIPE_EVENT_INTERVAL', 5))
+            self._wake.clear()
+            try:
+                process_events()
+            except Exception:
+                logger.exception("Processing the Stripe events failed")
+            finally:
+                connection.close()
+
+
+worker = EventWorker()
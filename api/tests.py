@@ -1,3 +1,141 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import ThreadingHTTPServer
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from api import models as api_models
+from api.management.commands.payment_load_test import HOST, FakePayments
+from api.payments import PayPalClient, PayPalError
+from api.stripe_events import process_events
+from userauths.models import User
+
+WEBHOOK_SECRET = 'whsec_test'
+
+
+def signed_event(event_id, session, secret=WEBHOOK_SECRET, event_type='checkout.session.completed'):
+    """A webhook body and its Stripe-Signature header, signed like Stripe does"""
+    payload = json.dumps({'id': event_id, 'object': 'event', 'type': event_type,
+                          'data': {'object': session}})
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return payload, f't={timestamp},v1={signature}'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTest(TestCase):
+
+    def setUp(self):
+        teacher_user = User.objects.create(username='teacher', email='teacher@example.com', full_name='Teacher')
+        teacher = api_models.Teacher.objects.create(user=teacher_user, full_name='Teacher')
+        category = api_models.Category.objects.create(title='Programming')
+        self.course = api_models.Course.objects.create(title='Python', teacher=teacher, category=category,
+                                                       price=Decimal('10'))
+        self.student = User.objects.create(username='student', email='student@example.com', full_name='Student')
+        self.order = api_models.CartOrder.objects.create(student=self.student, full_name='Student',
+                                                         email='student@example.com', total=Decimal('10'),
+                                                         stripe_session_id='cs_test_1')
+        api_models.CartOrderItem.objects.create(order=self.order, course=self.course, teacher=teacher,
+                                                price=Decimal('10'), total=Decimal('10'))
+        self.session = {'id': 'cs_test_1', 'object': 'checkout.session', 'payment_status': 'paid',
+                        'client_reference_id': self.order.oid}
+
+    def post(self, payload, signature):
+        return self.client.post('/api/v1/payment/stripe-webhook/', payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_paid_session_fulfills_the_order(self):
+        payload, signature = signed_event('evt_test_1', self.session)
+        response = self.post(payload, signature)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(api_models.StripeEvent.objects.get().object_id, 'cs_test_1')
+
+        # The webhook only stores the event
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'Processing')
+
+        self.assertEqual(process_events(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'Paid')
+        self.assertTrue(api_models.EnrolledCourse.objects.filter(user=self.student, course=self.course).exists())
+        self.assertEqual(api_models.OrderFulfillment.objects.get(order=self.order).idempotency_key,
+                         'stripe:cs_test_1')
+        self.assertEqual(process_events(), 0)
+
+    def test_redelivered_event_is_stored_once(self):
+        payload, signature = signed_event('evt_test_1', self.session)
+        self.assertEqual(self.post(payload, signature).status_code, 200)
+        self.assertEqual(self.post(payload, signature).status_code, 200)
+        self.assertEqual(api_models.StripeEvent.objects.count(), 1)
+
+        self.assertEqual(process_events(), 1)
+        self.assertEqual(api_models.EnrolledCourse.objects.filter(user=self.student).count(), 1)
+
+    def test_bad_signature_is_rejected(self):
+        payload, signature = signed_event('evt_test_1', self.session, secret='whsec_other')
+        self.assertEqual(self.post(payload, signature).status_code, 400)
+
+        payload, signature = signed_event('evt_test_1', self.session)
+        self.assertEqual(self.post(payload.replace('cs_test_1', 'cs_test_2'), signature).status_code, 400)
+        self.assertEqual(self.post(payload, '').status_code, 400)
+        self.assertFalse(api_models.StripeEvent.objects.exists())
+
+
+class PayPalStub(FakePayments):
+    """PayPal's token and order endpoints, answering the statuses queued on the server"""
+    latency = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.tokens += 1
+        self.answer({'access_token': f'token-{self.server.tokens}', 'expires_in': 32400})
+
+    def do_GET(self):
+        self.server.authorizations.append(self.headers['Authorization'])
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.answer({'id': self.path.rsplit('/', 1)[1], 'status': 'COMPLETED'}, status)
+
+
+class PayPalClientTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer((HOST, 0), PayPalStub)
+        self.server.daemon_threads = True
+        self.server.tokens, self.server.authorizations, self.server.statuses = 0, [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = PayPalClient('client-id', 'secret', f'http://{HOST}:{self.server.server_port}',
+                                   timeout=5, max_retries=2, backoff=0)
+
+    def test_token_is_cached(self):
+        self.assertEqual(self.client.get_order('ORDER-1')['id'], 'ORDER-1')
+        self.assertEqual(self.client.get_order('ORDER-2')['id'], 'ORDER-2')
+        self.assertEqual(self.server.tokens, 1)
+        self.assertEqual(self.server.authorizations, ['Bearer token-1', 'Bearer token-1'])
+
+    def test_revoked_token_is_refreshed_once(self):
+        self.server.statuses = [401]
+        self.assertEqual(self.client.get_order('ORDER-1')['status'], 'COMPLETED')
+        self.assertEqual(self.server.tokens, 2)
+        self.assertEqual(self.server.authorizations, ['Bearer token-1', 'Bearer token-2'])
+
+        self.server.statuses = [401, 401]
+        with self.assertRaises(PayPalError):
+            self.client.get_order('ORDER-2')
+        self.assertEqual(self.server.tokens, 3)
+
+    def test_server_errors_are_retried(self):
+        self.server.statuses = [503, 502]
+        self.assertEqual(self.client.get_order('ORDER-1')['status'], 'COMPLETED')
+        self.assertEqual(len(self.server.authorizations), 3)
+
+        self.server.statuses = [503] * 3
+        with self.assertRaises(PayPalError) as raised:
+            self.client.get_order('ORDER-2')
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(len(self.server.authorizations), 6)
@@ -66,18 +66,27 @@ urlpatterns = [
     path("course/cart-list/<cart_id>/", CartListAPIView.as_view()),
     path("course/cart-item-delete/<cart_id>/<item_id>", CartItemDeleteAPIView.as_view()),
     path("course/search/", SearchCourseAPIView.as_view()),
+    path("course/autocomplete/", CourseAutocompleteAPIView),
+    path("course/filter/", CourseFilterAPIView.as_view()),
     path("cart/stats/<cart_id>/", CartStatsAPIView.as_view()),
     path("order/create-order/", CreateOrderAPIView.as_view()),
     path("order/checkout/<oid>/", CheckOutAPIView.as_view()),
     path("order/coupon/", CouponApplyAPIView.as_view()),
     path("payment/stripe-checkout/<order_oid>/", StripeCheckoutAPIView.as_view()),
     path("payment/payment-success/", PaymentSuccessAPIView.as_view()),
+    path("payment/stripe-webhook/", StripeWebhookAPIView.as_view()),
+    # The same, async, for the ASGI workers
+    path("payment/async/stripe-checkout/<order_oid>/", AsyncStripeCheckoutAPIView),
+    path("payment/async/payment-success/", AsyncPaymentSuccessAPIView),
 
     # Students API Endpoints
     path('student/enrolled-courses/', EnrolledCoursesAPIView.as_view()),
+    path('student/enrolled-courses/cards/', EnrolledCourseCardsAPIView.as_view()),
     path('student/summary/', StudentSummaryAPIViewNoIdPass.as_view()),
     path('student/course-detail/<enrollment_id>/', StudentCourseDetailAPIView.as_view()),
     path('student/course-completed/', StudentCourseCompletedCreateAPIView.as_view()),
+    path('student/lecture-progress/', StudentLectureProgressAPIView.as_view()),
+    path('student/lecture-progress/<enrollment_id>/', StudentLectureProgressAPIView.as_view()),
     path('student/course-note/<enrollment_id>/', StudentNoteCreateAPIView.as_view()),
     path('student/course-note-detail/<enrollment_id>/<note_id>/', StudentNoteDetailAPIView.as_view()),
     path('student/rate-course/', StudentRateCourseCreateAPIView.as_view()),
@@ -93,6 +102,7 @@ urlpatterns = [
     path('teacher/review-detail/<review_id>', TeacherReviewDetailAPIView.as_view()),
     path('teacher/students-list/', TeacherStudentsListAPIView.as_view({'get': 'list'})),
     path('teacher/all-months-earning/', TeacherAllMonthsEarningAPIView),
+    path('teacher/earnings/', TeacherEarningsAPIView),
     path('teacher/best-course-earning/', TeacherBestSellingCourseAPIView.as_view({'get': 'list'})),
     path('teacher/course-order-list/', TeacherCourseOrdersListAPIView.as_view()),
     path('teacher/question-answer-list/', TeacherQuestionAnswerListAPIView.as_view()),
@@ -1,10 +1,10 @@
 import random
 
-import jwt
 import logging
-from django.conf import settings
 from django.contrib.auth import get_user_model
 
+from api.authentication import resolve_request_user
+
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
@@ -15,20 +15,27 @@ def generate_random_otp(length=7):
 
 
 def get_user_from_request(request):
-    token = request.COOKIES.get('access_token') or request.COOKIES.get('refresh_token')
-    if not token:
-        logger.debug("No token found in cookies")
-        return None
-    try:
-        decoded_data = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=["HS256"])
-        user_id = decoded_data.get('user_id')
-        logger.debug(f"Decoded user_id from token: {user_id}")
-        user = User.objects.get(id=user_id)
-        logger.debug(f"User found: {user}")
-        return user
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError) as e:
-        logger.error(f"Token error: {e}")
-        return None
-    except User.DoesNotExist:
-        logger.error("User does not exist")
+    # The token is decoded and the user loaded once per request,
+    # repeated calls from the same view are free
+    user = resolve_request_user(request)
+    logger.debug(f"User found: {user}")
+    return user
+
+
+def get_teacher_from_request(request):
+    """Returns the Teacher of the request's user. The teacher comes with the
+    user in the same query, so this doesn't hit the database again."""
+    user = get_user_from_request(request)
+    if not user:
+        raise ValueError('No user found')
+    teacher = getattr(user, 'teacher', None)
+    if not teacher:
+        raise ValueError('No teacher found')
+    return teacher
+
+
+def get_profile_from_request(request):
+    user = get_user_from_request(request)
+    if not user:
         return None
+    return user.profile
@@ -2,5 +2,6 @@ from .authentication_views import *
 from .course_views import *
 from .cart_views import *
 from .order_views import *
+from .payment_async_views import *
 from .student_views import *
 from .teacher_views import *
@@ -7,16 +7,11 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.conf import settings
-from api import models as api_models
 
 from api.serializer import ProfileSerializer
-from api.utils import generate_random_otp, get_user_from_request
-from userauths.models import User, Profile
+from api.utils import generate_random_otp, get_profile_from_request
+from userauths.models import User
 from api import serializer as api_serializer
-from environs import Env
-
-env = Env()
-env.read_env()
 
 
 class MyTokenObtainPairView(TokenObtainPairView):
@@ -43,7 +38,7 @@ class PasswordResetEmailVerifyAPIView(generics.RetrieveAPIView):
             user.refresh_token = refresh_token
             user.otp = generate_random_otp()
             user.save()
-            link = f"{env('FRONT_END_ROUTE_URL')}/create-new-password/?otp={user.otp}&uuidb64={uuidb64}&refresh_token={refresh_token}"
+            link = f"{settings.FRONT_END_ROUTE_URL}/create-new-password/?otp={user.otp}&uuidb64={uuidb64}&refresh_token={refresh_token}"
             merge_data = {"link": link, "username": user.username}
             subject = "Password Reset Email"
             text_body = render_to_string("email/password_reset.txt", merge_data)
@@ -102,11 +97,10 @@ class UserDetailAPIView(generics.RetrieveAPIView):
     serializer_class = ProfileSerializer
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if not user:
+        profile = get_profile_from_request(self.request)
+        if not profile:
             return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        profile = api_models.Profile.objects.get(user=user)
         return profile
 
 
@@ -115,10 +109,10 @@ class ProfileApiView(generics.RetrieveUpdateAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if not user:
+        profile = get_profile_from_request(self.request)
+        if not profile:
             return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-        return Profile.objects.get(user=user)
+        return profile
 
     # Delete the old image
     def update(self, request, *args, **kwargs):
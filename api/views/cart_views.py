@@ -5,12 +5,13 @@ from rest_framework.response import Response
 from decimal import Decimal
 from api import models as api_models
 from api import serializer as api_serializer
+from api.pagination import DateCursorPagination
 from api.utils import User
 
 
 class CartAPIView(generics.CreateAPIView):
     queryset = api_models.Cart.objects.all()
-    serializer_class = api_serializer.CartSerializer
+    serializer_class = api_serializer.CartWriteSerializer
     permission_classes = [AllowAny]
 
     def create(self, request, *args, **kwargs):
@@ -59,7 +60,7 @@ class CreateOrderAPIView(generics.CreateAPIView):
         "user_id": 1
     }
     """
-    serializer_class = api_serializer.CartOrderSerializer
+    serializer_class = api_serializer.CartOrderWriteSerializer
     permission_classes = [AllowAny]
     queryset = api_models.CartOrder.objects.all()
 
@@ -75,44 +76,9 @@ class CreateOrderAPIView(generics.CreateAPIView):
         else:
             user = None
 
-        cart_items = api_models.Cart.objects.filter(cart_id=cart_id)
-
-        total_price = Decimal(0.00)
-        total_tax = Decimal(0.00)
-        total_initial_total = Decimal(0.00)
-        total_total = Decimal(0.00)
-
-        order = api_models.CartOrder.objects.create(
-            full_name=full_name,
-            email=email,
-            country=country,
-            student=user
+        order = api_models.CartOrder.objects.create_from_cart(
+            cart_id, student=user, full_name=full_name, email=email, country=country,
         )
-
-        for c in cart_items:
-            api_models.CartOrderItem.objects.create(
-                order=order,
-                course=c.course,
-                price=c.price,
-                tax_fee=c.tax_fee,
-                total=c.total,
-                initial_total=c.total,
-                teacher=c.course.teacher
-            )
-
-            total_price += Decimal(c.price)
-            total_tax += Decimal(c.tax_fee)
-            total_initial_total += Decimal(c.total)
-            total_total += Decimal(c.total)
-
-            order.teachers.add(c.course.teacher)
-
-        order.sub_total = total_price
-        order.tax_fee = total_tax
-        order.initial_total = total_initial_total
-        order.total = total_total
-        order.save()
-
         return Response({"message": "Order created successfully", 'order_oid': order.oid}, status.HTTP_201_CREATED)
 
 
@@ -186,6 +152,7 @@ class CouponApplyAPIView(generics.CreateAPIView):
 class CartListAPIView(generics.ListAPIView):
     serializer_class = api_serializer.CartSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
         cart_id = self.kwargs['cart_id']
@@ -270,6 +237,7 @@ class CartStatsAPIView(generics.RetrieveAPIView):
 class CartOwnAPIView(generics.ListAPIView):
     serializer_class = api_serializer.CartSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
         cart_id = self.kwargs['cart_id']
@@ -1,54 +1,128 @@
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.utils.cache import patch_cache_control
 from rest_framework import generics, status
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from django.db.models import Avg
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
 
 import api.models
 from api import models as api_models
 from api import serializer as api_serializer
-from api.utils import get_user_from_request
+from api.fieldsets import FieldSelectionMixin
+from api.pagination import DateCursorPagination, SearchPagination
+from api.ranking import best_courses
+from api.search import autocomplete, filter_courses, search_courses
+from api.search.facets import FACETS, RATINGS
+from api.utils import get_teacher_from_request
 
 
-class CourseListAPIView(generics.ListAPIView):
-    queryset = api_models.Course.objects.filter(platform_status="Published", teacher_course_status="Published")
+class CourseListAPIView(FieldSelectionMixin, generics.ListAPIView):
     serializer_class = api_serializer.CourseSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
+    def get_queryset(self):
+        return api_models.Course.objects.filter(
+            platform_status="Published", teacher_course_status="Published"
+        ).for_serializer(self.field_selection)
 
-class BestCoursesListAPIView(generics.ListAPIView):
+
+class BestCoursesListAPIView(FieldSelectionMixin, generics.ListAPIView):
     serializer_class = api_serializer.CourseSerializer
     permission_classes = [AllowAny]
 
     def get_queryset(self):
-        return api_models.Course.objects.filter(
-            platform_status="Published",
-            teacher_course_status="Published"
-        ).annotate(
-            avg_rating=Avg('review__rating')
-        ).order_by('-avg_rating')[:4]
+        """
+        Served from the ranked snapshot (api/ranking.py).
+        Optional: ?category=<category slug>&language=English&limit=4
+        """
+        category_id = None
+        category_slug = self.request.query_params.get('category')
+        if category_slug:
+            category_id = api_models.Category.objects.filter(slug=category_slug).values_list('id', flat=True).first()
+            if category_id is None:
+                return []
+
+        try:
+            limit = int(self.request.query_params.get('limit', 4))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be a number'})
+        limit = min(max(limit, 1), settings.BEST_COURSES_SNAPSHOT_SIZE)
+
+        return best_courses(category_id, self.request.query_params.get('language') or None, limit,
+                            self.field_selection)
 
 
 class CourseDetailAPIView(generics.RetrieveDestroyAPIView):
-    serializer_class = api_serializer.CourseSerializer
+    serializer_class = api_serializer.CoursePublicDetailSerializer
     permission_classes = [AllowAny]
 
     def get_object(self):
         slug = self.kwargs['slug']
-        return api_models.Course.objects.get(slug=slug, platform_status="Published", teacher_course_status="Published")
+        return api_models.Course.objects.for_public_detail().get(slug=slug, platform_status="Published",
+                                                                 teacher_course_status="Published")
 
 
-class SearchCourseAPIView(generics.ListAPIView):
+class SearchCourseAPIView(FieldSelectionMixin, generics.ListAPIView):
+    """
+    BM25 ranked search over the title, description, category and teacher
+    of the published courses. ?query=python&page=1&page_size=12
+    """
     serializer_class = api_serializer.CourseSerializer
     permission_classes = [AllowAny]
+    pagination_class = SearchPagination
 
     def get_queryset(self):
-        query = self.request.GET.get('query')
-        return api_models.Course.objects.filter(
-            title__icontains=query,
-            platform_status="Published",
-            teacher_course_status="Published"
-        )
+        return search_courses(self.request.GET.get('query', ''), self.field_selection)
+
+
+class CourseFilterAPIView(FieldSelectionMixin, generics.ListAPIView):
+    """
+    Published courses filtered by facets, newest first, with the number of
+    courses of every facet value. Comma separated values are OR'ed:
+    ?category=<slug>,<slug>&level=Beginner&language=English&price=free,0-20&rating=4
+    The prices are free, 0-20, 20-50, 50-100 and 100+, rating=4 is 4 stars and up.
+    """
+    serializer_class = api_serializer.CourseSerializer
+    permission_classes = [AllowAny]
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        selected = {}
+        for facet in FACETS:
+            values = [value.strip() for value in self.request.query_params.get(facet, '').split(',') if value.strip()]
+            if values:
+                selected[facet] = values
+        if any(stars not in RATINGS for stars in selected.get('rating', ())):
+            raise ValidationError({'rating': f"Expected one of {', '.join(RATINGS)}"})
+        self.results = filter_courses(selected, self.field_selection)
+        return self.results
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data['facets'] = self.results.facets
+        return response
+
+
+@api_view(('GET',))
+@permission_classes([AllowAny])
+def CourseAutocompleteAPIView(request):
+    """
+    Suggestions for the search box: courses, categories and teachers whose
+    name has a word starting with ?q=, most popular first. ?limit= (max 10)
+    """
+    max_results = settings.AUTOCOMPLETE_MAX_RESULTS
+    try:
+        limit = min(max(int(request.query_params.get('limit', max_results)), 1), max_results)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be a number'})
+
+    response = Response(autocomplete(request.query_params.get('q', ''), limit))
+    # Every keystroke is a request, let the browser reuse recent ones
+    patch_cache_control(response, public=True, max_age=60)
+    return response
 
 
 class CategoryListAPIView(generics.ListAPIView):
@@ -70,7 +144,7 @@ def strtobool(val):
 
 class CourseCreateAPIView(generics.CreateAPIView):
     queryset = api_models.Course.objects.all()
-    serializer_class = api_serializer.CourseSerializer
+    serializer_class = api_serializer.CourseWriteSerializer
     permission_classes = [AllowAny]
 
     def perform_create(self, serializer):
@@ -131,13 +205,7 @@ class CourseUpdateAPIView(generics.RetrieveUpdateAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         course_id = self.kwargs['course_id']
         course = api.models.Course.objects.get(id=course_id)
@@ -271,13 +339,7 @@ class CourseVariantDeleteAPIView(generics.DestroyAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
         variant_id = self.kwargs['variant_id']
         course_id = self.kwargs['course_id']
 
@@ -290,13 +352,7 @@ class CourseVariantItemDeleteAPIView(generics.DestroyAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
         variant_id = self.kwargs['variant_id']
         course_id = self.kwargs['course_id']
         variant_item_id = self.kwargs['variant_item_id']
@@ -1,27 +1,22 @@
-import requests
-import stripe
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
 from django.shortcuts import redirect
 from rest_framework import generics, status
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from api import models as api_models
 from api import serializer as api_serializer
-from decimal import Decimal
+from api.payments import PayPalError, get_paypal, get_stripe
+from api.fulfillment import ReferenceAlreadyUsed, fulfill_order
+from api.stripe_events import InvalidEvent, process_events, receive_event
 
 from api.utils import User
-from backend import settings
-from environs import Env
-
-env = Env()
-env.read_env()
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-PAYPAL_CLIENT_ID = settings.PAYPAL_CLIENT_ID
-PAYPAL_SECRET_ID = settings.PAYPAL_SECRET_ID
 
 
 class CreateOrderAPIView(generics.CreateAPIView):
-    serializer_class = api_serializer.CartOrderSerializer
+    serializer_class = api_serializer.CartOrderWriteSerializer
     permission_classes = [AllowAny]
     queryset = api_models.CartOrder.objects.all()
 
@@ -32,42 +27,84 @@ class CreateOrderAPIView(generics.CreateAPIView):
         cart_id = request.data['cart_id']
         user_id = request.data['user_id']
         user = User.objects.get(id=user_id) if user_id != 0 else None
-        cart_items = api_models.Cart.objects.filter(cart_id=cart_id)
-        total_price = Decimal(0.00)
-        total_tax = Decimal(0.00)
-        total_initial_total = Decimal(0.00)
-        total_total = Decimal(0.00)
-        order = api_models.CartOrder.objects.create(
-            full_name=full_name,
-            email=email,
-            country=country,
-            student=user
+
+        order = api_models.CartOrder.objects.create_from_cart(
+            cart_id, student=user, full_name=full_name, email=email, country=country,
         )
-        for c in cart_items:
-            api_models.CartOrderItem.objects.create(
-                order=order,
-                course=c.course,
-                price=c.price,
-                tax_fee=c.tax_fee,
-                total=c.total,
-                initial_total=c.total,
-                teacher=c.course.teacher
-            )
-            total_price += Decimal(c.price)
-            total_tax += Decimal(c.tax_fee)
-            total_initial_total += Decimal(c.total)
-            total_total += Decimal(c.total)
-            order.teachers.add(c.course.teacher)
-        order.sub_total = total_price
-        order.tax_fee = total_tax
-        order.initial_total = total_initial_total
-        order.total = total_total
-        order.save()
         return Response({"message": "Order created successfully", 'order_oid': order.oid}, status.HTTP_201_CREATED)
 
 
+def checkout_session_params(order):
+    """The Stripe checkout session of the order, for the sync and async checkout views"""
+    return dict(
+        customer_email=order.email,
+        client_reference_id=order.oid,
+        payment_method_types=['card'],
+        line_items=[
+            {
+                'price_data': {
+                    'currency': 'eur',
+                    'product_data': {
+                        'name': order.full_name,
+                    },
+                    'unit_amount': int(order.total * 100)
+                },
+                'quantity': 1
+            }
+        ],
+        mode='payment',
+        success_url=settings.FRONT_END_ROUTE_URL + '/payment-success/' + order.oid + '?session_id={CHECKOUT_SESSION_ID}',
+        cancel_url=settings.FRONT_END_ROUTE_URL + '/payment-failed/'
+    )
+
+
+def stripe_payment_status(order, session_id):
+    """
+    The payment success message of an order paid through Stripe, when the
+    webhook fulfills the orders. Only an event that was received but not
+    handled yet is handled here, Stripe isn't called.
+    """
+    if order.payment_status == 'Processing' and order.stripe_session_id == session_id:
+        process_events(object_id=session_id)
+        order.refresh_from_db(fields=['payment_status'])
+    if order.payment_status == 'Paid':
+        return 'Payment Successful'
+    elif order.payment_status == 'Processing':
+        return 'Payment Pending'
+    else:
+        return 'Payment Failed'
+
+
+def stripe_session_matches(order, session_id, session):
+    """Whether the checkout session was created for the order, not for another one"""
+    return order.stripe_session_id == session_id or session.get('client_reference_id') == order.oid
+
+
+def paypal_order_matches(order, paypal_order):
+    """Whether the PayPal order, created by the front end, pays the order's total"""
+    try:
+        paid = sum(Decimal(unit['amount']['value']) for unit in paypal_order['purchase_units'])
+    except (KeyError, TypeError, InvalidOperation):
+        return False
+    return paid == order.total
+
+
+def fulfill_payment(order, provider, reference):
+    """
+    The payment success message and status of an order whose payment was
+    confirmed, for the sync and async views. A payment that already paid
+    another order fails.
+    """
+    try:
+        if fulfill_order(order, provider, reference):
+            return 'Payment Successful', status.HTTP_200_OK
+        return 'Already Paid', status.HTTP_200_OK
+    except ReferenceAlreadyUsed:
+        return 'Payment Failed', status.HTTP_400_BAD_REQUEST
+
+
 class StripeCheckoutAPIView(generics.CreateAPIView):
-    serializer_class = api_serializer.CartOrderSerializer
+    serializer_class = api_serializer.CartOrderWriteSerializer
     permission_classes = [AllowAny]
 
     def create(self, request, *args, **kwargs):
@@ -77,26 +114,9 @@ class StripeCheckoutAPIView(generics.CreateAPIView):
         if not order:
             return Response({'message': 'Order Not Found'}, status=status.HTTP_404_NOT_FOUND)
 
+        stripe = get_stripe()
         try:
-            checkout_session = stripe.checkout.Session.create(
-                customer_email=order.email,
-                payment_method_types=['card'],
-                line_items=[
-                    {
-                        'price_data': {
-                            'currency': 'eur',
-                            'product_data': {
-                                'name': order.full_name,
-                            },
-                            'unit_amount': int(order.total * 100)
-                        },
-                        'quantity': 1
-                    }
-                ],
-                mode='payment',
-                success_url=settings.FRONT_END_ROUTE_URL + '/payment-success/' + order.oid + '?session_id={CHECKOUT_SESSION_ID}',
-                cancel_url=settings.FRONT_END_ROUTE_URL + '/payment-failed/'
-            )
+            checkout_session = stripe.checkout.Session.create(**checkout_session_params(order))
 
             order.stripe_session_id = checkout_session.id
             order.save()
@@ -107,25 +127,8 @@ class StripeCheckoutAPIView(generics.CreateAPIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
 
-def get_access_token(client_id, secret_key):
-    """Function to get the paypal access
-    token from the frontend using client_id
-    and secret_key"""
-
-    token_url = "https://api.sandbox.paypal.com/v1/oauth2/token"
-    data = {'grant_type': 'client_credentials'}
-    auth = (client_id, secret_key)
-    response = requests.post(token_url, data=data, auth=auth)
-
-    if response.status_code == 200:
-        print('Access Token === ', response.json()['access_token'])
-        return response.json()['access_token']
-    else:
-        raise Exception(f'Failed to get access token from paypal {response.status_code}')
-
-
 class PaymentSuccessAPIView(generics.CreateAPIView):
-    serializer_class = api_serializer.CartOrderSerializer
+    serializer_class = api_serializer.CartOrderWriteSerializer
     queryset = api_models.CartOrder.objects.all()
 
     def create(self, request, *args, **kwargs):
@@ -134,86 +137,45 @@ class PaymentSuccessAPIView(generics.CreateAPIView):
         paypal_order_id = request.data['paypal_order_id']
 
         order = api_models.CartOrder.objects.get(oid=order_oid)
-        order_items = api_models.CartOrderItem.objects.filter(order=order)
 
         # Paypal payment success
         if paypal_order_id != 'null':
-            paypal_api_url = f'https://api-m.sandbox.paypal.com/v2/checkout/orders/{paypal_order_id}'
-            headers = {
-                'Content-type': 'application/json',
-                'Authorization': f'Bearer {get_access_token(PAYPAL_CLIENT_ID, PAYPAL_SECRET_ID)}'
-            }
-            response = requests.get(paypal_api_url, headers=headers)
-            if response.status_code == 200:
-                paypal_order_data = response.json()
-                paypal_payment_status = paypal_order_data['status']
-                if paypal_payment_status == 'COMPLETED':
-                    if order.payment_status == 'Processing':
-                        order.payment_status = "Paid"
-                        order.save()
-                        # Create a notification for the user
-                        api_models.Notification.objects.create(
-                            user=order.student,
-                            order=order,
-                            type="Course Enrollment Completed"
-                        )
-
-                        # Create a notification for ALL teachers in the order
-                        for i in order_items:
-                            api_models.Notification.objects.create(
-                                teacher=i.teacher,
-                                order=order,
-                                order_item=i,
-                                type="New Order"
-                            )
-
-                            api_models.EnrolledCourse.objects.create(
-                                course=i.course,
-                                user=order.student,
-                                teacher=i.teacher,
-                                order_item=i
-                            )
-
-                        return Response({'message': 'Payment Successful'})
-
-                    else:
-                        return Response({'message': 'Already Paid'})
-                else:
-                    return Response({'message': 'Payment Failed'})
-            else:
+            try:
+                paypal_order_data = get_paypal().get_order(paypal_order_id)
+            except PayPalError:
                 return Response({'message': 'PayPal Error Occurred'})
+            if paypal_order_data['status'] == 'COMPLETED':
+                if not paypal_order_matches(order, paypal_order_data):
+                    return Response({'message': 'Payment Failed'}, status=status.HTTP_400_BAD_REQUEST)
+                message, code = fulfill_payment(order, 'paypal', paypal_order_id)
+                return Response({'message': message}, status=code)
+            else:
+                return Response({'message': 'Payment Failed'})
 
         # Stripe Payment success
+        if session_id != 'null' and getattr(settings, 'STRIPE_WEBHOOK_SECRET', ''):
+            return Response({'message': stripe_payment_status(order, session_id)})
+
         if session_id != 'null':
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = get_stripe().checkout.Session.retrieve(session_id)
             if session.payment_status == 'paid':
-                if order.payment_status == 'Processing':
-                    order.payment_status = "Paid"
-                    order.save()
-
-                    api_models.Notification.objects.create(
-                        user=order.student,
-                        order=order,
-                        type="Course Enrollment Completed"
-                    )
-
-                    # Create a notification for ALL teachers in the order
-                    for i in order_items:
-                        api_models.Notification.objects.create(
-                            teacher=i.teacher,
-                            order=order,
-                            order_item=i,
-                            type="New Order"
-                        )
-
-                        api_models.EnrolledCourse.objects.create(
-                            course=i.course,
-                            user=order.student,
-                            teacher=i.teacher,
-                            order_item=i
-                        )
-                    return Response({'message': 'Payment Successful'})
-                else:
-                    return Response({'message': 'Already Paid'})
+                if not stripe_session_matches(order, session_id, session):
+                    return Response({'message': 'Payment Failed'}, status=status.HTTP_400_BAD_REQUEST)
+                message, code = fulfill_payment(order, 'stripe', session_id)
+                return Response({'message': message}, status=code)
             else:
                 return Response({'message': 'Payment Failed'})
+
+
+class StripeWebhookAPIView(APIView):
+    """Stores the events Stripe sends, see api/stripe_events.py"""
+    permission_classes = [AllowAny]
+    # Stripe signs the body, it has no user
+    authentication_classes = []
+
+    def post(self, request, *args, **kwargs):
+        try:
+            receive_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+        except InvalidEvent as e:
+            return Response({'message': f'Invalid event: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'received': True})
@@ -0,0 +1,95 @@
+"""
+Async variants of the payment views, for the ASGI entry point
+(backend/asgi.py). While PayPal or Stripe answer, the worker's event loop
+serves other requests instead of a thread waiting on the socket. The
+database work runs in Django's sync thread through sync_to_async.
+
+DRF views are sync only, these are plain Django views answering the same
+JSON as StripeCheckoutAPIView and PaymentSuccessAPIView.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from api import models as api_models
+from api.payments import PayPalError, StripeAPIError, get_async_paypal, get_async_stripe
+from api.views.order_views import (
+    checkout_session_params, fulfill_payment, paypal_order_matches, stripe_payment_status, stripe_session_matches,
+)
+
+
+def request_data(request):
+    """The JSON or form body, what DRF's request.data reads for these views"""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+    return request.POST
+
+
+@csrf_exempt
+@require_POST
+async def AsyncStripeCheckoutAPIView(request, order_oid):
+    order = await sync_to_async(api_models.CartOrder.objects.filter(oid=order_oid).first)()
+    if not order:
+        return JsonResponse({'message': 'Order Not Found'}, status=404)
+
+    try:
+        checkout_session = await get_async_stripe().create_checkout_session(**checkout_session_params(order))
+    except StripeAPIError as e:
+        return JsonResponse({'message': f'Something went wrong with the payment. Error: {str(e)}'}, status=400)
+
+    order.stripe_session_id = checkout_session['id']
+    await sync_to_async(order.save)(update_fields=['stripe_session_id'])
+    return redirect(checkout_session['url'])
+
+
+@csrf_exempt
+@require_POST
+async def AsyncPaymentSuccessAPIView(request):
+    data = request_data(request)
+    try:
+        order_oid, session_id, paypal_order_id = data['order_oid'], data['session_id'], data['paypal_order_id']
+    except KeyError as e:
+        return JsonResponse({'message': f'{e.args[0]} is required'}, status=400)
+
+    order = await sync_to_async(api_models.CartOrder.objects.filter(oid=order_oid).first)()
+    if not order:
+        return JsonResponse({'message': 'Order Not Found'}, status=404)
+
+    # Paypal payment success
+    if paypal_order_id != 'null':
+        try:
+            paypal_order_data = await get_async_paypal().get_order(paypal_order_id)
+        except PayPalError:
+            return JsonResponse({'message': 'PayPal Error Occurred'})
+        if paypal_order_data['status'] != 'COMPLETED':
+            return JsonResponse({'message': 'Payment Failed'})
+        if not paypal_order_matches(order, paypal_order_data):
+            return JsonResponse({'message': 'Payment Failed'}, status=400)
+        message, code = await sync_to_async(fulfill_payment)(order, 'paypal', paypal_order_id)
+        return JsonResponse({'message': message}, status=code)
+
+    # Stripe Payment success
+    if session_id != 'null' and getattr(settings, 'STRIPE_WEBHOOK_SECRET', ''):
+        return JsonResponse({'message': await sync_to_async(stripe_payment_status)(order, session_id)})
+
+    if session_id != 'null':
+        try:
+            session = await get_async_stripe().retrieve_checkout_session(session_id)
+        except StripeAPIError as e:
+            return JsonResponse({'message': f'Something went wrong with the payment. Error: {str(e)}'}, status=400)
+        if session['payment_status'] != 'paid':
+            return JsonResponse({'message': 'Payment Failed'})
+        if not stripe_session_matches(order, session_id, session):
+            return JsonResponse({'message': 'Payment Failed'}, status=400)
+        message, code = await sync_to_async(fulfill_payment)(order, 'stripe', session_id)
+        return JsonResponse({'message': message}, status=code)
+
+    return JsonResponse({'message': 'No payment given'}, status=400)
@@ -5,6 +5,11 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from api import models as api_models
 from api import serializer as api_serializer
+from api import heartbeats
+from api.fieldsets import FieldSelectionMixin
+from api.pagination import DateCursorPagination, IdCursorPagination, SearchPagination
+from api.progress import toggle_lesson
+from api.search import search_questions
 from ..models import EnrolledCourse
 from ..serializer import EnrolledCourseSerializer
 from ..utils import User, get_user_from_request
@@ -66,7 +71,7 @@ class StudentSummaryAPIViewNoIdPass(generics.ListAPIView):
         return Response(serializer.data)
 
 
-class StudentCourseDetailAPIView(generics.RetrieveAPIView):
+class StudentCourseDetailAPIView(FieldSelectionMixin, generics.RetrieveAPIView):
     serializer_class = api_serializer.EnrolledCourseSerializer
     permission_classes = [AllowAny]
     lookup_field = 'enrollment_id'
@@ -81,7 +86,9 @@ class StudentCourseDetailAPIView(generics.RetrieveAPIView):
         if not user or not enrollment_id:
             return []
         else:
-            return api_models.EnrolledCourse.objects.get(user=user, enrollment_id=enrollment_id)
+            return api_models.EnrolledCourse.objects.filter(
+                user=user, enrollment_id=enrollment_id
+            ).for_serializer(self.field_selection).get()
 
 
 class StudentCourseCompletedCreateAPIView(generics.CreateAPIView):
@@ -93,7 +100,7 @@ class StudentCourseCompletedCreateAPIView(generics.CreateAPIView):
     }
     """
 
-    serializer_class = api_serializer.CompletedLessonSerializer
+    serializer_class = api_serializer.CompletedLessonWriteSerializer
     permission_classes = [AllowAny]
 
     def create(self, request, *args, **kwargs):
@@ -104,19 +111,84 @@ class StudentCourseCompletedCreateAPIView(generics.CreateAPIView):
         course_id = request.data['course_id']
         variant_item_id = request.data['variant_item_id']
 
-        course = api_models.Course.objects.get(id=course_id)
-        variant_item = api_models.VariantItem.objects.get(variant_item_id=variant_item_id)
+        course = api_models.Course.objects.filter(id=course_id).first()
+        if not course:
+            return Response({'message': 'Course not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Only a lecture of this course, its ordinal is a bit of this course's bitmaps
+        variant_item = api_models.VariantItem.objects.select_related('variant').filter(
+            variant_item_id=variant_item_id, variant__course=course).first()
+        if not variant_item:
+            return Response({'message': 'Lecture not found in this course'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Flips the lecture's bit in the enrollment's bitmap (api/progress.py)
+        if toggle_lesson(user, course, variant_item):
+            return Response({'message': 'Lesson completed'}, status=status.HTTP_201_CREATED)
+        return Response({'message': 'Lesson not completed'}, status=status.HTTP_201_CREATED)
 
-        completed_lessons = api_models.CompletedLesson.objects.filter(user=user, course=course,
-                                                                      variant_item=variant_item).first()
 
-        if completed_lessons:
-            completed_lessons.delete()
-            return Response({'message': 'Lesson not completed'}, status=status.HTTP_201_CREATED)
+class StudentLectureProgressAPIView(generics.GenericAPIView):
+    """
+    Video heartbeats, sent by the player every few seconds while a lecture
+    plays. They are buffered in memory and written in bulk (api/heartbeats.py).
+    POST:
+    {
+        "enrollment_id": 691623,
+        "variant_item_id": 767990,
+        "position": 312.5,
+        "duration": 640
+    }
+    "duration" (seconds) is only used until the lecture's own is probed.
+    GET student/lecture-progress/<enrollment_id>/ returns where the student
+    is in every lecture started.
+    """
+    serializer_class = api_serializer.LectureHeartbeatSerializer
+    permission_classes = [AllowAny]
 
-        else:
-            api_models.CompletedLesson.objects.create(user=user, course=course, variant_item=variant_item)
-            return Response({'message': 'Lesson completed'}, status=status.HTTP_201_CREATED)
+    def post(self, request, *args, **kwargs):
+        user = get_user_from_request(request)
+        if not user:
+            return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        lecture = heartbeats.watched_lecture(user, data['enrollment_id'], data['variant_item_id'])
+        if lecture is None:
+            return Response({'message': 'Lecture not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        enrollment_id, variant_item_id, lecture_duration = lecture
+        heartbeats.buffer.add(enrollment_id, variant_item_id, data['position'], lecture_duration or data['duration'])
+        return Response({'message': 'Progress received'}, status=status.HTTP_202_ACCEPTED)
+
+    def get(self, request, *args, **kwargs):
+        user = get_user_from_request(request)
+        if not user:
+            return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        enrollment = api_models.EnrolledCourse.objects.filter(
+            user=user, enrollment_id=self.kwargs['enrollment_id']).values_list('id', flat=True).first()
+        if enrollment is None:
+            return Response({'message': 'Enrollment not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        lectures = {
+            variant_item_id: {'variant_item_id': public_id, 'position': position, 'furthest': furthest, 'date': date}
+            for variant_item_id, public_id, position, furthest, date in api_models.LectureProgress.objects.filter(
+                enrollment_id=enrollment,
+            ).values_list('variant_item_id', 'variant_item__variant_item_id', 'position', 'furthest', 'date')
+        }
+        # Heartbeats not written yet are newer
+        pending = heartbeats.buffer.pending(enrollment)
+        public_ids = dict(api_models.VariantItem.objects.filter(
+            id__in=set(pending) - set(lectures)).values_list('id', 'variant_item_id')) if pending else {}
+        for variant_item_id, beat in pending.items():
+            lecture = lectures.get(variant_item_id)
+            if lecture is None:
+                if variant_item_id not in public_ids:
+                    continue
+                lecture = lectures[variant_item_id] = {'variant_item_id': public_ids[variant_item_id], 'furthest': 0}
+            lecture.update(position=beat.position, furthest=max(lecture['furthest'], beat.furthest), date=beat.date)
+        return Response(sorted(lectures.values(), key=lambda lecture: lecture['date'], reverse=True))
 
 
 class StudentNoteCreateAPIView(generics.ListCreateAPIView):
@@ -136,6 +208,7 @@ class StudentNoteCreateAPIView(generics.ListCreateAPIView):
 
     serializer_class = api_serializer.NoteSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
         user = get_user_from_request(self.request)
@@ -208,7 +281,7 @@ class StudentRateCourseCreateAPIView(generics.CreateAPIView):
     }
     OPTIONAL: "active": true
     """
-    serializer_class = api_serializer.ReviewSerializer
+    serializer_class = api_serializer.ReviewWriteSerializer
     permission_classes = [AllowAny]
 
     def create(self, request, *args, **kwargs):
@@ -249,6 +322,12 @@ class StudentRateCourseUpdateAPIView(generics.RetrieveUpdateAPIView):
 class StudentWishListListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = api_serializer.WishlistSerializer
     permission_classes = [AllowAny]
+    pagination_class = IdCursorPagination
+
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return api_serializer.WishlistWriteSerializer
+        return api_serializer.WishlistSerializer
 
     def get_queryset(self):
         user = get_user_from_request(self.request)
@@ -282,10 +361,18 @@ class QuestionAndAnswerListAPIView(generics.ListCreateAPIView):
     serializer_class = api_serializer.QuestionAnswerSerializer
     permission_classes = [AllowAny]
 
+    @property
+    def pagination_class(self):
+        # ?search= results are ranked, they are paged by number
+        return SearchPagination if self.request.query_params.get('search', '').strip() else DateCursorPagination
+
     def get_queryset(self):
         course_id = self.kwargs['course_id']
         course = api_models.Course.objects.get(id=course_id)
-        return api_models.QuestionAnswer.objects.filter(course=course)
+        questions = api_models.QuestionAnswer.objects.filter(course=course)
+        # ?search= ranks the questions by similarity, typos included
+        search = self.request.query_params.get('search', '').strip()
+        return search_questions(questions, search) if search else questions
 
     def create(self, request, *args, **kwargs):
         user = get_user_from_request(self.request)
@@ -341,13 +428,33 @@ class QuestionAnswerMessageSendAPIView(generics.CreateAPIView):
         return Response({"message": "Message sent", "question": question_serializer.data})
 
 
-class EnrolledCoursesAPIView(generics.ListAPIView):
+class EnrolledCoursesAPIView(FieldSelectionMixin, generics.ListAPIView):
     serializer_class = EnrolledCourseSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
         user = get_user_from_request(self.request)
         if user:
-            return EnrolledCourse.objects.filter(user=user)
+            return EnrolledCourse.objects.filter(user=user).for_serializer(self.field_selection)
         else:
             return EnrolledCourse.objects.none()
+
+
+class EnrolledCourseCardsAPIView(generics.ListAPIView):
+    """
+    The student dashboard: one small card per enrolled course with its
+    progress, computed in the query of the page. The full enrollment is at
+    student/course-detail/<enrollment_id>/.
+    """
+    serializer_class = api_serializer.EnrolledCourseCardSerializer
+    permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
+
+    def get_queryset(self):
+        user = get_user_from_request(self.request)
+        if not user:
+            return EnrolledCourse.objects.none()
+        return EnrolledCourse.objects.filter(user=user).with_progress().only(
+            'enrollment_id', 'date', 'course__id', 'course__slug', 'course__title', 'course__image',
+        )
@@ -1,17 +1,67 @@
-import operator
-
-from django.db.models.functions import ExtractMonth
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import generics, viewsets
 from rest_framework.permissions import AllowAny
 
 from api import models as api_models
-from api.utils import generate_random_otp, get_user_from_request
-from userauths.models import User, Profile
+from api.fieldsets import FieldSelectionMixin
+from api.pagination import DateCursorPagination, SearchPagination, TeacherStudentCursorPagination
+from api.revenue import (GRANULARITIES, earnings_buckets, teacher_course_revenue, teacher_revenue,
+                         teacher_revenue_series)
+from api.search import search_questions
+from api.utils import get_teacher_from_request
+from userauths.models import Profile
 from api import serializer as api_serializer
-from datetime import datetime, timedelta
-from django.db import models
+from datetime import date, datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+MAX_EARNINGS_RANGE_DAYS = 366 * 20
+# The earnings buckets step one period past the range, and the default
+# range starts a year before it: both must stay within datetime.date
+EARNINGS_YEARS = range(1900, 9999)
+
+
+def parse_query_date(value, name):
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: 'Expected an ISO date (YYYY-MM-DD)'})
+    if day.year not in EARNINGS_YEARS:
+        raise ValidationError({name: f'Expected a year from {EARNINGS_YEARS[0]} to {EARNINGS_YEARS[-1]}'})
+    return day
+
+
+def parse_since(value):
+    if not value:
+        return None
+    since = parse_datetime(value)
+    if since is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({'since': 'Expected an ISO date or datetime'})
+        since = datetime.combine(day, time.min)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def teacher_students(teacher, since=None):
+    """
+    Profiles of the distinct students enrolled in the teacher's courses.
+    Deduplication happens in the database through an IN (subquery), so
+    the cost doesn't depend on how many enrollments each student has.
+    """
+    enrollments = api_models.EnrolledCourse.objects.filter(teacher=teacher)
+    if since is not None:
+        enrollments = enrollments.filter(date__gte=since)
+    return Profile.objects.filter(user__in=enrollments.values('user'))
 
 
 class TeacherSummaryAPIView(generics.ListAPIView):
@@ -19,44 +69,21 @@ class TeacherSummaryAPIView(generics.ListAPIView):
     permission_classes = [AllowAny]
 
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
-        one_month_ago = datetime.today() - timedelta(days=28)
+        one_month_ago = timezone.localdate() - timedelta(days=28)
 
         total_courses = api_models.Course.objects.filter(teacher=teacher).count()
 
-        total_revenue = \
-            api_models.CartOrderItem.objects.filter(teacher=teacher, order__payment_status='Paid').aggregate(
-                total_revenue=models.Sum('price'))['total_revenue'] or 0
-
-        monthly_revenue = api_models.CartOrderItem.objects.filter(teacher=teacher, order__payment_status='Paid',
-                                                                  date__gte=one_month_ago).aggregate(
-            total_revenue=models.Sum('price'))['total_revenue'] or 0
-
-        enrolled_course = api_models.EnrolledCourse.objects.filter(teacher=teacher)
-        unique_student_ids = set()
-        total_students = []
-
-        for course in enrolled_course:
-            if course.user_id not in unique_student_ids:
-                user = User.objects.get(id=course.user_id)
-                student = {
-                    'full_name': user.profile.full_name,
-                    'image': user.profile.image.url,
-                    'country': user.profile.country,
-                    'date': user.profile.date,
-                }
-                total_students.append(student)
-                unique_student_ids.add(course.user_id)
+        # Both revenue figures come from the daily rollup
+        total_revenue = teacher_revenue(teacher)
+        monthly_revenue = teacher_revenue(teacher, since=one_month_ago)
+
+        total_students = teacher_students(teacher).count()
+
         return [{
             'total_courses': total_courses,
-            'total_students': len(total_students),
+            'total_students': total_students,
             'total_revenue': total_revenue,
             'monthly_revenue': monthly_revenue,
         }]
@@ -67,36 +94,26 @@ class TeacherSummaryAPIView(generics.ListAPIView):
         return Response(serializer.data)
 
 
-class TeacherCourseListAPIView(generics.ListAPIView):
+class TeacherCourseListAPIView(FieldSelectionMixin, generics.ListAPIView):
     serializer_class = api_serializer.CourseSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
-        return api_models.Course.objects.filter(teacher=teacher)
+        return api_models.Course.objects.filter(teacher=teacher).for_serializer(self.field_selection)
 
 
 class TeacherReviewListAPIView(generics.ListAPIView):
     serializer_class = api_serializer.ReviewSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
-        return api_models.Review.objects.filter(course__teacher=teacher)
+        return api_models.Review.objects.filter(teacher=teacher)
 
 
 class TeacherReviewDetailAPIView(generics.RetrieveUpdateAPIView):
@@ -104,103 +121,103 @@ class TeacherReviewDetailAPIView(generics.RetrieveUpdateAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
+        teacher = get_teacher_from_request(self.request)
         review_id = self.kwargs['review_id']
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
 
         return api_models.Review.objects.get(course__teacher=teacher, id=review_id)
 
 
-class TeacherStudentsListAPIView(viewsets.ViewSet):
+class TeacherStudentsListAPIView(viewsets.GenericViewSet):
+    """
+    Distinct students of the teacher, newest first.
+    Query params:
+        since: only students enrolled on or after this date (ISO format)
+        cursor / limit: keyset pagination
+    """
+    serializer_class = api_serializer.TeacherStudentSerializer
+    pagination_class = TeacherStudentCursorPagination
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        teacher = get_teacher_from_request(self.request)
+        return teacher_students(teacher, since=parse_since(self.request.query_params.get('since')))
 
     def list(self, request):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
-
-        enrolled_course = api_models.EnrolledCourse.objects.filter(teacher=teacher)
-        unique_student_ids = set()
-        total_students = []
-
-        for course in enrolled_course:
-            if course.user_id not in unique_student_ids:
-                user = User.objects.get(id=course.user_id)
-                student = {
-                    'full_name': user.profile.full_name,
-                    'image': user.profile.image.url,
-                    'country': user.profile.country,
-                    'date': user.profile.date,
-                }
-                total_students.append(student)
-                unique_student_ids.add(course.user_id)
-
-        return Response(total_students)
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 @api_view(('GET',))
 def TeacherAllMonthsEarningAPIView(request):
-    user = get_user_from_request(request)
-    if user:
-        teacher = api_models.Teacher.objects.filter(user=user).first()
-        if not teacher:
-            raise ValueError('No teacher found')
-    else:
-        raise ValueError('No user found')
-
-    # teacher = api_models.Teacher.objects.get(id=teacher_id)
-
-    monthly_earning_tracker = (
-        api_models.CartOrderItem.objects
-        .filter(teacher=teacher, order__payment_status='Paid')
-        .annotate(
-            month=ExtractMonth('date')
-        )
-        .values('month')
-        .annotate(
-            total_earning = models.Sum('price')
-        )
-        .order_by('month')
-    )
+    """
+    Earnings per month of one year (?year=, defaults to the current one).
+    Months without sales are returned with a 0 total.
+    """
+    teacher = get_teacher_from_request(request)
+
+    year = request.query_params.get('year') or timezone.localdate().year
+    try:
+        year = int(year)
+    except ValueError:
+        raise ValidationError({'year': 'Expected a year'})
+    if year not in EARNINGS_YEARS:
+        raise ValidationError({'year': f'Expected a year from {EARNINGS_YEARS[0]} to {EARNINGS_YEARS[-1]}'})
+    start = date(year, 1, 1)
+
+    buckets = earnings_buckets(teacher_revenue_series(teacher), start, date(year, 12, 31), 'month')
+    monthly_earning_tracker = [
+        {'year': year, 'month': bucket['period'].month, 'total_earning': bucket['total_earning']}
+        for bucket in buckets
+    ]
 
     return Response(monthly_earning_tracker)
 
 
+@api_view(('GET',))
+def TeacherEarningsAPIView(request):
+    """
+    Zero-filled earnings time series.
+    Query params:
+        from / to: ISO dates, both inclusive (defaults to the last 365 days)
+        granularity: day | week | month | year (defaults to month)
+    """
+    teacher = get_teacher_from_request(request)
+
+    to_date = parse_query_date(request.query_params.get('to'), 'to') or timezone.localdate()
+    from_date = parse_query_date(request.query_params.get('from'), 'from') or to_date - timedelta(days=365)
+    granularity = request.query_params.get('granularity', 'month')
+
+    if granularity not in GRANULARITIES:
+        raise ValidationError({'granularity': f'Expected one of {", ".join(GRANULARITIES)}'})
+    if from_date > to_date:
+        raise ValidationError({'from': 'from must not be after to'})
+    if (to_date - from_date).days > MAX_EARNINGS_RANGE_DAYS:
+        raise ValidationError({'from': f'The range can be at most {MAX_EARNINGS_RANGE_DAYS} days'})
+
+    return Response({
+        'from': from_date,
+        'to': to_date,
+        'granularity': granularity,
+        'results': earnings_buckets(teacher_revenue_series(teacher), from_date, to_date, granularity),
+    })
+
+
 class TeacherBestSellingCourseAPIView(viewsets.ViewSet):
 
     def list(self, request):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
-
-        courses_with_total_price = []
-        courses = api_models.Course.objects.filter(teacher=teacher)
-
-        for course in courses:
-            revenue = course.enrolledcourse_set.aggregate(total_price=models.Sum('order_item__price'))['total_price'] or 0
-            sales = course.enrolledcourse_set.count()
-
-            courses_with_total_price.append({
+        teacher = get_teacher_from_request(self.request)
+
+        courses_with_total_price = [
+            {
                 'course_image': course.image.url,
                 'course_title': course.title,
-                'revenue': revenue,
-                'sales': sales,
-            })
-
-        # Sort courses by revenue in descending order
-        courses_with_total_price.sort(key=operator.itemgetter('revenue'), reverse=True)
+                'revenue': course.revenue,
+                'sales': course.sales,
+            }
+            # Sorted by revenue in descending order by the query
+            for course in teacher_course_revenue(teacher)
+        ]
 
         return Response(courses_with_total_price)
 
@@ -208,15 +225,10 @@ class TeacherBestSellingCourseAPIView(viewsets.ViewSet):
 class TeacherCourseOrdersListAPIView(generics.ListAPIView):
     serializer_class = api_serializer.CartOrderItemSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         return api_models.CartOrderItem.objects.filter(teacher=teacher)
 
@@ -225,41 +237,31 @@ class TeacherQuestionAnswerListAPIView(generics.ListAPIView):
     serializer_class = api_serializer.QuestionAnswerSerializer
     permission_classes = [AllowAny]
 
+    @property
+    def pagination_class(self):
+        # ?search= results are ranked, they are paged by number
+        return SearchPagination if self.request.query_params.get('search', '').strip() else DateCursorPagination
+
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
-        return api_models.QuestionAnswer.objects.filter(course__teacher=teacher)
+        questions = api_models.QuestionAnswer.objects.filter(teacher=teacher)
+        search = self.request.query_params.get('search', '').strip()
+        return search_questions(questions, search) if search else questions
 
 
 class TeacherCouponListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = api_serializer.CouponSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         return api_models.Coupon.objects.filter(teacher=teacher)
 
     def perform_create(self, serializer):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         serializer.save(teacher=teacher)
 
@@ -270,13 +272,7 @@ class TeacherCouponDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         coupon_id = self.kwargs['coupon_id']
         return api_models.Coupon.objects.get(teacher=teacher, id=coupon_id)
@@ -285,15 +281,10 @@ class TeacherCouponDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 class TeacherNotificationListAPIView(generics.ListAPIView):
     serializer_class = api_serializer.NotificationSerializer
     permission_classes = [AllowAny]
+    pagination_class = DateCursorPagination
 
     def get_queryset(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         return api_models.Notification.objects.filter(teacher=teacher)
 
@@ -303,13 +294,7 @@ class TeacherNotificationDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [AllowAny]
 
     def get_object(self):
-        user = get_user_from_request(self.request)
-        if user:
-            teacher = api_models.Teacher.objects.filter(user=user).first()
-            if not teacher:
-                raise ValueError('No teacher found')
-        else:
-            raise ValueError('No user found')
+        teacher = get_teacher_from_request(self.request)
 
         notification_id = self.kwargs['notification_id']
 
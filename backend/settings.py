@@ -86,6 +86,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user from the JWT cookie when the session has none, resolved lazily
+    'api.middleware.TokenUserMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -120,6 +122,10 @@ DATABASES = {
     }
 }
 
+# The pg_trgm lookups of the fuzzy search (api/search/fuzzy.py)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -163,6 +169,28 @@ MEDIA_URL = '/media/'  # URL to access media files
 
 MEDIA_ROOT = BASE_DIR / 'media'  # Root directory for media files
 
+# Lecture durations are probed in a background process pool (api/media.py)
+MEDIA_PROBE_WORKERS = 2
+MEDIA_PROBE_MAX_RETRIES = 3
+MEDIA_PROBE_RETRY_DELAY = 5  # seconds, doubled on every retry
+
+# Best courses snapshot (api/ranking.py), refresh it from cron with
+# `manage.py refresh_best_courses`. It's also rebuilt after this many
+# review changes in a process.
+BEST_COURSES_SNAPSHOT_SIZE = 20
+BEST_COURSES_PRIOR_WEIGHT = 10  # every course starts with this many reviews at the platform average
+BEST_COURSES_REFRESH_REVIEWS = 25
+
+# The in-memory course search catalog (api/search) is rebuilt in the
+# background when it's older than this many seconds
+SEARCH_INDEX_MAX_AGE = 15 * 60
+AUTOCOMPLETE_MAX_RESULTS = 10
+# Misspelled searches: minimum trigram similarity (0-1) of a match, and
+# the number of matches ranked. pg_trgm's 0.3 misses a swap of two letters
+# in a short word, "pyhton" is 0.27 similar to "python".
+SEARCH_FUZZY_THRESHOLD = 0.25
+SEARCH_FUZZY_MAX_RESULTS = 500
+
 AUTH_USER_MODEL = 'userauths.User'
 
 # Default primary key field type
@@ -233,6 +261,28 @@ JAZZMIN_UI_TWEAKS = {
     }
 }
 
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.CookieJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+# Video heartbeats (api/heartbeats.py) are kept in memory and written in
+# bulk every HEARTBEAT_FLUSH_INTERVAL seconds, or once this many lectures
+# are pending. A lecture watched up to this fraction is marked completed.
+HEARTBEAT_FLUSH_INTERVAL = 5
+HEARTBEAT_FLUSH_SIZE = 500
+HEARTBEAT_COMPLETE_FRACTION = 0.9
+
+# Cursor pagination of the list endpoints (api/pagination.py), ?limit= up to the max
+LIST_PAGE_SIZE = 20
+LIST_MAX_PAGE_SIZE = 100
+
+# Number of verified JWTs kept in memory per process
+AUTH_TOKEN_CACHE_SIZE = 1024
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=90),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=50),
@@ -283,12 +333,37 @@ DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL')
 EMAIL_BACKEND = env('EMAIL_BACKEND')
 
 STRIPE_SECRET_KEY = env('STRIPE_SECRET_KEY')
+# The Stripe API (a local fake server in `manage.py payment_load_test`), and
+# the timeout in seconds and retries of the async views' client
+STRIPE_API_URL = env('STRIPE_API_URL', default='https://api.stripe.com')
+STRIPE_TIMEOUT = 30
+STRIPE_MAX_RETRIES = 2
+# Signing secret of the webhook endpoint (payment/stripe-webhook/). When set,
+# the received events fulfill the orders (api/stripe_events.py) and the
+# payment success endpoint only reads the order's status. Events older than
+# the tolerance (seconds) are refused; a failing event is retried up to
+# STRIPE_EVENT_MAX_ATTEMPTS times, every STRIPE_EVENT_INTERVAL seconds.
+STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET', default='')
+STRIPE_WEBHOOK_TOLERANCE = 300
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+STRIPE_EVENT_INTERVAL = 5
 
 PAYPAL_CLIENT_ID = env('PAYPAL_CLIENT_ID')
 PAYPAL_SECRET_ID = env('PAYPAL_SECRET_ID')
+# REST API of api.payments.PayPalClient (the sandbox, or a local stub in
+# tests), the timeout of every call in seconds, and the retries of
+# connection errors, 429 and 5xx
+PAYPAL_API_URL = env('PAYPAL_API_URL', default='https://api-m.sandbox.paypal.com')
+PAYPAL_TIMEOUT = 10
+PAYPAL_MAX_RETRIES = 3
 
 FRONT_END_ROUTE_URL = env('FRONT_END_ROUTE_URL')
 
+# Checked by `manage.py import_benchmark`: worker boot import time, and the
+# packages that must only be imported on first use (requests comes with anymail)
+STARTUP_IMPORT_BUDGET_MS = 1000
+STARTUP_LAZY_IMPORTS = ['moviepy', 'numpy', 'imageio', 'stripe', 'httpx']
+
 
 ANYMAIL = {
     "MAILGUN_API_KEY": env('MAILGUN_API_KEY'),